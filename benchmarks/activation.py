@@ -0,0 +1,39 @@
+import argparse
+import time
+from src.blip import BlipCaptionModel
+from src.joytag import JoyTagModel
+from src.weights_cache import WeightsCache
+
+
+def timed_activate(model) -> float:
+    t0 = time.perf_counter()
+    model.activate()
+    secs = time.perf_counter() - t0
+    model.deactivate()
+    return secs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Model activation: original weights vs converted weights cache')
+    parser.add_argument('--models', nargs='+', default=['joytag', 'blip'], choices=['joytag', 'blip'])
+    args = parser.parse_args()
+
+    factories = {
+        'joytag': lambda cache: JoyTagModel(use_weights_cache=cache),
+        'blip': lambda cache: BlipCaptionModel(use_weights_cache=cache),
+    }
+    for name in args.models:
+        make = factories[name]
+        baseline = timed_activate(make(False))
+
+        model = make(True)
+        WeightsCache(model.model_dir, model.weights_dtype).invalidate()
+        cold = timed_activate(model)
+        warm = timed_activate(make(True))
+
+        print(f'{name}: original {baseline:.2f}s | cold (convert) {cold:.2f}s | warm (mapped) {warm:.2f}s'
+              f' | speedup {baseline / warm:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from PIL import Image
+import numpy as np
+import torch
+
+TARGET_SIZE = 224
+
+
+def make_model_class():
+    from src.images import MAX_DECODE_BYTES, load_image, prepare_image
+    from src.models import TaskModel
+
+    class ConvModel(TaskModel):
+        # a small CNN on the CPU plus a fixed cost per call standing in for launch and transfer overhead,
+        # optionally failing like a GPU that runs out of memory past a batch size
+        max_batch = 64
+
+        def __init__(self, model_dir: Path, call_secs: float, oom_at: int = 0):
+            self._model = None
+            self.model_name = 'conv'
+            self.model_dir = model_dir
+            self.device = torch.device('cpu')
+            self.max_decode_bytes = MAX_DECODE_BYTES
+            self.call_secs = call_secs
+            self.oom_at = oom_at
+            self.batches = []
+
+        def activate(self):
+            torch.manual_seed(0)
+            self._model = torch.nn.Sequential(
+                torch.nn.Conv2d(3, 32, 3, stride=2), torch.nn.ReLU(),
+                torch.nn.Conv2d(32, 64, 3, stride=2), torch.nn.ReLU(),
+                torch.nn.Conv2d(64, 128, 3, stride=2), torch.nn.ReLU(),
+                torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten(), torch.nn.Linear(128, 1000),
+            ).eval()
+
+        def process_batch(self, sources):
+            self.batches.append(len(sources))
+            if self.oom_at and len(sources) >= self.oom_at:
+                raise torch.cuda.OutOfMemoryError('CUDA out of memory (simulated)')
+            x = torch.stack([prepare_image(load_image(s, TARGET_SIZE), TARGET_SIZE) for s in sources])
+            with torch.inference_mode():
+                y = self._model(x)
+            time.sleep(self.call_secs)
+            return [int(v.argmax()) for v in y]
+
+        def process(self, source):
+            return self.process_batch([source])[0]
+
+    return ConvModel
+
+
+def make_images(folder: Path, count: int):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        small = rng.integers(0, 255, size=(8, 8, 3), dtype=np.uint8)
+        path = folder / f'img_{i:05d}.jpg'
+        Image.fromarray(small).resize((256, 256), Image.BILINEAR).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def run(paths, model, tune: bool):
+    from src.workers import AIWorker, ImageTask
+    worker = AIWorker([model], tune_batches=tune)
+    results = []
+    worker.signals.result.connect(results.append)
+    t0 = time.perf_counter()
+    for p in paths:
+        worker.put(ImageTask(id=p.name, path=p))
+    worker.put(None)
+    worker.run()
+    secs = time.perf_counter() - t0
+    errors = [r['error'] for r in results if 'error' in r]
+    assert len(results) == len(paths) and not errors, errors[:3]
+    # the size most batches ran at, when the run ends the tuner may be trying a larger one again after a cap lifted
+    return len(paths) / secs, Counter(model.batches).most_common(1)[0][0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='AIWorker throughput with fixed and self-tuned batch sizes')
+    parser.add_argument('--images', type=int, default=1500)
+    parser.add_argument('--oom-at', type=int, default=8)
+    parser.add_argument('--call-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    ConvModel = make_model_class()
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp) / 'images'
+        folder.mkdir()
+        paths = make_images(folder, args.images)
+        model_dir = Path(tmp) / 'model'
+        oom_dir = Path(tmp) / 'oom-model'
+        call = args.call_ms / 1000
+        print(f'{args.images} images, {TARGET_SIZE}px, {args.call_ms:.0f} ms per call, '
+              f'torch threads {torch.get_num_threads()}')
+
+        rate, size = run(paths, ConvModel(model_dir, call), tune=False)
+        print(f'batch 1 (untuned)          : {rate:6.1f} images/s')
+        rate, size = run(paths, ConvModel(model_dir, call), tune=True)
+        print(f'tuning from 1              : {rate:6.1f} images/s, settled at {size}')
+        rate, size = run(paths, ConvModel(model_dir, call), tune=True)
+        print(f'stored size                : {rate:6.1f} images/s, batch {size}')
+
+        model = ConvModel(oom_dir, call, oom_at=args.oom_at)
+        rate, size = run(paths, model, tune=True)
+        print(f'out of memory at {args.oom_at:<10}: {rate:6.1f} images/s, settled at {size}, '
+              f'{sum(1 for b in model.batches if b >= args.oom_at)} batches retried')
+
+
+if __name__ == '__main__':
+    main()
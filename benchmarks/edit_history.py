@@ -0,0 +1,157 @@
+import argparse
+import json
+import random
+import shutil
+import tempfile
+from pathlib import Path
+from PySide6.QtCore import QCoreApplication
+
+TAGS = list('abcdefgh')
+
+
+def make_index(root: Path, images: int, rng: random.Random) -> None:
+    files = {}
+    for i in range(images):
+        id = f'i{i}.jpg'
+        props = {'_tags': [f'{t} ({rng.randint(10, 99)}.00%)' for t in rng.sample(TAGS, rng.randint(0, 4))]}
+        if rng.random() < 0.5:
+            props['tags'] = [rng.choice(TAGS) for _ in range(rng.randint(0, 4))]
+        files[id] = {'__type__': 'ImageFile', 'id': id, 'path': str(root / id), 'status': 'done', 'properties': props}
+    with (root / 'tags_index.json').open('w', encoding='utf-8') as f:
+        json.dump({'root': str(root), 'files': files}, f)
+
+
+def tag_data(files) -> dict:
+    return {id: (img.effective_tags(), img['_tags']) for id, img in files.items()}
+
+
+def stats_of(stats) -> tuple:
+    names = stats._names
+    counts = {names[t]: c for t, c in stats.counts.items() if c}
+    postings = {names[t]: frozenset(ids) for t, ids in stats._postings.items() if ids}
+    cooc = {frozenset((names[k >> 32], names[k & 0xFFFFFFFF])): c for k, c in stats.cooc.items() if c}
+    return counts, postings, cooc
+
+
+def check_reload(c, tmp: Path) -> None:
+    # what a crash right now would leave: the last snapshot plus the log, read through either index file
+    from src.editlog import EditLog
+    from src.filestore import TagVocab
+    from src.storage import columns_path, load_index
+    if c.compact_worker is not None:
+        c.compact_worker.wait()
+        QCoreApplication.processEvents()
+    live = tag_data(c.database['files'])
+    for binary in (True, False):
+        copy = tmp / 'reload'
+        shutil.rmtree(copy, ignore_errors=True)
+        copy.mkdir()
+        for p in c.root.glob('tags_index.*'):
+            shutil.copy(p, copy / p.name)
+        if not binary:
+            columns_path(copy / 'tags_index.json').unlink(missing_ok=True)
+        data = load_index(copy / 'tags_index.json', TagVocab())
+        EditLog(copy / 'tags_index.log').replay(data['files'], data.get('log_seq', 0))
+        # images deleted on disk since the snapshot come back with it, the next scan drops them
+        got = tag_data(data['files'])
+        assert {id: got.get(id) for id in live} == live, f'reload from {"npz" if binary else "json"} differs'
+
+
+def run(seed: int, images: int, steps: int, tmp: Path) -> None:
+    from src.batch_controller import BatchController
+    from src.tagstats import TagStats
+    from src.workspace import Workspace
+    rng = random.Random(seed)
+    root = tmp / f'root{seed}'
+    root.mkdir()
+    make_index(root, images, rng)
+    c = BatchController(None)
+    c.workspace = Workspace(tmp / 'workspace.json')
+    c.start_tasks(root)
+    c.stop_tasks()
+    files = c.database['files']
+
+    # expected tag data after each logged edit, the last entries are what redo brings back
+    states = [tag_data(files)]
+    at = 0
+    trace = []
+    for _ in range(steps):
+        ids = sorted(files)
+        logged = len(c.edit_log._undo)
+        pick = rng.random()
+        if pick < 0.15 and ids:
+            id = rng.choice(ids)
+            step = ('add', id)
+            c.add_tag(id, rng.choice(TAGS))
+        elif pick < 0.3 and ids:
+            id = rng.choice(ids)
+            step = ('rm', id)
+            c.remove_tag(id, rng.randrange(max(1, len(files[id].edit_tags()))))
+        elif pick < 0.35 and ids:
+            id = rng.choice(ids)
+            step = ('dedupe', id)
+            c.remove_duplicate_tags(id)
+        elif pick < 0.45:
+            a, b = rng.sample(TAGS, 2)
+            step = ('ren', a, b)
+            c.rename_tag(a, b)
+        elif pick < 0.55:
+            sources, target = rng.sample(TAGS, 2), rng.choice(TAGS)
+            step = ('merge', sources, target)
+            c.merge_tags(sources, target)
+        elif pick < 0.6:
+            step = ('delete_tag',)
+            c.delete_tag(rng.choice(TAGS))
+        elif pick < 0.75:
+            step = ('undo',)
+            if c.undo() is not None:
+                at -= 1
+        elif pick < 0.85:
+            step = ('redo',)
+            if c.redo() is not None:
+                at += 1
+        elif pick < 0.9:
+            step = ('save',)
+            QCoreApplication.processEvents()
+            c.save()
+        elif pick < 0.95 and ids:
+            # not logged and never undone, every expected state loses the image
+            id = rng.choice(ids)
+            step = ('del', id)
+            c.on_watch_deleted(root / id)
+            for s in states:
+                s.pop(id, None)
+        else:
+            step = ('reload',)
+            check_reload(c, tmp)
+        trace.append(step)
+
+        now = tag_data(files)
+        if step[0] not in ('undo', 'redo') and len(c.edit_log._undo) > logged:
+            states[at + 1:] = [now]
+            at += 1
+        assert now == states[at], f'seed {seed}: tags differ after {trace}'
+        c.tag_stats.top()
+        fresh = TagStats()
+        fresh.rebuild(files)
+        assert stats_of(c.tag_stats) == stats_of(fresh), f'seed {seed}: stats differ from a rebuild after {trace}'
+    check_reload(c, tmp)
+    c.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Random edits, undo, redo and saves checked against snapshots')
+    parser.add_argument('--runs', type=int, default=40)
+    parser.add_argument('--images', type=int, default=8)
+    parser.add_argument('--steps', type=int, default=60)
+    args = parser.parse_args()
+
+    app = QCoreApplication([])  # noqa: F841  queued signals need an application
+    with tempfile.TemporaryDirectory() as tmp:
+        for seed in range(args.runs):
+            run(seed, args.images, args.steps, Path(tmp))
+    print(f'{args.runs} runs of {args.steps} steps on {args.images} images match their snapshots and a rebuild')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import gc
+import json
+import multiprocessing as mp
+import random
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+VOCAB_SIZE = 5000
+
+
+def make_index(path: Path, count: int, tags_per_image: int) -> None:
+    rng = random.Random(0)
+    vocab = [f'tag_{i}' for i in range(VOCAB_SIZE)]
+    files = {}
+    for i in range(count):
+        id = f'set_{i // 1000}/img_{i:07d}.jpg'
+        tags = rng.sample(vocab, tags_per_image)
+        props = {
+            '_tags': [f'{t} ({rng.uniform(40, 100):.2f}%)' for t in tags],
+            '_caption': [f'a photo of {tags[0]} and {tags[1]}'],
+            '_phash': f'{rng.getrandbits(64):016x}',
+        }
+        if i % 10 == 0:
+            props['tags'] = [t for t in tags[:-1]]
+        files[id] = {'__type__': 'ImageFile', 'id': id, 'path': f'/data/{id}', 'status': 'done', 'properties': props}
+    with path.open('w', encoding='utf-8') as f:
+        json.dump({'root': '/data', 'files': files}, f)
+
+
+def legacy_load(path: Path):
+    # the loader before the columnar store: one ImageFile, Path and properties dict per entry
+    from src.imagefile import ImageFile
+    with path.open('r', encoding='utf-8') as f:
+        data = json.load(f)
+    data['files'] = {k: ImageFile.from_dict(v) for k, v in data['files'].items()}
+    return data
+
+
+def store_json_load(path: Path):
+    from src.storage import columns_path, load_index
+    columns_path(path).unlink(missing_ok=True)
+    return load_index(path)
+
+
+def store_columns_load(path: Path):
+    from src.storage import load_index
+    return load_index(path)
+
+
+LOADERS = {'legacy': legacy_load, 'json': store_json_load, 'columns': store_columns_load}
+
+
+def _child(mode: str, path: str, traced: bool, q) -> None:
+    import src.imagefile  # noqa: F401  import cost is not part of the measurement
+    import src.storage  # noqa: F401
+    load = LOADERS[mode]
+    if traced:
+        # python heap only, RSS keeps freed arenas and hides what the structure itself retains
+        tracemalloc.start()
+        data = load(Path(path))
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        q.put((retained / 2 ** 20, peak / 2 ** 20))
+        return
+
+    t0 = time.perf_counter()
+    data = load(Path(path))
+    secs = time.perf_counter() - t0
+    # a full pass over tags and captions, the access pattern of summaries and searches
+    t0 = time.perf_counter()
+    n = 0
+    for img in data['files'].values():
+        n += len(img.effective_tags()) + len(img.caption_text())
+    q.put((secs, time.perf_counter() - t0))
+
+
+def _run(ctx, mode: str, path: Path, traced: bool):
+    q = ctx.Queue()
+    p = ctx.Process(target=_child, args=(mode, str(path), traced, q))
+    p.start()
+    res = q.get()
+    p.join()
+    return res
+
+
+def _report(ctx, mode: str, path: Path) -> None:
+    secs, scan = _run(ctx, mode, path, False)
+    retained, peak = _run(ctx, mode, path, True)
+    print(f'{mode:7}: load {secs:6.2f}s | retained {retained:7.0f} MiB | peak {peak:7.0f} MiB'
+          f' | full tag scan {scan:5.2f}s')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Index load time and memory: ImageFile dicts vs FileStore from json and from the binary index'
+    )
+    parser.add_argument('--images', type=int, default=200_000)
+    parser.add_argument('--tags', type=int, default=25)
+    args = parser.parse_args()
+
+    ctx = mp.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'tags_index.json'
+        make_index(path, args.images, args.tags)
+        size = path.stat().st_size / 2 ** 20
+        print(f'{args.images} images, {args.tags} tags each, index {size:.0f} MiB')
+        _report(ctx, 'legacy', path)
+        _report(ctx, 'json', path)
+
+        # the next save writes the binary index next to the json
+        from src.storage import columns_path, load_index, save_index
+        save_index(load_index(path), path)
+        print(f'binary index {columns_path(path).stat().st_size / 2 ** 20:.0f} MiB')
+        _report(ctx, 'columns', path)
+
+
+if __name__ == '__main__':
+    main()
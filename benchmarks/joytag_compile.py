@@ -0,0 +1,47 @@
+import argparse
+import time
+import torch
+from src.inference import InferenceProfile, to_memory_format
+from src.joytag import JoyTagModel
+
+
+def bench(model: JoyTagModel, batch: int, iters: int) -> float:
+    size = model._model.image_size
+    x = to_memory_format(torch.randn(batch, 3, size, size, device=model.device), model.profile)
+    with torch.inference_mode():
+        model._run(model._forward, x)
+        t0 = time.perf_counter()
+        for _ in range(iters):
+            model._run(model._forward, x)
+    return (time.perf_counter() - t0) / (iters * batch)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='JoyTag eager vs optimized profile')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=10)
+    args = parser.parse_args()
+
+    eager = JoyTagModel(device=args.device)
+    t0 = time.perf_counter()
+    eager.activate()
+    eager_activate = time.perf_counter() - t0
+    eager_time = bench(eager, args.batch, args.iters)
+    eager.deactivate()
+
+    opt = JoyTagModel(device=args.device, profile=InferenceProfile(warmup_batches=(args.batch,)))
+    t0 = time.perf_counter()
+    opt.activate()
+    opt_activate = time.perf_counter() - t0
+    opt_time = bench(opt, args.batch, args.iters)
+    opt.deactivate()
+
+    print(f'device={args.device} batch={args.batch} iters={args.iters}')
+    print(f'eager:     {eager_time * 1000:8.1f} ms/image  (activate {eager_activate:.1f}s)')
+    print(f'optimized: {opt_time * 1000:8.1f} ms/image  (activate {opt_activate:.1f}s incl. compile/warmup)')
+    print(f'speedup:   {eager_time / opt_time:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
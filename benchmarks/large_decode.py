@@ -0,0 +1,78 @@
+import argparse
+import multiprocessing as mp
+import resource
+import tempfile
+from pathlib import Path
+from PIL import Image
+import numpy as np
+
+TARGET_SIZE = 448
+
+
+def legacy_decode(path: Path):
+    # the decode path before bounded decoding: full decode, full-size square canvas, then resize
+    from src.images import prepare_image
+    with Image.open(path) as im:
+        image = im.convert('RGB').copy()
+    w, h = image.size
+    max_dim = max(w, h)
+    padded = Image.new('RGB', (max_dim, max_dim), (255, 255, 255))
+    padded.paste(image, ((max_dim - w) // 2, (max_dim - h) // 2))
+    return prepare_image(padded, TARGET_SIZE)
+
+
+def bounded_decode(path: Path):
+    from src.images import load_image, prepare_image
+    return prepare_image(load_image(path, TARGET_SIZE), TARGET_SIZE)
+
+
+def _child(mode: str, path: str, q) -> None:
+    import src.images  # noqa: F401  import cost is not part of the measurement
+    Image.MAX_IMAGE_PIXELS = None
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        (legacy_decode if mode == 'legacy' else bounded_decode)(Path(path))
+        err = ''
+    except Exception as e:
+        err = f'{type(e).__name__}: {e}'
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    q.put((after - before, err))
+
+
+def make_images(folder: Path, megapixels: int):
+    side = int((megapixels * 1_000_000) ** 0.5)
+    rng = np.random.default_rng(0)
+    # low-frequency noise compresses like a photo and keeps generation fast
+    small = rng.integers(0, 255, size=(side // 64, side // 64, 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize((side, side), Image.BILINEAR)
+    paths = [folder / 'large.jpg', folder / 'large.tif', folder / 'large.png', folder / 'large.webp']
+    image.save(paths[0], quality=90)
+    image.save(paths[1])
+    image.save(paths[2], compress_level=1)
+    image.save(paths[3], quality=80)
+    return paths
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Peak RSS of legacy vs bounded decoding on synthetic large images')
+    parser.add_argument('--megapixels', type=int, default=100)
+    args = parser.parse_args()
+
+    ctx = mp.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_images(Path(tmp), args.megapixels)
+        print(f'{args.megapixels} MP synthetic images, target {TARGET_SIZE}px, peak RSS growth per decode')
+        for path in paths:
+            row = []
+            for mode in ('legacy', 'bounded'):
+                q = ctx.Queue()
+                p = ctx.Process(target=_child, args=(mode, str(path), q))
+                p.start()
+                delta_kb, err = q.get()
+                p.join()
+                row.append(f'{mode} {delta_kb / 1024:8.0f} MiB' + (f' ({err})' if err else ''))
+            print(f'{path.suffix:5}: ' + ' | '.join(row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from PIL import Image
+import numpy as np
+
+TARGET_SIZE = 448
+
+
+class SlowStorage:
+    # stand-in for a network share: a fixed delay per open plus a bandwidth cap
+    def __init__(self, latency: float, mb_per_s: float):
+        self.latency = latency
+        self.bytes_per_s = mb_per_s * 2**20
+
+    def read(self, path: Path) -> bytes:
+        from src.prefetch import read_file
+        time.sleep(self.latency)
+        data = read_file(path)
+        if self.bytes_per_s:
+            time.sleep(len(data) / self.bytes_per_s)
+        return data
+
+    def size(self, path: Path) -> int:
+        time.sleep(self.latency / 4)
+        return path.stat().st_size
+
+
+class DecodeModel:
+    # the decode half of JoyTag.process, plus a fixed wait standing in for the GPU forward pass
+    model_name = 'decode'
+    max_batch = 1
+
+    def __init__(self, infer_secs: float):
+        import torch
+        self.infer_secs = infer_secs
+        self.device = torch.device('cpu')
+
+    def activate(self):
+        pass
+
+    def deactivate(self):
+        pass
+
+    def process(self, source):
+        from src.images import load_image, prepare_image
+        x = prepare_image(load_image(source, TARGET_SIZE), TARGET_SIZE)
+        time.sleep(self.infer_secs)
+        return x.shape[0]
+
+    def process_batch(self, sources):
+        return [self.process(s) for s in sources]
+
+
+def make_images(folder: Path, count: int, side: int):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        small = rng.integers(0, 255, size=(side // 32, side // 32, 3), dtype=np.uint8)
+        path = folder / f'img_{i:05d}.jpg'
+        Image.fromarray(small).resize((side, side), Image.BILINEAR).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def run(paths, storage, workers: int, infer_secs: float) -> float:
+    from src.phash import HashIndex
+    from src.prefetch import Prefetcher, read_file
+    from src.workers import AIWorker, ImageTask
+    reader = storage.read if storage else read_file
+    size_of = storage.size if storage else (lambda p: p.stat().st_size)
+    prefetch = Prefetcher(workers, reader=reader, size_of=size_of)
+    worker = AIWorker([DecodeModel(infer_secs)], hash_index=HashIndex(), dup_distance=0, prefetch=prefetch)
+    results = []
+    worker.signals.result.connect(results.append)
+
+    t0 = time.perf_counter()
+    for p in paths:
+        worker.put(ImageTask(id=p.name, path=p))
+    worker.put(None)
+    worker.run()
+    secs = time.perf_counter() - t0
+    prefetch.close()
+    errors = [r['error'] for r in results if 'error' in r]
+    assert len(results) == len(paths) and not errors, errors[:3]
+    return len(paths) / secs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='AIWorker throughput with and without read-ahead on slow storage')
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--side', type=int, default=2048)
+    parser.add_argument('--latency-ms', type=float, default=40)
+    parser.add_argument('--mb-per-s', type=float, default=50)
+    parser.add_argument('--infer-ms', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_images(Path(tmp), args.images, args.side)
+        size = sum(p.stat().st_size for p in paths) / len(paths) / 2**20
+        print(f'{args.images} images {args.side}px ({size:.1f} MiB avg), model {args.infer_ms:.0f} ms/image')
+        slow = SlowStorage(args.latency_ms / 1000, args.mb_per_s)
+        infer = args.infer_ms / 1000
+        rows = [
+            ('local, no prefetch', None, 0),
+            (f'{args.latency_ms:.0f} ms + {args.mb_per_s:.0f} MB/s, no prefetch', slow, 0),
+            (f'{args.latency_ms:.0f} ms + {args.mb_per_s:.0f} MB/s, prefetch x{args.workers}', slow, args.workers),
+        ]
+        for name, storage, workers in rows:
+            print(f'{name:36}: {run(paths, storage, workers, infer):6.1f} images/s')
+
+
+if __name__ == '__main__':
+    main()
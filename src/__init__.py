@@ -0,0 +1,6 @@
+import os
+from pathlib import Path
+
+# inductor pins its cache dir the first time it looks, so it is set before any module here imports torch;
+# compiled graphs are kept next to the models (MODEL_ROOT in models.py), an explicit setting still wins
+os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', str(Path.cwd().resolve() / 'models' / '.cache' / 'inductor'))
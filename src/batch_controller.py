@@ -1,41 +1,93 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import Any, Dict, Optional, List
+from typing import Any, Dict, Iterable, Optional, List, Set, Tuple
 from PySide6.QtCore import QObject, Signal, Slot, QThreadPool
-from .workers import ScanWorker, AIWorker, ImageTask
-from .storage import load_index, save_index
-from .enums import WorkerName, Fileds, FileState
-from .imagefile import ImageFile
+from .workers import ScanWorker, AIWorker, ImageTask, CompactWorker, IndexWorker, ThumbTask, ThumbWorker
+from .storage import copy_index, load_index, save_index
+from .enums import WorkerName, Fileds, FileState, EditKind, ErrorKind
+from .filestore import DEFAULT_VOCAB, ImageView
+from .editlog import EditLog, EditOp, relabel_of, touched_ids
 from .models import TaskModel
 from .joytag import JoyTagModel as JoyTag
 from .blip import BlipCaptionModel as BlipCaption
+from .phash import HashIndex, hash_from_str
+from .embeddings import EmbeddingStore, IVFIndex
+from .watcher import FolderWatcher
+from .inference import InferenceProfile
+from .images import find_sidecars, read_sidecars
+from .workspace import Workspace, summarize
+from .tagstats import TagStats, tag_set
+from .prefetch import Prefetcher
+from .thumbstore import ThumbStore
 
 
 class BatchController(QObject):
     item_found = Signal(str)
+    item_removed = Signal(str)
     item_tag = Signal(str)
+    tags_changed = Signal()
+    thumb_ready = Signal(str, bytes)
     error = Signal(str, str)
     status = Signal(str)
     models = List[TaskModel]
     model_by_id = Dict[str, TaskModel]
+    # edits kept in the log before they are folded into tags_index.json
+    compact_every = 1000
 
-    def __init__(self, parent: Optional[QObject] = None):
+    def __init__(
+        self,
+        parent: Optional[QObject] = None,
+        dup_distance: int = 4,
+        save_embeddings: bool = True,
+        optimize: bool = False,
+        prefetch_workers: int = 4,
+        prefetch_bytes: int = 256 * 2**20,
+    ):
         super().__init__(parent)
-        self.folder: Optional[Path] = None
         self.database: Optional[Dict[str, Any]] = None
+        self.save_embeddings = save_embeddings
+        self.embeddings: Optional[EmbeddingStore] = None
+        self.index_worker: Optional[IndexWorker] = None
+        self.thumbs: Optional[ThumbStore] = None
+        self.thumb_worker: Optional[ThumbWorker] = None
+        self.edit_log: Optional[EditLog] = None
+        self.compact_worker: Optional[CompactWorker] = None
+        self.watch_enabled = False
+        self.watcher: Optional[FolderWatcher] = None
+        self.workspace = Workspace()
+        self.root_key: Optional[str] = None
+        self.tag_stats = TagStats()
+        # changed on disk while queued, processed again once the running task reports
+        self.changed_in_flight: Set[str] = set()
 
         # inference single worker thread
         self.pool = QThreadPool.globalInstance()
+        # the thumbnailer waits for requests for as long as a folder is open, on its own thread
+        # it never holds a slot the scan or the compaction needs
+        self.thumb_pool = QThreadPool(self)
+        self.thumb_pool.setMaxThreadCount(1)
+        # the inference worker holds its slot in the global pool all session, which may be the only one;
+        # the scan, the compaction and the index build each get a thread of their own here
+        self.io_pool = QThreadPool(self)
+        self.io_pool.setMaxThreadCount(3)
         self.database_dirty = False
         self.scan_worker: Optional[ScanWorker] = None
         self.ai_worker: Optional[AIWorker] = None
         self.models = []
-        self.models.append(JoyTag(0.5))
+        profile = InferenceProfile() if optimize else None
+        self.models.append(JoyTag(0.5, save_embeddings=save_embeddings, profile=profile))
         self.models.append(BlipCaption())
-        ai_worker = AIWorker(self.models)
+        # auto tag ids in the in-memory store line up with JoyTag's output indexes
+        DEFAULT_VOCAB.seed(self.models[0].top_tags)
+        # perceptual hashes of processed images, near-duplicates reuse their results
+        self.hash_index = HashIndex()
+        # files are read ahead of inference, slow or network storage stays off the critical path
+        prefetch = Prefetcher(prefetch_workers, prefetch_bytes)
+        ai_worker = AIWorker(self.models, hash_index=self.hash_index, dup_distance=dup_distance, prefetch=prefetch)
         self.ai_worker = ai_worker
         ai_worker.signals.result.connect(self.on_ai_result)
         ai_worker.signals.error.connect(self.on_error_workers)
+        ai_worker.signals.status.connect(self.status)
         self.pool.start(ai_worker)
 
         md = {}
@@ -49,40 +101,215 @@ class BatchController(QObject):
             self.scan_worker.signals.found.disconnect(self.on_scan_found)
             self.scan_worker.signals.error.disconnect(self.on_error_workers)
             self.scan_worker.cancel()
-            self.pool.waitForDone(1500)
+            self.io_pool.waitForDone(1500)
             self.scan_worker = None
 
     def start_tasks(self, folder: Path, recursive: bool = True) -> None:
         self.stop_tasks()
+        self.stop_watch()
+        self.close_database()
         self.root = folder
+        self.recursive = recursive
+        self.root_key = self.workspace.register(folder).key
         self.database = load_index(folder / 'tags_index.json')
         self.database_dirty = False
+        self.edit_log = EditLog(folder / 'tags_index.log')
+        replayed = self.edit_log.open(self.database[Fileds.FILES], self.database.get('log_seq', 0))
+        if replayed:
+            self.status.emit(f'Recovered {replayed} edits')
+        # undo history starts empty, no relabel from before can be undone any more
+        self.database[Fileds.FILES].clear_relabels()
+        self.workspace.attach(self.root_key, self.database)
+        self.tag_stats.attach(self.database[Fileds.FILES])
+        # tasks from the previous folder must not land in the new folder's index
+        if self.ai_worker is not None:
+            self.ai_worker.clear()
+        self.hash_index.clear()
+        self.changed_in_flight.clear()
+        self.embeddings = EmbeddingStore(folder) if self.save_embeddings else None
+        self._update_index()
+        self.thumbs = ThumbStore(folder)
+        thumb_worker = ThumbWorker(self.thumbs)
+        self.thumb_worker = thumb_worker
+        thumb_worker.signals.ready.connect(self.thumb_ready)
+        thumb_worker.signals.error.connect(self.on_error_workers)
+        self.thumb_pool.start(thumb_worker)
         self.status.emit(f'Scanning: {folder}')
         worker = ScanWorker(folder, recursive=recursive)
         self.scan_worker = worker
         worker.signals.found.connect(self.on_scan_found)
         worker.signals.error.connect(self.on_error_workers)
-        self.pool.start(worker)
+        self.io_pool.start(worker)
+        if self.watch_enabled:
+            self.start_watch()
+
+    def set_watch(self, enabled: bool) -> None:
+        self.watch_enabled = enabled
+        if enabled and self.database is not None:
+            self.start_watch()
+        elif not enabled:
+            self.stop_watch()
+
+    def start_watch(self) -> None:
+        self.stop_watch()
+        watcher = FolderWatcher(self.root, recursive=self.recursive, parent=self)
+        watcher.created.connect(self.on_watch_created)
+        watcher.modified.connect(self.on_watch_modified)
+        watcher.deleted.connect(self.on_watch_deleted)
+        watcher.renamed.connect(self.on_watch_renamed)
+        watcher.start()
+        self.watcher = watcher
+        self.status.emit(f'Watching: {self.root}')
 
-    def getImage(self, id: str) -> ImageFile:
+    def stop_watch(self) -> None:
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher.deleteLater()
+            self.watcher = None
+
+    def getImage(self, id: str) -> ImageView:
         return self.database.get(Fileds.FILES, {}).get(id)
 
-    @Slot(Path)
-    def on_scan_found(self, path: Path) -> None:
-        if path.parent == self.folder:
-            id = path.relative_to(self.folder).as_posix()
-        else:
-            id = (Path(path.parent.name) / path.name).as_posix()
-        image = self.getImage(id)
+    def make_id(self, path: Path) -> str:
+        # relative to the root so nested folders with equal names never collide
+        return path.relative_to(self.root).as_posix()
+
+    def _migrate_legacy(self, id: str, path: Path) -> Optional[ImageView]:
+        # older indexes keyed images by 'parent/name' only
+        legacy_id = (Path(path.parent.name) / path.name).as_posix()
+        legacy = self.getImage(legacy_id)
+        if legacy is None or legacy_id == id or Path(legacy.path) != path:
+            return None
+        image = self.database[Fileds.FILES].rename(legacy_id, id, path)
+        self._rekey_stats(legacy_id, id, tag_set(image))
+        if self.embeddings is not None:
+            self.embeddings.rename(legacy_id, id)
+        if self.thumbs is not None:
+            self.thumbs.rename(legacy_id, id)
+        return image
+
+    def _enqueue(self, image: ImageView) -> None:
+        image.status = FileState.QUEUED
+        self.ai_worker.put(ImageTask(id=image.id, path=image.path))
+
+    @Slot(Path, object)
+    def on_scan_found(self, path: Path, imported: Optional[Dict[str, Any]] = None) -> None:
+        id = self.make_id(path)
+        image = self.getImage(id) or self._migrate_legacy(id, path)
         if not image:
-            image = ImageFile(id=id, path=path, status=FileState.PENDING)
+            image = self.database[Fileds.FILES].add(id, path, FileState.PENDING)
 
         if image.status != FileState.DONE:
-            image.status = FileState.QUEUED
-            self.ai_worker.put(ImageTask(id=id, path=path))
-            self.database[Fileds.FILES][id] = image
+            if imported:
+                # already tagged on disk, never sent through the models
+                before = tag_set(image)
+                for k, v in imported.items():
+                    image[k] = v
+                self.tag_stats.update(id, before, tag_set(image))
+                image['_source'] = 'sidecar'
+                image.status = FileState.DONE
+            elif self._is_quarantined(image):
+                image.status = FileState.ERROR
+            else:
+                self._enqueue(image)
+        elif image['_phash']:
+            self.hash_index.add(id, hash_from_str(image['_phash']))
         self.item_found.emit(id)
 
+    def _is_quarantined(self, image: ImageView) -> bool:
+        quarantine = self.database.get(Fileds.QUARANTINE, {})
+        entry = quarantine.get(image.id)
+        if entry is None:
+            return False
+        try:
+            st = Path(image.path).stat()
+        except OSError:
+            return True
+        # a replaced or re-exported file gets another chance
+        if [st.st_size, st.st_mtime_ns] != [entry.get('size'), entry.get('mtime_ns')]:
+            del quarantine[image.id]
+            return False
+        return True
+
+    def _quarantine(self, image: ImageView, reason: str) -> None:
+        try:
+            st = Path(image.path).stat()
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        except OSError:
+            size, mtime_ns = None, None
+        quarantine = self.database.setdefault(Fileds.QUARANTINE, {})
+        quarantine[image.id] = {'reason': reason, 'size': size, 'mtime_ns': mtime_ns}
+
+    @Slot(Path)
+    def on_watch_created(self, path: Path) -> None:
+        if self.getImage(self.make_id(path)) is not None:
+            self.on_watch_modified(path)
+        else:
+            self.on_scan_found(path, read_sidecars(find_sidecars(path)))
+
+    @Slot(Path)
+    def on_watch_modified(self, path: Path) -> None:
+        image = self.getImage(self.make_id(path))
+        if image is None:
+            self.on_scan_found(path)
+            return
+        if image.status == FileState.QUEUED:
+            # the file may still be being written, its final content is read after this run
+            self.changed_in_flight.add(image.id)
+            image.path = path
+            return
+        self.hash_index.remove(image.id)
+        self.database.get(Fileds.QUARANTINE, {}).pop(image.id, None)
+        image.path = path
+        self._enqueue(image)
+
+    @Slot(Path)
+    def on_watch_deleted(self, path: Path) -> None:
+        id = self.make_id(path)
+        image = self.database[Fileds.FILES].pop(id, None)
+        if image is None:
+            return
+        self.tag_stats.update(id, tag_set(image), set())
+        if self.ai_worker is not None:
+            self.ai_worker.drop(id)
+        self.changed_in_flight.discard(id)
+        self.hash_index.remove(id)
+        if self.embeddings is not None:
+            self.embeddings.remove(id)
+        if self.thumbs is not None:
+            self.thumbs.discard(id)
+        self.item_removed.emit(id)
+
+    @Slot(Path, Path)
+    def on_watch_renamed(self, old: Path, new: Path) -> None:
+        old_id = self.make_id(old)
+        new_id = self.make_id(new)
+        moved = self.database[Fileds.FILES].rename(old_id, new_id, new)
+        if moved is None:
+            self.on_watch_created(new)
+            return
+        if old_id == new_id:
+            return
+        self._rekey_stats(old_id, new_id, tag_set(moved))
+        if moved.status == FileState.QUEUED:
+            # the task already queued under the old id is withdrawn
+            self.ai_worker.drop(old_id)
+            self.changed_in_flight.discard(old_id)
+            self._enqueue(moved)
+        self.hash_index.remove(old_id)
+        if moved['_phash'] and moved.status == FileState.DONE:
+            self.hash_index.add(new_id, hash_from_str(moved['_phash']))
+        if self.embeddings is not None:
+            self.embeddings.rename(old_id, new_id)
+        if self.thumbs is not None:
+            self.thumbs.rename(old_id, new_id)
+        self.item_removed.emit(old_id)
+        self.item_found.emit(new_id)
+
+    def _rekey_stats(self, old_id: str, new_id: str, tags: Set[str]) -> None:
+        self.tag_stats.update(old_id, tags, set())
+        self.tag_stats.update(new_id, set(), tags)
+
     @Slot(str, str)
     def on_error_workers(self, id: str, msg: str):
 
@@ -102,23 +329,335 @@ class BatchController(QObject):
 
     def shutdown(self):
         self.stop_tasks()
+        self.stop_watch()
         if self.ai_worker is not None:
             self.ai_worker.cancel()
             self.ai_worker.signals.result.disconnect(self.on_ai_result)
             self.ai_worker.signals.error.disconnect(self.on_error_workers)
+            self.ai_worker.signals.status.disconnect(self.status)
             self.ai_worker.cancel()
             self.pool.waitForDone(1500)
             self.ai_worker = None
+        self.close_database()
+
+    def close_database(self) -> None:
+        if self.compact_worker is not None:
+            # one still waiting for a thread is dropped, the full save below covers it;
+            # only a write already under way is waited for
+            if not self.io_pool.tryTake(self.compact_worker):
+                self.compact_worker.wait()
+            self.compact_worker = None
+        if self.embeddings is not None:
+            self.embeddings.close()
+            self.embeddings = None
+        # a build still running finishes on its own and saves next to the store it read
+        self.index_worker = None
+        if self.thumb_worker is not None:
+            self.thumb_worker.cancel()
+            self.thumb_worker.signals.ready.disconnect(self.thumb_ready)
+            self.thumb_worker.signals.error.disconnect(self.on_error_workers)
+            self.thumb_pool.waitForDone(5000)
+            self.thumb_worker = None
+        if self.thumbs is not None:
+            self.thumbs.close()
+            self.thumbs = None
         if self.database:
+            if self.edit_log is not None:
+                self.database['log_seq'] = self.edit_log.seq
             save_index(self.database, self.root / 'tags_index.json')
+            self.workspace.update_summary(self.root_key, self.summary())
+        if self.edit_log is not None:
+            self.edit_log.discard()
+            self.edit_log = None
+        if self.root_key is not None:
+            self.workspace.detach(self.root_key)
+            self.root_key = None
+
+    def save(self) -> None:
+        if not self.database or self.edit_log is None or self.compact_worker is not None:
+            return
+        self.database['log_seq'] = self.edit_log.seq
+        data = copy_index(self.database)
+        self.edit_log.rotate()
+        worker = CompactWorker(data, self.root / 'tags_index.json')
+        worker.signals.done.connect(self.on_compacted)
+        self.compact_worker = worker
+        self.io_pool.start(worker)
+
+    @Slot(object, str)
+    def on_compacted(self, index_path: Path, msg: str) -> None:
+        if self.compact_worker is None or self.compact_worker.index_path != index_path:
+            return
+        worker, self.compact_worker = self.compact_worker, None
+        if msg == 'Done':
+            self.edit_log.finish_compaction()
+            # counted by the worker from what it saved
+            self.workspace.update_summary(self.root_key, worker.summary)
+            self.status.emit('Saved')
+        else:
+            self.status.emit(f'Save failed: {msg}')
+
+    def _tag_sets(self, ids: Iterable[str]) -> Dict[str, Set[str]]:
+        files = self.database[Fileds.FILES]
+        return {id: tag_set(files[id]) for id in ids if id in files}
+
+    def apply_edit(self, op: EditOp) -> None:
+        if self.edit_log is None:
+            return
+        before = self._tag_sets(touched_ids(op))
+        self.edit_log.do(self.database[Fileds.FILES], op)
+        self._after_edit(op, before)
+
+    def undo(self) -> Optional[str]:
+        if self.edit_log is None or not self.edit_log.can_undo():
+            return None
+        before = self._tag_sets(touched_ids(self.edit_log.next_undo()))
+        op = self.edit_log.undo(self.database[Fileds.FILES])
+        self._after_edit(op, before)
+        return op.id
+
+    def redo(self) -> Optional[str]:
+        if self.edit_log is None or not self.edit_log.can_redo():
+            return None
+        before = self._tag_sets(touched_ids(self.edit_log.next_redo()))
+        op = self.edit_log.redo(self.database[Fileds.FILES])
+        self._after_edit(op, before)
+        return op.id
+
+    def _after_edit(self, op: EditOp, before: Dict[str, Set[str]]) -> None:
+        after = self._tag_sets(before)
+        relabel = relabel_of(op)
+        # an undone relabel leads its batch, a relabel comes after the per-image edits it depends on
+        if relabel is not None and relabel.kind == EditKind.UNRELABEL:
+            self.tag_stats.unrelabel(relabel.index, list(relabel.old), relabel.new)
+        self.tag_stats.update_many({id: (tags, after.get(id, set())) for id, tags in before.items()})
+        if relabel is not None and relabel.kind == EditKind.RELABEL:
+            self.tag_stats.relabel(relabel.index, list(relabel.old), relabel.new)
+        if op.kind == EditKind.BATCH:
+            self.tags_changed.emit()
+        else:
+            self.item_tag.emit(op.id)
+        if self.edit_log.pending >= self.compact_every:
+            self.save()
+
+    def add_tag(self, id: str, tag: str) -> None:
+        img = self.getImage(id)
+        if img is None or not tag:
+            return
+        self.apply_edit(EditOp(EditKind.ADD, id, tag=tag, index=len(img.edit_tags())))
+
+    def remove_tag(self, id: str, index: int) -> None:
+        img = self.getImage(id)
+        if img is None:
+            return
+        tags = img.edit_tags()
+        if 0 <= index < len(tags):
+            self.apply_edit(EditOp(EditKind.REMOVE, id, tag=tags[index], index=index))
+
+    def move_tag(self, id: str, index: int, to: int) -> None:
+        img = self.getImage(id)
+        if img is None:
+            return
+        tags = img.edit_tags()
+        if 0 <= index < len(tags) and 0 <= to < len(tags) and index != to:
+            self.apply_edit(EditOp(EditKind.MOVE, id, index=index, to=to))
+
+    def remove_duplicate_tags(self, id: str) -> None:
+        img = self.getImage(id)
+        if img is None:
+            return
+        tags = img.edit_tags()
+        deduped = list(dict.fromkeys(tags))
+        if deduped != tags:
+            self.apply_edit(EditOp(EditKind.SET, id, old=list(tags), new=deduped))
+
+    def set_caption(self, id: str, caption: str) -> None:
+        img = self.getImage(id)
+        if img is None:
+            return
+        old = img.caption_text()
+        if caption != old:
+            self.apply_edit(EditOp(EditKind.CAPTION, id, old=old, new=caption))
+
+    def _apply_bulk(self, ops: List[EditOp]) -> int:
+        if not ops:
+            return 0
+        # one log entry for the whole operation, undone and redone as a unit
+        op = EditOp(EditKind.BATCH, '', ops=tuple(ops))
+        self.apply_edit(op)
+        return len(touched_ids(op))
+
+    def rename_tag(self, old: str, new: str) -> int:
+        return self.merge_tags([old], new)
+
+    def merge_tags(self, sources: List[str], target: str) -> int:
+        target = target.strip()
+        sources = [t for t in dict.fromkeys(sources) if t and t != target]
+        if self.database is None or not target or not sources:
+            return 0
+        changed: Set[str] = set()
+        for tag in sources:
+            changed |= self.tag_stats.images_with(tag)
+        if not changed:
+            return 0
+        # a single small log entry that the store applies to every image carrying a source; only images that would
+        # end up with the target twice are edited one by one, keeping the first of the merged tags
+        overlap = set()
+        carrying = self.tag_stats.images_with(target)
+        for tag in sources:
+            ids = self.tag_stats.images_with(tag)
+            overlap |= carrying & ids
+            carrying |= ids
+        group = set(sources) | {target}
+        ops: List[EditOp] = []
+        for id in sorted(overlap):
+            tags = self.getImage(id).effective_tags()
+            first = next(i for i, t in enumerate(tags) if t in group)
+            # back to front so the recorded indexes stay valid while applying
+            for i in reversed(range(first + 1, len(tags))):
+                if tags[i] in group:
+                    ops.append(EditOp(EditKind.REMOVE, id, tag=tags[i], index=i))
+        # numbered by the log entry it goes into, unique for as long as it can be undone
+        ops.append(EditOp(EditKind.RELABEL, '', index=self.edit_log.seq + 1, old=sources, new=target))
+        self._apply_bulk(ops)
+        return len(changed)
+
+    def delete_tag(self, tag: str) -> int:
+        if self.database is None:
+            return 0
+        ops: List[EditOp] = []
+        for id in sorted(self.tag_stats.images_with(tag)):
+            tags = self.getImage(id).edit_tags()
+            # back to front so the recorded indexes stay valid while applying
+            for i in reversed(range(len(tags))):
+                if tags[i] == tag:
+                    ops.append(EditOp(EditKind.REMOVE, id, tag=tag, index=i))
+        return self._apply_bulk(ops)
+
+    def implies_tag(self, tag: str, implied: str) -> int:
+        implied = implied.strip()
+        if self.database is None or not implied or implied == tag:
+            return 0
+        ops: List[EditOp] = []
+        for id in sorted(self.tag_stats.images_with(tag) - self.tag_stats.images_with(implied)):
+            tags = self.getImage(id).edit_tags()
+            ops.append(EditOp(EditKind.ADD, id, tag=implied, index=len(tags)))
+        return self._apply_bulk(ops)
 
     @Slot(object)
     def on_ai_result(self, item: object):
         item = dict(item)
         img = self.getImage(item.get('id'))
+        if img is None or self.ai_worker.is_stale(img.id, item['seq']):
+            return
+        if img.id in self.changed_in_flight:
+            # read before the last write finished, the result is thrown away
+            self.changed_in_flight.discard(img.id)
+            self.hash_index.remove(img.id)
+            self.database.get(Fileds.QUARANTINE, {}).pop(img.id, None)
+            self._enqueue(img)
+            return
+        dup_id = item.get('duplicate_of')
+        dup = self.getImage(dup_id) if dup_id else None
+        if dup_id and (dup is None or dup.status != FileState.DONE):
+            # the source went away or is being redone since it was indexed, so run the models after all
+            self.hash_index.remove(dup_id)
+            self._enqueue(img)
+            return
+        if item.get('error'):
+            img.status = FileState.ERROR
+            img['_error'] = item.get('error')
+            if item.get('error_kind') == ErrorKind.FILE:
+                self._quarantine(img, item.get('error'))
+            self.status.emit(f"Skipped {img.id}: {item.get('error')}")
+            self.item_tag.emit(img.id)
+            return
+        before = tag_set(img)
         result_list = item.get('result')
         for rl in result_list:
             m = self.model_by_id[rl.get('models')]
             img[m.get_filed_name()] = m.get_result(rl.get('result'))
+            emb = m.get_embedding(rl.get('result'))
+            if emb is not None and self.embeddings is not None:
+                self.embeddings.put(img.id, emb)
+
+        if item.get('phash'):
+            img['_phash'] = item.get('phash')
+        if dup is not None:
+            for m in self.models:
+                img[m.get_filed_name()] = list(dup[m.get_filed_name()] or [])
+            img['_duplicate_of'] = dup.id
+            emb = self.embeddings.get(dup.id) if self.embeddings is not None else None
+            if emb is not None:
+                self.embeddings.put(img.id, emb)
+        self._update_index()
+        img.pop('_error', None)
         img.status = FileState.DONE
+        self.tag_stats.update(img.id, before, tag_set(img))
         self.item_tag.emit(img.id)
+
+    def _update_index(self) -> None:
+        # the search index is built off the UI thread, searches scan everything until it is in place
+        if self.embeddings is None or self.index_worker is not None or not self.embeddings.needs_index():
+            return
+        worker = IndexWorker(self.embeddings)
+        worker.signals.done.connect(self.on_indexed)
+        self.index_worker = worker
+        self.io_pool.start(worker)
+
+    @Slot(object, object)
+    def on_indexed(self, store: EmbeddingStore, result: object) -> None:
+        if self.index_worker is None or self.index_worker.store is not store:
+            return
+        self.index_worker = None
+        if not isinstance(result, IVFIndex):
+            self.status.emit(f'Similarity index failed: {result}')
+            return
+        if store is self.embeddings:
+            store.set_index(result)
+            self._update_index()
+
+    def find_similar(self, id: str, k: int = 20) -> List[Tuple[str, float]]:
+        if self.embeddings is None:
+            return []
+        emb = self.embeddings.get(id)
+        if emb is None:
+            return []
+        return self.embeddings.search(emb, k=k, exclude=id)
+
+    def thumbnail(self, id: str) -> Optional[bytes]:
+        if self.thumbs is None:
+            return None
+        return self.thumbs.get(id)
+
+    def request_thumbs(self, ids: Iterable[str]) -> None:
+        # stored thumbnails are checked against the original in the worker, off the GUI thread
+        if self.thumb_worker is None:
+            return
+        tasks = []
+        for id in ids:
+            img = self.getImage(id)
+            if img is not None:
+                tasks.append(ThumbTask(id=id, path=Path(img.path), stamp=self.thumbs.stamp(id)))
+        self.thumb_worker.request(tasks)
+
+    def search_workspace(self, text: str, limit: int = 500) -> List[Tuple[str, ImageView]]:
+        return self.workspace.search(text, limit=limit)
+
+    def summary(self) -> Dict[str, Any]:
+        # tag counts from the live statistics when they are counted already
+        return summarize(self.database, self.tag_stats.named_counts())
+
+    def workspace_stats(self) -> Dict[str, Any]:
+        live = {self.root_key: self.summary()} if self.database and self.root_key is not None else None
+        return self.workspace.stats(live)
+
+    def duplicate_clusters(self) -> List[List[str]]:
+        clusters: Dict[str, List[str]] = {}
+        if not self.database:
+            return []
+        for id, img in self.database.get(Fileds.FILES, {}).items():
+            src = img['_duplicate_of']
+            if src:
+                clusters.setdefault(src, [src]).append(id)
+        return list(clusters.values())
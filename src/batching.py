@@ -0,0 +1,157 @@
+from __future__ import annotations
+import json
+import statistics
+from pathlib import Path
+from typing import Dict, List, Optional
+import torch
+
+CACHE_DIR_NAME = '.cache'
+
+
+def is_oom(e: BaseException) -> bool:
+    if isinstance(e, (torch.cuda.OutOfMemoryError, MemoryError)):
+        return True
+    # older builds and other backends raise a plain RuntimeError
+    return isinstance(e, RuntimeError) and 'out of memory' in str(e).lower()
+
+
+def device_key(device: torch.device) -> str:
+    if device.type == 'cuda' and torch.cuda.is_available():
+        index = device.index if device.index is not None else torch.cuda.current_device()
+        props = torch.cuda.get_device_properties(index)
+        return f'cuda:{props.name}:{props.total_memory // 2**20}MiB'
+    return device.type
+
+
+def memory_budget(device: torch.device, fraction: float) -> Optional[int]:
+    if device.type != 'cuda' or not torch.cuda.is_available():
+        return None
+    _free, total = torch.cuda.mem_get_info(device)
+    return int(total * fraction)
+
+
+def memory_in_use(device: torch.device) -> Optional[int]:
+    if device.type != 'cuda' or not torch.cuda.is_available():
+        return None
+    return torch.cuda.memory_allocated(device)
+
+
+def reset_peak_memory(device: torch.device) -> None:
+    if device.type == 'cuda' and torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def peak_memory(device: torch.device) -> Optional[int]:
+    if device.type != 'cuda' or not torch.cuda.is_available():
+        return None
+    return torch.cuda.max_memory_allocated(device)
+
+
+def release_memory(device: torch.device) -> None:
+    if device.type == 'cuda' and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class BatchSizeStore:
+    # tuned sizes per device, next to the model's other caches
+    def __init__(self, model_dir: Path):
+        self.path = model_dir / CACHE_DIR_NAME / 'batch_sizes.json'
+
+    def load(self) -> Dict[str, int]:
+        if not self.path.exists():
+            return {}
+        try:
+            with self.path.open('r', encoding='utf-8') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            return {}
+        return {k: int(v) for k, v in data.items()} if isinstance(data, dict) else {}
+
+    def get(self, device: str) -> Optional[int]:
+        return self.load().get(device)
+
+    def put(self, device: str, size: int) -> None:
+        data = self.load()
+        data[device] = size
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        with tmp.open('w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        tmp.replace(self.path)
+
+
+class BatchTuner:
+    # full batches timed per size, the first one at a new size pays for warmup and is skipped
+    samples = 3
+    # doubling has to cut per-image latency by at least this much to be kept
+    min_gain = 0.05
+    # successful batches before the cap set by an out-of-memory error is lifted, doubled with every further one
+    recover_after = 64
+
+    def __init__(self, max_size: int, start: Optional[int] = None, budget: Optional[int] = None):
+        self.limit = max(1, max_size)
+        self.max_size = self.limit
+        self.size = min(start, self.max_size) if start else 1
+        self.budget = budget
+        # a stored size is used as is; after an out-of-memory error the size is capped for a while, then tuned again
+        self.settled = start is not None or self.max_size == 1
+        self._ooms = 0
+        self._clean = 0
+        self.best: Optional[tuple] = None
+        self._times: List[float] = []
+        self._warm = False
+        self._per_image: Optional[float] = None
+        self._base: Optional[int] = None
+
+    def record(self, n: int, secs: float, base: Optional[int] = None, peak: Optional[int] = None) -> bool:
+        # returns True once the size settles without an out-of-memory cap, that is the value worth persisting
+        if self.max_size < self.limit:
+            self._clean += 1
+            if self._clean >= self.recover_after << min(self._ooms - 1, 10):
+                # most likely memory held by something else at the time, the full range is tried again
+                self.max_size = self.limit
+                self.best = None
+                self._times = []
+                self._warm = False
+                self.settled = False
+        if self.settled or n != self.size:
+            return False
+        if base is not None and peak is not None:
+            self._base = base
+            self._per_image = max(self._per_image or 0.0, (peak - base) / n)
+        if not self._warm:
+            self._warm = True
+            return False
+        self._times.append(secs / n)
+        if len(self._times) < self.samples:
+            return False
+
+        per = statistics.median(self._times)
+        self._times = []
+        self._warm = False
+        if self.best is None or per < self.best[1] * (1 - self.min_gain):
+            self.best = (self.size, per)
+            grown = self.size * 2
+            if grown <= self.max_size and self._fits(grown):
+                self.size = grown
+                return False
+        self.size = self.best[0]
+        self.settled = True
+        return self.max_size == self.limit
+
+    def _fits(self, n: int) -> bool:
+        if self.budget is None or self._per_image is None or self._base is None:
+            return True
+        return self._base + self._per_image * n <= self.budget
+
+    def oom(self, n: int) -> None:
+        self.max_size = max(1, n // 2)
+        self.size = min(self.size, self.max_size)
+        if self.best is not None and self.best[0] > self.max_size:
+            self.best = None
+        self._times = []
+        self._warm = False
+        # the lowered size is used until the cap is lifted, it is never stored
+        self.settled = True
+        self._ooms += 1
+        self._clean = 0
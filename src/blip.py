@@ -1,56 +1,88 @@
 from __future__ import annotations
 
+import time
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, List, Optional, Tuple, Union
 
-from PIL import Image
 import torch
 from torch.amp.autocast_mode import autocast
 from transformers import BlipProcessor, BlipForConditionalGeneration
 
 from .models import TaskModel
+from .images import load_image
+from .weights_cache import WeightsCache
 
 
 class BlipCaptionModel(TaskModel):
+    max_batch = 32
+
     def __init__(
         self,
         max_new_tokens: int = 40,
         num_beams: int = 3,
+        weights_dtype: torch.dtype = torch.float16,
+        use_weights_cache: bool = True,
     ) -> None:
         super().__init__(model_name='blip-image-captioning-base')
         self.max_new_tokens = max_new_tokens
         self.num_beams = num_beams
 
         self.device = torch.device('cuda')
+        self.weights_dtype = weights_dtype
+        self.use_weights_cache = use_weights_cache
         self._processor: Optional[BlipProcessor] = None
 
-    def activate(self) -> None:
-        processor = BlipProcessor.from_pretrained(
+    def _load_model(self) -> Tuple[BlipForConditionalGeneration, bool]:
+        cache = WeightsCache(self.model_dir, self.weights_dtype)
+        if self.use_weights_cache and cache.is_valid():
+            # converted safetensors in the target dtype, mapped rather than copied
+            model = BlipForConditionalGeneration.from_pretrained(
+                str(cache.dir),
+                local_files_only=True,
+                torch_dtype=self.weights_dtype,
+            )
+            return model, True
+
+        model = BlipForConditionalGeneration.from_pretrained(
             str(self.model_dir),
             local_files_only=True,
         )
-        model = BlipForConditionalGeneration.from_pretrained(
+        model = model.to(self.weights_dtype)
+        if self.use_weights_cache:
+            model.save_pretrained(str(cache.begin()), safe_serialization=True)
+            cache.commit()
+        return model, False
+
+    def activate(self) -> None:
+        t0 = time.perf_counter()
+        processor = BlipProcessor.from_pretrained(
             str(self.model_dir),
             local_files_only=True,
         )
+        model, cached = self._load_model()
         model.eval()
 
         self._processor = processor
         self._model = model.to(self.device)
+        self.report(f"blip activate ({'warm' if cached else 'cold'}): {time.perf_counter() - t0:.2f}s")
 
     def deactivate(self) -> None:
         self._processor = None
         super().deactivate()
 
+    def process(self, source: Union[Path, BinaryIO]) -> str:
+        return self.process_batch([source])[0]
+
     @torch.no_grad()
-    def process(self, path: Path) -> str:
+    def process_batch(self, sources: List[Union[Path, BinaryIO]]) -> List[str]:
         if self._model is None or self._processor is None:
             raise RuntimeError('Model is not activated. Call activate() first.')
 
-        with Image.open(path) as im:
-            image = im.convert('RGB')
+        size = self._processor.image_processor.size
+        target = max(size.get('height', 384), size.get('width', 384))
+        images = [load_image(s, target, self.max_decode_bytes) for s in sources]
 
-        inputs = self._processor(images=image, return_tensors='pt')
+        inputs = self._processor(images=images, return_tensors='pt')
         inputs = {k: v.to(self.device) for k, v in inputs.items()}
         with autocast(device_type=self.device.type, enabled=True):
             out = self._model.generate(
@@ -59,8 +91,7 @@ class BlipCaptionModel(TaskModel):
                 num_beams=self.num_beams,
             )
 
-        caption = self._processor.decode(out[0], skip_special_tokens=True).strip()
-        return caption
+        return [c.strip() for c in self._processor.batch_decode(out, skip_special_tokens=True)]
 
     def get_filed_name(self) -> str:
         return '_caption'
@@ -0,0 +1,162 @@
+from typing import List, Tuple
+from PySide6.QtCore import Qt, Signal
+from PySide6.QtWidgets import (
+    QAbstractItemView,
+    QDialog,
+    QDialogButtonBox,
+    QHBoxLayout,
+    QInputDialog,
+    QLineEdit,
+    QMessageBox,
+    QPushButton,
+    QTreeWidget,
+    QTreeWidgetItem,
+    QVBoxLayout,
+)
+
+
+class ImageGroupsDialog(QDialog):
+    activated = Signal(str)
+
+    def __init__(self, title: str, groups: List[Tuple[str, List[Tuple[str, str]]]], parent=None) -> None:
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.resize(520, 480)
+
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(['Image', 'Info'])
+        self.tree.setColumnWidth(0, 340)
+        for group_title, items in groups:
+            parent_item = QTreeWidgetItem([group_title, str(len(items))])
+            for id, info in items:
+                child = QTreeWidgetItem([id, info])
+                child.setData(0, Qt.UserRole, id)
+                parent_item.addChild(child)
+            self.tree.addTopLevelItem(parent_item)
+        self.tree.expandAll()
+        self.tree.itemDoubleClicked.connect(self._on_double_clicked)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        buttons.rejected.connect(self.reject)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.tree, 1)
+        layout.addWidget(buttons)
+
+    def _on_double_clicked(self, item: QTreeWidgetItem, column: int) -> None:
+        id = item.data(0, Qt.UserRole)
+        if id:
+            self.activated.emit(id)
+
+
+class TagStatsDialog(QDialog):
+    # the table is capped, the filter box reaches everything else
+    max_rows = 2000
+
+    def __init__(self, controller, parent=None) -> None:
+        super().__init__(parent)
+        self.controller = controller
+        self.setWindowTitle('Tag Stats')
+        self.resize(720, 560)
+
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText('Filter tags…')
+        self.filter_edit.setClearButtonEnabled(True)
+
+        self.tags_tree = QTreeWidget()
+        self.tags_tree.setHeaderLabels(['Tag', 'Images'])
+        self.tags_tree.setColumnWidth(0, 260)
+        self.tags_tree.setRootIsDecorated(False)
+        self.tags_tree.setSelectionMode(QAbstractItemView.ExtendedSelection)
+
+        self.cooc_tree = QTreeWidget()
+        self.cooc_tree.setHeaderLabels(['Appears with', 'Images'])
+        self.cooc_tree.setColumnWidth(0, 200)
+        self.cooc_tree.setRootIsDecorated(False)
+
+        self.rename_btn = QPushButton('Rename…')
+        self.merge_btn = QPushButton('Merge Into…')
+        self.delete_btn = QPushButton('Delete')
+        self.implies_btn = QPushButton('Implies…')
+
+        lists_row = QHBoxLayout()
+        lists_row.addWidget(self.tags_tree, 3)
+        lists_row.addWidget(self.cooc_tree, 2)
+
+        actions_row = QHBoxLayout()
+        actions_row.addWidget(self.rename_btn)
+        actions_row.addWidget(self.merge_btn)
+        actions_row.addWidget(self.delete_btn)
+        actions_row.addWidget(self.implies_btn)
+        actions_row.addStretch(1)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        buttons.rejected.connect(self.reject)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.filter_edit)
+        layout.addLayout(lists_row, 1)
+        layout.addLayout(actions_row)
+        layout.addWidget(buttons)
+
+        self.filter_edit.textChanged.connect(self.refresh)
+        self.tags_tree.itemSelectionChanged.connect(self._on_selection_changed)
+        self.rename_btn.clicked.connect(self._on_rename)
+        self.merge_btn.clicked.connect(self._on_merge)
+        self.delete_btn.clicked.connect(self._on_delete)
+        self.implies_btn.clicked.connect(self._on_implies)
+        self.refresh()
+
+    def refresh(self) -> None:
+        self.tags_tree.clear()
+        for tag, n in self.controller.tag_stats.top(self.max_rows, self.filter_edit.text()):
+            self.tags_tree.addTopLevelItem(QTreeWidgetItem([tag, str(n)]))
+        self.cooc_tree.clear()
+
+    def _selected(self) -> List[str]:
+        return [item.text(0) for item in self.tags_tree.selectedItems()]
+
+    def _on_selection_changed(self) -> None:
+        self.cooc_tree.clear()
+        tags = self._selected()
+        if len(tags) != 1:
+            return
+        for tag, n in self.controller.tag_stats.cooccurring(tags[0]):
+            self.cooc_tree.addTopLevelItem(QTreeWidgetItem([tag, str(n)]))
+
+    def _done(self, verb: str, n: int) -> None:
+        self.refresh()
+        QMessageBox.information(self, 'Tag Stats', f'{verb} in {n} images.')
+
+    def _on_rename(self) -> None:
+        tags = self._selected()
+        if len(tags) != 1:
+            return
+        new, ok = QInputDialog.getText(self, 'Rename Tag', f'Rename "{tags[0]}" to:', text=tags[0])
+        if ok and new.strip():
+            self._done('Renamed', self.controller.rename_tag(tags[0], new.strip()))
+
+    def _on_merge(self) -> None:
+        tags = self._selected()
+        if not tags:
+            return
+        target, ok = QInputDialog.getText(self, 'Merge Tags', f'Merge {len(tags)} tags into:', text=tags[0])
+        if ok and target.strip():
+            self._done('Merged', self.controller.merge_tags(tags, target.strip()))
+
+    def _on_delete(self) -> None:
+        tags = self._selected()
+        if not tags:
+            return
+        answer = QMessageBox.question(self, 'Delete Tags', f'Delete {", ".join(tags)} from every image?')
+        if answer != QMessageBox.Yes:
+            return
+        self._done('Deleted', sum(self.controller.delete_tag(t) for t in tags))
+
+    def _on_implies(self) -> None:
+        tags = self._selected()
+        if len(tags) != 1:
+            return
+        implied, ok = QInputDialog.getText(self, 'Tag Implies', f'Every image tagged "{tags[0]}" also gets:')
+        if ok and implied.strip():
+            self._done('Added', self.controller.implies_tag(tags[0], implied.strip()))
@@ -0,0 +1,241 @@
+from __future__ import annotations
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, IO, List, Optional, Tuple
+from .enums import EditKind
+from .imagefile import ImageFile
+
+
+@dataclass(frozen=True)
+class EditOp:
+    kind: str
+    id: str
+    tag: Optional[str] = None
+    index: int = -1
+    to: int = -1
+    old: Any = None
+    new: Any = None
+    ops: Tuple['EditOp', ...] = ()
+
+    def to_dict(self) -> Dict[str, Any]:
+        d: Dict[str, Any] = {'k': str(self.kind), 'id': self.id}
+        if self.tag is not None:
+            d['t'] = self.tag
+        if self.index >= 0:
+            d['i'] = self.index
+        if self.to >= 0:
+            d['to'] = self.to
+        if self.old is not None:
+            d['o'] = self.old
+        if self.new is not None:
+            d['n'] = self.new
+        if self.ops:
+            d['ops'] = [o.to_dict() for o in self.ops]
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> 'EditOp':
+        return cls(
+            kind=EditKind(d['k']),
+            id=d['id'],
+            tag=d.get('t'),
+            index=d.get('i', -1),
+            to=d.get('to', -1),
+            old=d.get('o'),
+            new=d.get('n'),
+            ops=tuple(cls.from_dict(o) for o in d.get('ops', ())),
+        )
+
+
+def invert(op: EditOp) -> EditOp:
+    if op.kind == EditKind.ADD:
+        return EditOp(EditKind.REMOVE, op.id, tag=op.tag, index=op.index)
+    if op.kind == EditKind.REMOVE:
+        return EditOp(EditKind.ADD, op.id, tag=op.tag, index=op.index)
+    if op.kind == EditKind.MOVE:
+        return EditOp(EditKind.MOVE, op.id, index=op.to, to=op.index)
+    if op.kind == EditKind.REPLACE:
+        return EditOp(EditKind.REPLACE, op.id, index=op.index, old=op.new, new=op.old)
+    if op.kind == EditKind.BATCH:
+        return EditOp(EditKind.BATCH, op.id, ops=tuple(invert(o) for o in reversed(op.ops)))
+    if op.kind == EditKind.RELABEL:
+        return EditOp(EditKind.UNRELABEL, op.id, index=op.index, old=op.old, new=op.new)
+    if op.kind == EditKind.UNRELABEL:
+        return EditOp(EditKind.RELABEL, op.id, index=op.index, old=op.old, new=op.new)
+    if op.kind in (EditKind.CAPTION, EditKind.SET):
+        return EditOp(op.kind, op.id, old=op.new, new=op.old)
+    raise ValueError(f'Unknown edit kind: {op.kind}')
+
+
+def apply_op(files: Dict[str, ImageFile], op: EditOp) -> None:
+    if op.kind == EditKind.BATCH:
+        for o in op.ops:
+            apply_op(files, o)
+        return
+    # old holds the source tags and new the target; index numbers the relabel, the store keeps what it changed
+    # under that number so the undo restores exactly those tags
+    if op.kind == EditKind.RELABEL:
+        files.relabel(op.index, list(op.old), op.new)
+        return
+    if op.kind == EditKind.UNRELABEL:
+        files.unrelabel(op.index, list(op.old), op.new)
+        return
+
+    img = files.get(op.id)
+    if img is None:
+        return
+
+    if op.kind == EditKind.CAPTION:
+        img['caption'] = [op.new] if op.new is not None else None
+        return
+    if op.kind == EditKind.SET:
+        img['tags'] = list(op.new)
+        return
+
+    tags = img.edit_tags()
+    if op.kind == EditKind.ADD:
+        tags.insert(op.index if op.index >= 0 else len(tags), op.tag)
+    elif op.kind == EditKind.REMOVE:
+        if 0 <= op.index < len(tags) and tags[op.index] == op.tag:
+            del tags[op.index]
+        elif op.tag in tags:
+            tags.remove(op.tag)
+    elif op.kind == EditKind.MOVE:
+        if 0 <= op.index < len(tags):
+            tags.insert(min(op.to, len(tags) - 1), tags.pop(op.index))
+    elif op.kind == EditKind.REPLACE:
+        i = op.index if 0 <= op.index < len(tags) and tags[op.index] == op.old else -1
+        if i < 0 and op.old in tags:
+            i = tags.index(op.old)
+        if i >= 0:
+            tags[i] = op.new
+    else:
+        raise ValueError(f'Unknown edit kind: {op.kind}')
+
+
+def touched_ids(op: EditOp) -> List[str]:
+    # a relabel has no id, the images it reaches are never listed
+    if op.kind == EditKind.BATCH:
+        return list(dict.fromkeys(o.id for o in op.ops if o.id))
+    return [op.id] if op.id else []
+
+
+def relabel_of(op: EditOp) -> Optional[EditOp]:
+    ops = op.ops if op.kind == EditKind.BATCH else (op,)
+    return next((o for o in ops if o.kind in (EditKind.RELABEL, EditKind.UNRELABEL)), None)
+
+
+class EditLog:
+    def __init__(self, path: Path):
+        self.path = path
+        self.compacting_path = path.with_suffix(path.suffix + '.compacting')
+        self.seq = 0
+        self.pending = 0
+        self._undo: List[EditOp] = []
+        self._redo: List[EditOp] = []
+        self._f: Optional[IO[str]] = None
+
+    def _read(self, path: Path):
+        if not path.exists():
+            return
+        with path.open('r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # torn write at the tail of the log
+                    return
+                yield entry['seq'], EditOp.from_dict(entry['op'])
+
+    def replay(self, files: Dict[str, ImageFile], after_seq: int = 0) -> int:
+        self.seq = after_seq
+        replayed = 0
+        for path in (self.compacting_path, self.path):
+            for seq, op in self._read(path):
+                if seq <= self.seq:
+                    continue
+                apply_op(files, op)
+                self.seq = seq
+                replayed += 1
+        return replayed
+
+    def open(self, files: Dict[str, ImageFile], after_seq: int = 0) -> int:
+        self.close()
+        self._undo = []
+        self._redo = []
+        replayed = self.replay(files, after_seq)
+        self.pending = replayed
+        self._f = self.path.open('a', encoding='utf-8')
+        return replayed
+
+    def _record(self, op: EditOp) -> None:
+        self.seq += 1
+        self.pending += 1
+        if self._f is not None:
+            self._f.write(json.dumps({'seq': self.seq, 'op': op.to_dict()}, ensure_ascii=False) + '\n')
+            self._f.flush()
+
+    def do(self, files: Dict[str, ImageFile], op: EditOp) -> None:
+        apply_op(files, op)
+        self._record(op)
+        self._undo.append(op)
+        self._redo.clear()
+
+    def undo(self, files: Dict[str, ImageFile]) -> Optional[EditOp]:
+        if not self._undo:
+            return None
+        op = self._undo.pop()
+        inv = invert(op)
+        apply_op(files, inv)
+        self._record(inv)
+        self._redo.append(op)
+        return inv
+
+    def redo(self, files: Dict[str, ImageFile]) -> Optional[EditOp]:
+        if not self._redo:
+            return None
+        op = self._redo.pop()
+        apply_op(files, op)
+        self._record(op)
+        self._undo.append(op)
+        return op
+
+    def next_undo(self) -> Optional[EditOp]:
+        return self._undo[-1] if self._undo else None
+
+    def next_redo(self) -> Optional[EditOp]:
+        return self._redo[-1] if self._redo else None
+
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def rotate(self) -> None:
+        # the current log moves aside while a snapshot is written, new edits go to a fresh file
+        if self._f is not None:
+            self._f.close()
+        if self.path.exists():
+            if self.compacting_path.exists():
+                with self.compacting_path.open('a', encoding='utf-8') as dst:
+                    dst.write(self.path.read_text(encoding='utf-8'))
+                self.path.unlink()
+            else:
+                self.path.replace(self.compacting_path)
+        self.pending = 0
+        self._f = self.path.open('a', encoding='utf-8')
+
+    def finish_compaction(self) -> None:
+        self.compacting_path.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def discard(self) -> None:
+        self.close()
+        self.compacting_path.unlink(missing_ok=True)
+        self.path.unlink(missing_ok=True)
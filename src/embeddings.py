@@ -0,0 +1,245 @@
+from __future__ import annotations
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+
+SEARCH_CHUNK = 65536
+
+
+def _normalize(vec: np.ndarray) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32).reshape(-1)
+    n = float(np.linalg.norm(v))
+    return v / n if n > 0 else v
+
+
+def _merge_topk(scores: np.ndarray, rows: np.ndarray, best: Tuple[np.ndarray, np.ndarray], k: int):
+    all_scores = np.concatenate([best[0], scores])
+    all_rows = np.concatenate([best[1], rows])
+    if len(all_scores) > k:
+        keep = np.argpartition(-all_scores, k - 1)[:k]
+        all_scores, all_rows = all_scores[keep], all_rows[keep]
+    return all_scores, all_rows
+
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, size: int):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.size = size
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, n_lists: int, iters: int = 10, sample: int = 65536, seed: int = 0) -> 'IVFIndex':
+        rng = np.random.default_rng(seed)
+        n = len(matrix)
+        pick = np.sort(rng.choice(n, size=min(n, max(sample, n_lists * 32)), replace=False))
+        train = np.asarray(matrix[pick], dtype=np.float32)
+        centroids = train[rng.choice(len(train), size=n_lists, replace=False)].copy()
+
+        # spherical k-means on a sample, the vectors are already unit length
+        for _ in range(iters):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, train)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            filled = norms[:, 0] > 0
+            centroids[filled] = sums[filled] / norms[filled]
+
+        assign = np.empty(n, dtype=np.int32)
+        for start in range(0, n, SEARCH_CHUNK):
+            block = np.asarray(matrix[start:start + SEARCH_CHUNK], dtype=np.float32)
+            assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        order = np.argsort(assign, kind='stable').astype(np.int64)
+        offsets = np.searchsorted(assign[order], np.arange(n_lists + 1))
+        return cls(centroids, order, offsets, n)
+
+    def candidates(self, q: np.ndarray, nprobe: int) -> np.ndarray:
+        probe = np.argsort(-(self.centroids @ q))[:nprobe]
+        rows = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+        # sorted rows keep the memmap reads mostly sequential
+        return np.sort(rows)
+
+    def save(self, path: Path) -> None:
+        tmp = path.with_suffix('.tmp.npz')
+        np.savez(tmp, centroids=self.centroids, order=self.order, offsets=self.offsets, size=np.int64(self.size))
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['IVFIndex']:
+        try:
+            with np.load(path) as npz:
+                return cls(npz['centroids'], npz['order'], npz['offsets'], int(npz['size']))
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+class EmbeddingStore:
+    # the id list is written at most this often while results keep coming, the vectors are in the memmap already
+    flush_interval = 60.0
+
+    def __init__(self, folder: Path, ivf_threshold: int = 1_000_000, nprobe: int = 8):
+        self.data_path = folder / 'embeddings.f16'
+        self.meta_path = folder / 'embeddings.json'
+        self.ivf_path = folder / 'embeddings.ivf.npz'
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.dim: Optional[int] = None
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self._mm: Optional[np.memmap] = None
+        self._ivf: Optional[IVFIndex] = None
+        self._dirty = False
+        self._flushed = time.monotonic()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _load(self) -> None:
+        if not (self.meta_path.exists() and self.data_path.exists()):
+            return
+        try:
+            with self.meta_path.open('r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except json.JSONDecodeError:
+            return
+        dim = int(meta.get('dim') or 0)
+        ids = list(meta.get('ids') or [])
+        capacity = self.data_path.stat().st_size // (dim * 2) if dim else 0
+        if not dim or capacity < len(ids):
+            return
+        self.dim = dim
+        self.ids = ids
+        self.rows = {id: i for i, id in enumerate(ids) if id}
+        self._mm = np.memmap(self.data_path, dtype=np.float16, mode='r+', shape=(capacity, dim))
+        if self.ivf_path.exists():
+            ivf = IVFIndex.load(self.ivf_path)
+            # rows are never reused, an index over a prefix of them stays valid
+            if ivf is not None and ivf.size <= len(ids) and ivf.centroids.shape[1] == dim:
+                self._ivf = ivf
+
+    def _ensure_capacity(self, n: int) -> None:
+        capacity = 0 if self._mm is None else self._mm.shape[0]
+        if n <= capacity:
+            return
+        new_capacity = max(1024, capacity * 2, n)
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm = None
+        with self.data_path.open('ab') as f:
+            f.truncate(new_capacity * self.dim * 2)
+        self._mm = np.memmap(self.data_path, dtype=np.float16, mode='r+', shape=(new_capacity, self.dim))
+
+    def put(self, id: str, vec: np.ndarray) -> None:
+        v = _normalize(vec)
+        if self.dim is None:
+            self.dim = len(v)
+        if len(v) != self.dim:
+            raise ValueError(f'embedding dim {len(v)} does not match store dim {self.dim}')
+
+        row = self.rows.get(id)
+        if row is None:
+            row = len(self.ids)
+            self._ensure_capacity(row + 1)
+            self.ids.append(id)
+            self.rows[id] = row
+        self._mm[row] = v.astype(np.float16)
+        self._changed()
+
+    def rename(self, old_id: str, new_id: str) -> None:
+        row = self.rows.pop(old_id, None)
+        if row is None:
+            return
+        self.ids[row] = new_id
+        self.rows[new_id] = row
+        self._changed()
+
+    def remove(self, id: str) -> None:
+        # the row stays as an empty slot so row numbers, and an index built on them, stay valid
+        row = self.rows.pop(id, None)
+        if row is None:
+            return
+        self.ids[row] = ''
+        self._mm[row] = 0
+        self._changed()
+
+    def _changed(self) -> None:
+        self._dirty = True
+        if time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def get(self, id: str) -> Optional[np.ndarray]:
+        row = self.rows.get(id)
+        if row is None:
+            return None
+        return np.asarray(self._mm[row], dtype=np.float32)
+
+    def _matrix(self) -> np.ndarray:
+        return self._mm[:len(self.ids)]
+
+    def needs_index(self) -> bool:
+        n = len(self.ids)
+        if n < self.ivf_threshold:
+            return False
+        # rebuilt once the unindexed tail grows past 10%
+        return self._ivf is None or n > self._ivf.size * 1.1
+
+    def build_index(self) -> IVFIndex:
+        # runs on a worker thread: rows below n are only ever overwritten in place, the memmap is not reallocated
+        # under a reference held here, and the result is saved before the UI thread swaps it in
+        mm, n = self._mm, len(self.ids)
+        ivf = IVFIndex.build(mm[:n], n_lists=int(np.sqrt(n)))
+        ivf.save(self.ivf_path)
+        return ivf
+
+    def set_index(self, ivf: IVFIndex) -> None:
+        if ivf.size <= len(self.ids) and (self._ivf is None or ivf.size > self._ivf.size):
+            self._ivf = ivf
+
+    def search(self, vec: np.ndarray, k: int = 20, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        if not self.ids:
+            return []
+        q = _normalize(vec)
+        matrix = self._matrix()
+        kk = k + 1 if exclude is not None else k
+        best = (np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64))
+
+        # searched by brute force until a worker has built the index
+        ivf = self._ivf if len(self.ids) >= self.ivf_threshold else None
+        if ivf is not None:
+            rows = ivf.candidates(q, self.nprobe)
+            # rows appended after the build are always scanned
+            tail = np.arange(ivf.size, len(self.ids), dtype=np.int64)
+            rows = np.concatenate([rows, tail])
+            for start in range(0, len(rows), SEARCH_CHUNK):
+                part = rows[start:start + SEARCH_CHUNK]
+                scores = np.asarray(matrix[part], dtype=np.float32) @ q
+                best = _merge_topk(scores, part, best, kk)
+        else:
+            for start in range(0, len(matrix), SEARCH_CHUNK):
+                block = np.asarray(matrix[start:start + SEARCH_CHUNK], dtype=np.float32)
+                scores = block @ q
+                best = _merge_topk(scores, np.arange(start, start + len(block), dtype=np.int64), best, kk)
+
+        order = np.argsort(-best[0])
+        res = [(self.ids[int(best[1][i])], float(best[0][i])) for i in order]
+        return [r for r in res if r[0] and r[0] != exclude][:k]
+
+    def flush(self) -> None:
+        if not self._dirty or self._mm is None:
+            return
+        self._mm.flush()
+        tmp = self.meta_path.with_suffix(self.meta_path.suffix + '.tmp')
+        with tmp.open('w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'ids': self.ids}, f, ensure_ascii=False)
+        tmp.replace(self.meta_path)
+        self._dirty = False
+        self._flushed = time.monotonic()
+
+    def close(self) -> None:
+        self.flush()
+        self._mm = None
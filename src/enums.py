@@ -17,13 +17,34 @@ class FileState(StrEnum):
     ERROR = 'error'
 
 
+class ErrorKind(StrEnum):
+    FILE = 'file'
+    IO = 'io'
+    MODEL = 'model'
+
+
 class Fileds(StrEnum):
     ID = 'id'
     FILES = 'files'
     STATUS = 'status'
     TAGS = 'tags'
+    QUARANTINE = 'quarantine'
 
 
 class WorkerName(StrEnum):
     Scan_Worker = 'ScanWorker'
     AIWorker = 'AIWorker'
+    Compact_Worker = 'CompactWorker'
+    Thumb_Worker = 'ThumbWorker'
+
+
+class EditKind(StrEnum):
+    ADD = 'add'
+    REMOVE = 'remove'
+    MOVE = 'move'
+    CAPTION = 'caption'
+    SET = 'set'
+    REPLACE = 'replace'
+    BATCH = 'batch'
+    RELABEL = 'relabel'
+    UNRELABEL = 'unrelabel'
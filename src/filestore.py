@@ -0,0 +1,694 @@
+from __future__ import annotations
+import json
+import os
+import re
+import sys
+from array import array
+from collections.abc import MutableMapping, MutableSequence
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from .enums import FileState
+from .imagefile import ImageFile, tag_name
+
+STATUSES: List[FileState] = list(FileState)
+_STATUS_CODE = {str(s): i for i, s in enumerate(STATUSES)}
+# auto tags keep their score as hundredths of a percent, this marks a tag without one
+NO_SCORE = 0xFFFF
+_SCORED_RE = re.compile(r'^(.*) \((\d+)(?:\.(\d{1,2}))?%\)$', re.MULTILINE)
+# the exact format TaskModel results are written in, 'name (93.12%)'
+_SCORED_2DP_RE = re.compile(r'^(.*) \((\d+)\.(\d\d)%\)$', re.MULTILINE)
+# properties held in columns, everything else goes to a sparse per-row dict
+_COLUMNS = ('tags', '_tags', 'caption', '_caption', '_phash')
+# rows, positions and tag ids of a relabel that found nothing
+_NO_MOVES = (np.empty(0, dtype=np.int64),) * 3
+
+
+class TagVocab:
+    __slots__ = ('names', '_ids')
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self.seed(names)
+
+    def seed(self, names: Iterable[str]) -> None:
+        for name in names:
+            self.id(name)
+
+    def id(self, name: str) -> int:
+        tid = self._ids.get(name)
+        if tid is None:
+            tid = len(self.names)
+            name = sys.intern(name)
+            self._ids[name] = tid
+            self.names.append(name)
+        return tid
+
+    def get(self, name: str) -> Optional[int]:
+        return self._ids.get(name)
+
+    def ids(self, names: List[str]) -> np.ndarray:
+        for name in sorted(set(names).difference(self._ids)):
+            self.id(name)
+        return np.fromiter(map(self._ids.__getitem__, names), dtype=np.uint64, count=len(names))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def copy(self) -> 'TagVocab':
+        vocab = TagVocab()
+        vocab.names = list(self.names)
+        vocab._ids = dict(self._ids)
+        return vocab
+
+
+# shared by every loaded root so each tag string exists once
+DEFAULT_VOCAB = TagVocab()
+
+
+def _caption_value(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return str(value[0]) if value else ''
+    return str(value)
+
+
+class TagList(MutableSequence):
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store: 'FileStore', row: int):
+        self._store = store
+        self._row = row
+
+    def _arr(self) -> array:
+        return self._store._user_tags[self._row]
+
+    def __len__(self) -> int:
+        return len(self._arr())
+
+    def __getitem__(self, i):
+        names = self._store.vocab.names
+        if isinstance(i, slice):
+            return [names[t] for t in self._arr()[i]]
+        return names[self._arr()[i]]
+
+    def __setitem__(self, i, value) -> None:
+        if isinstance(i, slice):
+            self._arr()[i] = array('I', (self._store.vocab.id(v) for v in value))
+        else:
+            self._arr()[i] = self._store.vocab.id(value)
+
+    def __delitem__(self, i) -> None:
+        del self._arr()[i]
+
+    def insert(self, i: int, value: str) -> None:
+        self._arr().insert(i, self._store.vocab.id(value))
+
+    # lookups compare tag ids inside the array instead of decoding every name
+    def __iter__(self) -> Iterator[str]:
+        names = self._store.vocab.names
+        return iter([names[t] for t in self._arr()])
+
+    def __contains__(self, value: object) -> bool:
+        tid = self._store.vocab.get(value) if isinstance(value, str) else None
+        return tid is not None and tid in self._arr()
+
+    def index(self, value: str, start: int = 0, stop: int = sys.maxsize) -> int:
+        tid = self._store.vocab.get(value)
+        if tid is None:
+            raise ValueError(f'{value!r} is not in list')
+        return self._arr().index(tid, start, stop)
+
+    def count(self, value: str) -> int:
+        tid = self._store.vocab.get(value)
+        return self._arr().count(tid) if tid is not None else 0
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (list, tuple, TagList)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+class ImageView:
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store: 'FileStore', row: int):
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, '_row', row)
+
+    @property
+    def id(self) -> str:
+        return self._store._ids[self._row]
+
+    @property
+    def path(self) -> Path:
+        s = self._store
+        return Path(s._dirs[s._dir[self._row]], s._names[self._row])
+
+    @path.setter
+    def path(self, value: Path) -> None:
+        self._store._set_path(self._row, value)
+
+    @property
+    def status(self) -> FileState:
+        return STATUSES[self._store._status[self._row]]
+
+    @status.setter
+    def status(self, value: str) -> None:
+        self._store._status[self._row] = _STATUS_CODE[str(value)]
+
+    @property
+    def properties(self) -> Dict[str, Any]:
+        # a copy, writes go through item assignment
+        return self._store._properties(self._row)
+
+    def __getattr__(self, name: str):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self._store._get(self._row, name)
+
+    def __getitem__(self, key: str) -> Any:
+        return self._store._get(self._row, key)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in ('id', 'path', 'status'):
+            object.__setattr__(self, name, value)
+        else:
+            self._store._set(self._row, name, value)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._store._set(self._row, key, value)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, ImageView) and other._store is self._store and other._row == self._row
+
+    def __hash__(self) -> int:
+        return hash((id(self._store), self._row))
+
+    def __repr__(self) -> str:
+        return f'ImageView(id={self.id!r}, status={self.status!r})'
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        s = self._store
+        value = s._get_own(self._row, key)
+        if key in _COLUMNS:
+            s._set(self._row, key, None)
+        else:
+            s._extra.get(self._row, {}).pop(key, None)
+        return default if value is None else value
+
+    def edit_tags(self) -> TagList:
+        s = self._store
+        if s._user_tags[self._row] is None:
+            auto = s._auto_tags[self._row]
+            s._user_tags[self._row] = array('I', (e >> 16 for e in auto)) if auto is not None else array('I')
+        return TagList(s, self._row)
+
+    def effective_tags(self) -> List[str]:
+        s = self._store
+        names = s.vocab.names
+        user = s._user_tags[self._row]
+        if user is not None:
+            return [names[t] for t in user]
+        auto = s._auto_tags[self._row]
+        return [names[e >> 16] for e in auto] if auto is not None else []
+
+    def caption_text(self) -> str:
+        s = self._store
+        text = s._user_caption[self._row]
+        if text is None:
+            text = s._auto_caption[self._row]
+        return text or ''
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            '__type__': 'ImageFile',
+            'id': self.id,
+            'path': self.path.as_posix(),
+            'status': self.status,
+            'properties': self._store._properties(self._row),
+        }
+
+
+def _pack_strings(strings: Iterable[str]) -> np.ndarray:
+    return np.frombuffer(''.join(s + '\0' for s in strings).encode('utf-8'), dtype=np.uint8)
+
+
+def _unpack_strings(buf: np.ndarray) -> List[str]:
+    return buf.tobytes().decode('utf-8').split('\0')[:-1]
+
+
+def _split_rows(buf: bytes, lens: np.ndarray, typecode: str) -> List[Optional[array]]:
+    res: List[Optional[array]] = []
+    view = memoryview(buf)
+    size = array(typecode).itemsize
+    start = 0
+    for n in lens.tolist():
+        if n < 0:
+            res.append(None)
+            continue
+        a = array(typecode)
+        a.frombytes(view[start:start + n * size])
+        res.append(a)
+        start += n * size
+    return res
+
+
+class FileStore(MutableMapping):
+    # auto tags converted per batch while loading, bounds the temporary strings
+    load_chunk = 1 << 16
+
+    def __init__(self, vocab: Optional[TagVocab] = None):
+        self.vocab = vocab if vocab is not None else DEFAULT_VOCAB
+        self._rows: Dict[str, int] = {}
+        # row -> id, None once the row is deleted; rows are never reused so views stay readable
+        self._ids: List[Optional[str]] = []
+        self._dirs: List[str] = []
+        self._dir_ids: Dict[str, int] = {}
+        self._dir = array('I')
+        self._names: List[str] = []
+        self._status = bytearray()
+        # (tag id << 16) | score, in model output order
+        self._auto_tags: List[Optional[array]] = []
+        self._user_tags: List[Optional[array]] = []
+        self._auto_caption: List[Optional[str]] = []
+        self._user_caption: List[Optional[str]] = []
+        self._phash = array('Q')
+        self._has_phash = bytearray()
+        self._extra: Dict[int, Dict[str, Any]] = {}
+        # what each relabel changed, by its number, so undoing it puts back exactly those tags
+        self._relabels: Dict[int, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._rows)
+
+    def __contains__(self, id: object) -> bool:
+        return id in self._rows
+
+    def __getitem__(self, id: str) -> ImageView:
+        return ImageView(self, self._rows[id])
+
+    def get(self, id: str, default: Any = None) -> Any:
+        row = self._rows.get(id)
+        return ImageView(self, row) if row is not None else default
+
+    def __setitem__(self, id: str, img: Any) -> None:
+        if isinstance(img, ImageView) and img._store is self:
+            if self._rows.get(id) == img._row:
+                return
+            img = ImageFile.from_dict(img.to_dict())
+        row = self._rows.get(id)
+        if row is None:
+            row = self._append(id, img.path, img.status)
+        else:
+            self._clear(row)
+            self._set_path(row, img.path)
+            self._status[row] = _STATUS_CODE[str(img.status)]
+        for k, v in img.properties.items():
+            self._set(row, k, v)
+
+    def __delitem__(self, id: str) -> None:
+        row = self._rows.pop(id)
+        self._ids[row] = None
+
+    def add(self, id: str, path: Path, status: str) -> ImageView:
+        if id in self._rows:
+            del self[id]
+        return ImageView(self, self._append(id, path, status))
+
+    def rename(self, old: str, new: str, path: Path) -> Optional[ImageView]:
+        row = self._rows.pop(old, None)
+        if row is None:
+            return None
+        if new in self._rows:
+            del self[new]
+        self._rows[new] = row
+        self._ids[row] = new
+        self._set_path(row, path)
+        return ImageView(self, row)
+
+    def _append(self, id: str, path: Path, status: str) -> int:
+        row = len(self._ids)
+        self._rows[id] = row
+        self._ids.append(id)
+        self._dir.append(0)
+        self._names.append('')
+        self._set_path(row, path)
+        self._status.append(_STATUS_CODE[str(status)])
+        self._auto_tags.append(None)
+        self._user_tags.append(None)
+        self._auto_caption.append(None)
+        self._user_caption.append(None)
+        self._phash.append(0)
+        self._has_phash.append(0)
+        return row
+
+    def _clear(self, row: int) -> None:
+        self._auto_tags[row] = None
+        self._user_tags[row] = None
+        self._auto_caption[row] = None
+        self._user_caption[row] = None
+        self._has_phash[row] = 0
+        self._extra.pop(row, None)
+
+    def _set_path(self, row: int, path: Path) -> None:
+        folder, name = os.path.split(os.fspath(path))
+        d = self._dir_ids.get(folder)
+        if d is None:
+            d = len(self._dirs)
+            self._dir_ids[folder] = d
+            self._dirs.append(folder)
+        self._dir[row] = d
+        self._names[row] = name
+
+    def _get_own(self, row: int, key: str) -> Any:
+        if key == 'tags':
+            return TagList(self, row) if self._user_tags[row] is not None else None
+        if key == '_tags':
+            auto = self._auto_tags[row]
+            return self._format_auto(auto) if auto is not None else None
+        if key == 'caption':
+            text = self._user_caption[row]
+            return [text] if text is not None else None
+        if key == '_caption':
+            text = self._auto_caption[row]
+            return [text] if text is not None else None
+        if key == '_phash':
+            return f'{self._phash[row]:016x}' if self._has_phash[row] else None
+        return self._extra.get(row, {}).get(key)
+
+    def _get(self, row: int, key: str) -> Any:
+        # same lookup as ImageFile: the key itself, then its '_' prefixed auto value
+        v = self._get_own(row, key)
+        if v is None:
+            v = self._get_own(row, '_' + key)
+        return v
+
+    def _set(self, row: int, key: str, value: Any) -> None:
+        if key == 'tags':
+            self._user_tags[row] = array('I', (self.vocab.id(t) for t in value)) if value is not None else None
+        elif key == '_tags':
+            self._auto_tags[row] = self._parse_auto(value) if value is not None else None
+        elif key == 'caption':
+            self._user_caption[row] = _caption_value(value)
+        elif key == '_caption':
+            self._auto_caption[row] = _caption_value(value)
+        elif key == '_phash':
+            self._has_phash[row] = value is not None
+            self._phash[row] = int(value, 16) if value is not None else 0
+        else:
+            self._extra.setdefault(row, {})[key] = value
+
+    def _pack_auto(self, tag_lists: List[List[str]]) -> Optional[List[array]]:
+        # one regex pass and one numpy conversion for many images, None unless every tag is in the standard format
+        count = sum(len(tags) for tags in tag_lists)
+        joined = '\n'.join('\n'.join(tags) for tags in tag_lists)
+        if not count or joined.count('\n') != count - 1:
+            return None
+        found = _SCORED_2DP_RE.findall(joined)
+        if len(found) != count:
+            return None
+        whole = np.array(list(map(itemgetter(1), found)), dtype=np.uint64)
+        hundredths = np.array(list(map(itemgetter(2), found)), dtype=np.uint64)
+        ids = self.vocab.ids(list(map(itemgetter(0), found)))
+        packed = (ids << np.uint64(16) | whole * 100 + hundredths).tobytes()
+        res = []
+        start = 0
+        for tags in tag_lists:
+            end = start + len(tags) * 8
+            auto = array('Q')
+            auto.frombytes(packed[start:end])
+            res.append(auto)
+            start = end
+        return res
+
+    def _set_auto_many(self, pending: List[Tuple[int, List[str]]]) -> None:
+        packed = self._pack_auto([tags for _, tags in pending])
+        for i, (row, tags) in enumerate(pending):
+            self._auto_tags[row] = packed[i] if packed is not None else self._parse_auto(tags)
+
+    def _parse_auto(self, tags: List[str]) -> array:
+        packed = self._pack_auto([tags])
+        if packed is not None:
+            return packed[0]
+        vocab = self.vocab
+        res = array('Q')
+        for t in tags:
+            m = _SCORED_RE.match(t)
+            if m is not None and '\n' not in t:
+                n, i, f = m.groups()
+                res.append(vocab.id(n) << 16 | int(i) * 100 + int((f or '').ljust(2, '0')))
+            else:
+                res.append(vocab.id(tag_name(t)) << 16 | NO_SCORE)
+        return res
+
+    def _format_auto(self, auto: array) -> List[str]:
+        names = self.vocab.names
+        res = []
+        for e in auto:
+            score = e & 0xFFFF
+            name = names[e >> 16]
+            res.append(name if score == NO_SCORE else f'{name} ({score // 100}.{score % 100:02d}%)')
+        return res
+
+    def _properties(self, row: int) -> Dict[str, Any]:
+        props: Dict[str, Any] = {}
+        for key in _COLUMNS:
+            v = self._get_own(row, key)
+            if v is not None:
+                props[key] = list(v) if isinstance(v, TagList) else v
+        for k, v in self._extra.get(row, {}).items():
+            props[k] = list(v) if isinstance(v, list) else v
+        return props
+
+    def copy(self) -> 'FileStore':
+        # detached from later edits and cheap enough for the UI thread, encoding it can then run elsewhere;
+        # auto tag arrays are only ever replaced, user tag arrays are edited in place and duplicated
+        store = FileStore(self.vocab.copy())
+        store._rows = dict(self._rows)
+        store._ids = list(self._ids)
+        store._dirs = list(self._dirs)
+        store._dir_ids = dict(self._dir_ids)
+        store._dir = self._dir[:]
+        store._names = list(self._names)
+        store._status = bytearray(self._status)
+        store._auto_tags = list(self._auto_tags)
+        store._user_tags = [a[:] if a is not None else None for a in self._user_tags]
+        store._auto_caption = list(self._auto_caption)
+        store._user_caption = list(self._user_caption)
+        store._phash = self._phash[:]
+        store._has_phash = bytearray(self._has_phash)
+        store._extra = {r: dict(v) for r, v in self._extra.items()}
+        store._relabels = dict(self._relabels)
+        return store
+
+    @staticmethod
+    def _flat(arrays: List[Optional[array]], dtype: type, shift: int) -> Tuple[np.ndarray, np.ndarray]:
+        # tags per row and the tag ids of all rows end to end
+        lens = np.fromiter((len(a) if a is not None else 0 for a in arrays), dtype=np.int64, count=len(arrays))
+        flat = np.frombuffer(b''.join(a.tobytes() for a in arrays if a is not None), dtype=dtype)
+        return lens, (flat >> dtype(shift)).astype(np.int64)
+
+    def _find(self, arrays: List[Optional[array]], dtype: type, shift: int, tids: List[int]) -> Tuple[np.ndarray, ...]:
+        # rows, positions and tag ids of every listed tag, one numpy pass over all rows
+        lens, flat = self._flat(arrays, dtype, shift)
+        hits = np.flatnonzero(np.isin(flat, tids))
+        ends = np.cumsum(lens)
+        rows = np.searchsorted(ends, hits, side='right')
+        hits = hits[np.fromiter((self._ids[r] is not None for r in rows.tolist()), dtype=bool, count=len(rows))]
+        rows = np.searchsorted(ends, hits, side='right')
+        return rows, hits - (ends - lens)[rows], flat[hits]
+
+    def relabel(self, n: int, sources: List[str], target: str) -> None:
+        # every source becomes the target in user and auto tags alike
+        sids = [t for t in (self.vocab.get(s) for s in dict.fromkeys(sources) if s != target) if t is not None]
+        if not sids:
+            self._relabels[n] = {'user': _NO_MOVES, 'auto': _NO_MOVES, 'auto_arrays': {}, 'derived': set()}
+            return
+        tid = self.vocab.id(target)
+        user = self._find(self._user_tags, np.uint32, 0, sids)
+        for row, pos in zip(user[0].tolist(), user[1].tolist()):
+            self._user_tags[row][pos] = tid
+        auto = self._find(self._auto_tags, np.uint64, 16, sids)
+        arrays: Dict[int, array] = {}
+        for row, pos in zip(auto[0].tolist(), auto[1].tolist()):
+            a = arrays.get(row)
+            if a is None:
+                # auto tag arrays are replaced, never edited in place
+                a = arrays[row] = self._auto_tags[row][:]
+                self._auto_tags[row] = a
+            a[pos] = tid << 16 | a[pos] & 0xFFFF
+        # rows shown from their auto tags, editing them later copies the relabeled tags into user tags
+        derived = {row for row in arrays if self._user_tags[row] is None}
+        self._relabels[n] = {'user': user, 'auto': auto, 'auto_arrays': arrays, 'derived': derived}
+
+    def unrelabel(self, n: int, sources: List[str], target: str) -> None:
+        # the edits logged after the relabel were undone first, so every recorded position is where it was;
+        # one still holding something else was changed outside the log and is left alone
+        rec = self._relabels.pop(n, None)
+        tid = self.vocab.get(target)
+        if rec is None or tid is None:
+            return
+        for row, pos, sid in zip(*(c.tolist() for c in rec['user'])):
+            arr = self._user_tags[row]
+            if arr is not None and pos < len(arr) and arr[pos] == tid:
+                arr[pos] = sid
+        arrays = rec['auto_arrays']
+        restored: Dict[int, array] = {}
+        for row, pos, sid in zip(*(c.tolist() for c in rec['auto'])):
+            # auto tags replaced by a new result since are not the ones that were relabeled
+            a = restored.get(row)
+            if a is None and self._auto_tags[row] is arrays.get(row):
+                a = restored[row] = self._auto_tags[row] = arrays[row][:]
+            if a is not None:
+                a[pos] = sid << 16 | a[pos] & 0xFFFF
+            arr = self._user_tags[row] if row in rec['derived'] else None
+            if arr is not None and pos < len(arr) and arr[pos] == tid:
+                arr[pos] = sid
+
+    def clear_relabels(self) -> None:
+        self._relabels.clear()
+
+    def dump_relabels(self) -> Dict[str, Any]:
+        # by image id and tag name, row numbers and tag ids do not survive a reload
+        ids, names = self._ids, self.vocab.names
+
+        def moves(rows, pos, tids) -> List[list]:
+            keep = [i for i, r in enumerate(rows.tolist()) if ids[r] is not None]
+            return [[ids[rows[i]] for i in keep], [int(pos[i]) for i in keep], [names[tids[i]] for i in keep]]
+
+        return {
+            str(n): {
+                'user': moves(*rec['user']),
+                'auto': moves(*rec['auto']),
+                'derived': [ids[r] for r in rec['derived'] if ids[r] is not None],
+            }
+            for n, rec in self._relabels.items()
+        }
+
+    def load_relabels(self, raw: Optional[Dict[str, Any]]) -> None:
+        def moves(ids, pos, tags):
+            keep = [i for i, id in enumerate(ids) if id in self._rows]
+            return (
+                np.array([self._rows[ids[i]] for i in keep], dtype=np.int64),
+                np.array([pos[i] for i in keep], dtype=np.int64),
+                np.array([self.vocab.id(tags[i]) for i in keep], dtype=np.int64),
+            )
+
+        for n, rec in (raw or {}).items():
+            auto = moves(*rec['auto'])
+            self._relabels[int(n)] = {
+                'user': moves(*rec['user']),
+                'auto': auto,
+                'auto_arrays': {row: self._auto_tags[row] for row in auto[0].tolist()},
+                'derived': {self._rows[id] for id in rec['derived'] if id in self._rows},
+            }
+
+    def status_counts(self) -> Dict[str, int]:
+        codes = np.frombuffer(bytes(self._status), dtype=np.uint8)[list(self._rows.values())]
+        return {str(STATUSES[c]): n for c, n in enumerate(np.bincount(codes).tolist()) if n}
+
+    def tag_counts(self) -> Dict[str, int]:
+        # images per effective tag, a tag listed twice on one image counts once
+        rows = list(self._rows.values())
+        user = [self._user_tags[r] for r in rows]
+        auto = [self._auto_tags[r] if u is None else None for r, u in zip(rows, user)]
+        tids = []
+        for arrays, dtype, shift in ((user, np.uint32, 0), (auto, np.uint64, 16)):
+            lens, flat = self._flat(arrays, dtype, shift)
+            pairs = np.sort(np.repeat(np.arange(len(arrays), dtype=np.int64), lens) << 32 | flat)
+            tids.append(pairs[np.diff(pairs, prepend=-1) != 0] & 0xFFFFFFFF)
+        counts = np.bincount(np.concatenate(tids), minlength=len(self.vocab))
+        names = self.vocab.names
+        return {names[t]: n for t, n in enumerate(counts.tolist()) if n}
+
+    def to_dicts(self) -> Dict[str, Dict[str, Any]]:
+        return {id: ImageView(self, row).to_dict() for id, row in self._rows.items()}
+
+    def pack(self) -> Dict[str, np.ndarray]:
+        # flat arrays for the binary index, strings are NUL separated utf-8 and row order is id order
+        rows = list(self._rows.values())
+        auto = [self._auto_tags[r] for r in rows]
+        user = [self._user_tags[r] for r in rows]
+        extra = {str(i): self._extra[r] for i, r in enumerate(rows) if self._extra.get(r)}
+        captions = [[self._auto_caption[r] for r in rows], [self._user_caption[r] for r in rows]]
+        relabels = json.dumps(self.dump_relabels(), ensure_ascii=False)
+        return {
+            'ids': _pack_strings(self._rows),
+            'dirs': _pack_strings(self._dirs),
+            'dir': np.frombuffer(self._dir, dtype=np.uint32)[rows],
+            'names': _pack_strings(self._names[r] for r in rows),
+            'status': np.frombuffer(bytes(self._status), dtype=np.uint8)[rows],
+            'vocab': _pack_strings(self.vocab.names),
+            'auto_len': np.array([len(a) if a is not None else -1 for a in auto], dtype=np.int64),
+            'auto': np.frombuffer(b''.join(a.tobytes() for a in auto if a is not None), dtype=np.uint64),
+            'user_len': np.array([len(a) if a is not None else -1 for a in user], dtype=np.int64),
+            'user': np.frombuffer(b''.join(a.tobytes() for a in user if a is not None), dtype=np.uint32),
+            'phash': np.frombuffer(self._phash, dtype=np.uint64)[rows],
+            'has_phash': np.frombuffer(bytes(self._has_phash), dtype=np.uint8)[rows],
+            'json': np.frombuffer(json.dumps([captions, extra], ensure_ascii=False).encode('utf-8'), dtype=np.uint8),
+            'relabels': np.frombuffer(relabels.encode('utf-8'), dtype=np.uint8),
+        }
+
+    @classmethod
+    def unpack(cls, cols: Dict[str, np.ndarray], vocab: Optional[TagVocab] = None) -> 'FileStore':
+        store = cls(vocab)
+        ids = _unpack_strings(cols['ids'])
+        n = len(ids)
+        store._ids = ids
+        store._rows = dict(zip(ids, range(n)))
+        store._dirs = _unpack_strings(cols['dirs'])
+        store._dir_ids = {d: i for i, d in enumerate(store._dirs)}
+        store._dir = array('I', cols['dir'].astype(np.uint32).tobytes())
+        store._names = _unpack_strings(cols['names'])
+        store._status = bytearray(cols['status'].tobytes())
+        store._phash = array('Q', cols['phash'].astype(np.uint64).tobytes())
+        store._has_phash = bytearray(cols['has_phash'].tobytes())
+        captions, extra = json.loads(cols['json'].tobytes().decode('utf-8'))
+        store._auto_caption, store._user_caption = captions
+        store._extra = {int(k): v for k, v in extra.items()}
+
+        # tag ids were written against the saved vocabulary, remap them onto this one
+        remap = store.vocab.ids(_unpack_strings(cols['vocab']))
+        auto = cols['auto']
+        auto = (remap[auto >> np.uint64(16)] << np.uint64(16) | auto & np.uint64(0xFFFF)) if len(auto) else auto
+        store._auto_tags = _split_rows(auto.astype(np.uint64).tobytes(), cols['auto_len'], 'Q')
+        user = cols['user']
+        user = remap[user].astype(np.uint32) if len(user) else user
+        store._user_tags = _split_rows(user.astype(np.uint32).tobytes(), cols['user_len'], 'I')
+        if 'relabels' in cols:
+            store.load_relabels(json.loads(cols['relabels'].tobytes().decode('utf-8')))
+        return store
+
+    @classmethod
+    def from_dicts(cls, raw: Dict[str, Dict[str, Any]], vocab: Optional[TagVocab] = None) -> 'FileStore':
+        store = cls(vocab)
+        pending: List[Tuple[int, List[str]]] = []
+        count = 0
+        for id, d in raw.items():
+            row = store._append(id, d['path'], d['status'])
+            # backward-compat if older JSON had flattened extra keys
+            for k, v in d.items():
+                if k not in ('__type__', 'id', 'path', 'properties', 'status'):
+                    store._set(row, k, v)
+            for k, v in d.get('properties', {}).items():
+                if k == '_tags' and v:
+                    pending.append((row, v))
+                    count += len(v)
+                else:
+                    store._set(row, k, v)
+            if count >= cls.load_chunk:
+                store._set_auto_many(pending)
+                pending = []
+                count = 0
+        store._set_auto_many(pending)
+        return store
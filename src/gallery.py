@@ -0,0 +1,209 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+from PySide6.QtCore import (
+    QAbstractListModel,
+    QModelIndex,
+    QPoint,
+    QSize,
+    QSortFilterProxyModel,
+    Qt,
+    QTimer,
+    Signal,
+    Slot,
+)
+from PySide6.QtGui import QColor, QPixmap
+from PySide6.QtWidgets import QAbstractItemView, QListView
+from .thumbstore import THUMB_SIZE
+
+
+class GalleryModel(QAbstractListModel):
+    # decoded thumbnails kept in memory, the store on disk holds the rest
+    cache_size = 2048
+
+    def __init__(self, controller, parent=None) -> None:
+        super().__init__(parent)
+        self.controller = controller
+        self.ids: List[str] = []
+        # id -> the slot it was added at, its row is that less the removed slots before it;
+        # a removal never renumbers the rows after it
+        self._slots: Dict[str, int] = {}
+        self._removed: List[int] = []
+        self._next_slot = 0
+        self._cache: OrderedDict[str, QPixmap] = OrderedDict()
+        self._placeholder: Optional[QPixmap] = None
+        controller.thumb_ready.connect(self.on_thumb_ready)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.ids)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        id = self.ids[index.row()]
+        if role == Qt.DisplayRole:
+            return Path(id).name
+        if role == Qt.DecorationRole:
+            return self.pixmap(id)
+        if role in (Qt.ToolTipRole, Qt.UserRole):
+            return id
+        return None
+
+    def pixmap(self, id: str) -> QPixmap:
+        # only called for painted cells, so only what is on screen is ever read or decoded
+        pix = self._cache.get(id)
+        if pix is not None:
+            self._cache.move_to_end(id)
+            return pix
+        data = self.controller.thumbnail(id)
+        if data is None:
+            return self.placeholder()
+        return self._remember(id, data)
+
+    def placeholder(self) -> QPixmap:
+        if self._placeholder is None:
+            self._placeholder = QPixmap(THUMB_SIZE, THUMB_SIZE)
+            self._placeholder.fill(QColor('#eee'))
+        return self._placeholder
+
+    def _remember(self, id: str, data: bytes) -> QPixmap:
+        pix = QPixmap()
+        if not pix.loadFromData(data):
+            return self.placeholder()
+        self._cache[id] = pix
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return pix
+
+    def row(self, id: str) -> Optional[int]:
+        slot = self._slots.get(id)
+        return None if slot is None else slot - bisect_left(self._removed, slot)
+
+    def clear(self) -> None:
+        self.beginResetModel()
+        self.ids = []
+        self._slots = {}
+        self._removed = []
+        self._next_slot = 0
+        self._cache.clear()
+        self.endResetModel()
+
+    def add(self, id: str) -> None:
+        if id in self._slots:
+            return
+        row = len(self.ids)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.ids.append(id)
+        self._slots[id] = self._next_slot
+        self._next_slot += 1
+        self.endInsertRows()
+
+    def remove(self, id: str) -> None:
+        row = self.row(id)
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.ids[row]
+        insort(self._removed, self._slots.pop(id))
+        self._cache.pop(id, None)
+        self.endRemoveRows()
+
+    @Slot(str, bytes)
+    def on_thumb_ready(self, id: str, data: bytes) -> None:
+        row = self.row(id)
+        if row is None:
+            return
+        self._remember(id, bytes(data))
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class GalleryView(QListView):
+    activated_id = Signal(str)
+    opened_id = Signal(str)
+
+    def __init__(self, controller, parent=None) -> None:
+        super().__init__(parent)
+        self.controller = controller
+        self.gallery = GalleryModel(controller, self)
+        self.proxy = QSortFilterProxyModel(self)
+        self.proxy.setSourceModel(self.gallery)
+        self.proxy.setFilterRole(Qt.UserRole)
+        self.proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.setModel(self.proxy)
+
+        self.setViewMode(QListView.IconMode)
+        self.setMovement(QListView.Static)
+        self.setResizeMode(QListView.Adjust)
+        # fixed cells let the view place and hit-test items without asking the model
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(512)
+        self.setIconSize(QSize(THUMB_SIZE, THUMB_SIZE))
+        self.setGridSize(QSize(THUMB_SIZE + 16, THUMB_SIZE + 28))
+        self.setTextElideMode(Qt.ElideMiddle)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+
+        # thumbnails are requested for what is visible once scrolling settles
+        self._request_timer = QTimer(self)
+        self._request_timer.setSingleShot(True)
+        self._request_timer.setInterval(80)
+        self._request_timer.timeout.connect(self._request_visible)
+        self.verticalScrollBar().valueChanged.connect(self._schedule_request)
+        self.proxy.rowsInserted.connect(self._schedule_request)
+        self.proxy.rowsRemoved.connect(self._schedule_request)
+        self.proxy.modelReset.connect(self._schedule_request)
+        self.proxy.layoutChanged.connect(self._schedule_request)
+
+        self.clicked.connect(self._on_clicked)
+        self.doubleClicked.connect(self._on_double_clicked)
+
+    def set_filter(self, text: str) -> None:
+        self.proxy.setFilterFixedString(text.strip())
+
+    def select(self, id: str) -> None:
+        row = self.gallery.row(id)
+        if row is None:
+            return
+        index = self.proxy.mapFromSource(self.gallery.index(row))
+        if index.isValid() and index != self.currentIndex():
+            self.setCurrentIndex(index)
+            self.scrollTo(index)
+
+    def visible_ids(self) -> List[str]:
+        grid = self.gridSize()
+        size = self.viewport().size()
+        ids = []
+        # one probe per grid cell, a partly scrolled-out top row is probed at its visible edge
+        top = grid.height() // 2 - self.verticalOffset() % grid.height()
+        for y in range(top, size.height() + grid.height() // 2, grid.height()):
+            for x in range(grid.width() // 2, size.width(), grid.width()):
+                index = self.indexAt(QPoint(x, max(0, min(y, size.height() - 1))))
+                if index.isValid():
+                    ids.append(index.data(Qt.UserRole))
+        return list(dict.fromkeys(ids))
+
+    def _schedule_request(self, *args) -> None:
+        # throttled rather than debounced, a long scan keeps inserting rows
+        if not self._request_timer.isActive():
+            self._request_timer.start()
+
+    def resizeEvent(self, event) -> None:
+        super().resizeEvent(event)
+        self._request_timer.start()
+
+    def _request_visible(self) -> None:
+        if self.isVisible():
+            self.controller.request_thumbs(self.visible_ids())
+
+    def showEvent(self, event) -> None:
+        super().showEvent(event)
+        self._request_timer.start()
+
+    def _on_clicked(self, index: QModelIndex) -> None:
+        self.activated_id.emit(index.data(Qt.UserRole))
+
+    def _on_double_clicked(self, index: QModelIndex) -> None:
+        self.opened_id.emit(index.data(Qt.UserRole))
@@ -26,7 +26,8 @@ class HomePage(QWidget):
         title = QLabel('TagEditor')
         title.setStyleSheet('font-size: 18px; font-weight: 600;')
 
-        hint = QLabel('Pick a dataset folder. The UI will populate the list on the next screen.')
+        hint = QLabel('Pick a dataset folder. Existing .txt tags and .caption files are imported, '
+                      'everything else is auto-tagged.')
         hint.setStyleSheet('color: #666;')
 
         card = QFrame()
@@ -1,7 +1,27 @@
 from __future__ import annotations
+import re
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List
+
+# auto tags are stored as 'name (93.12%)'
+_SCORE_RE = re.compile(r'^(.*) \(\d+(?:\.\d+)?%\)$')
+_SCORE_SUFFIX_RE = re.compile(r' \(\d+(?:\.\d+)?%\)$', re.MULTILINE)
+
+
+def tag_name(tag: str) -> str:
+    if not tag.endswith('%)'):
+        return tag
+    m = _SCORE_RE.match(tag)
+    return m.group(1) if m else tag
+
+
+def tag_names(tags: List[str]) -> List[str]:
+    # one regex pass over the whole list instead of one call per tag
+    joined = '\n'.join(tags)
+    if not tags or joined.count('\n') != len(tags) - 1:
+        return [tag_name(t) for t in tags]
+    return _SCORE_SUFFIX_RE.sub('', joined).split('\n')
 
 
 @dataclass
@@ -17,9 +37,32 @@ class ImageFile:
             'id': self.id,
             'path': self.path.as_posix(),
             'status': self.status,
-            'properties': self.properties,
+            # copy lists so a snapshot stays stable while edits continue
+            'properties': {k: list(v) if isinstance(v, list) else v for k, v in self.properties.items()},
         }
 
+    def edit_tags(self) -> List[str]:
+        tags = self.properties.get('tags')
+        if tags is None:
+            tags = tag_names(self.properties.get('_tags') or [])
+            self.properties['tags'] = tags
+        return tags
+
+    def effective_tags(self) -> List[str]:
+        tags = self.properties.get('tags')
+        if tags is not None:
+            return list(tags)
+        return tag_names(self.properties.get('_tags') or [])
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        return self.properties.pop(key, default)
+
+    def caption_text(self) -> str:
+        caption = self.caption
+        if isinstance(caption, list):
+            return caption[0] if caption else ''
+        return caption or ''
+
     @classmethod
     def from_dict(cls, d: Dict[str, Any]) -> 'ImageFile':
         props = dict(d.get('properties', {}))
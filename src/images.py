@@ -1,10 +1,29 @@
-from typing import Set, Iterator
+import os
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Set, Tuple, Union
 from pathlib import Path
 from PIL import Image
 import torch
 import torchvision.transforms.functional as TVF
 
 IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff'}
+# sidecar files next to an image: comma separated tags and a free text caption
+TAG_SIDECAR_EXT = '.txt'
+CAPTION_SIDECAR_EXT = '.caption'
+SIDECAR_EXTS = {TAG_SIDECAR_EXT, CAPTION_SIDECAR_EXT}
+
+# peak memory allowed per decode, only JPEG can draft so every other format counts at full resolution
+MAX_DECODE_BYTES = 512 * 1024 * 1024
+
+
+_REDUCIBLE_MODES = {'L', 'LA', 'RGB', 'RGBA', 'CMYK', 'I', 'F'}
+# Pillow keeps every other mode at 4 bytes per pixel
+_MODE_BYTES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16B': 2, 'I;16L': 2, 'I;16N': 2}
+# formats decoded into a buffer of their own that is then copied, as a multiple of the image itself
+_DECODE_COPIES = {'WEBP': 4}
+
+
+class ImageTooLargeError(ValueError):
+    pass
 
 
 def iter_images(root: Path, recursive: bool = True, exts: Set[str] = IMAGE_EXTS) -> Iterator[Path]:
@@ -14,20 +33,110 @@ def iter_images(root: Path, recursive: bool = True, exts: Set[str] = IMAGE_EXTS)
             yield p
 
 
+def iter_images_with_sidecars(
+    root: Path,
+    recursive: bool = True,
+    exts: Set[str] = IMAGE_EXTS,
+) -> Iterator[Tuple[Path, Dict[str, Path]]]:
+    # one directory listing serves both images and sidecars, no per-image stat calls
+    for dirpath, dirnames, filenames in os.walk(root):
+        if not recursive:
+            dirnames.clear()
+        folder = Path(dirpath)
+        sidecars: Dict[str, Dict[str, Path]] = {}
+        images = []
+        for name in filenames:
+            stem, ext = os.path.splitext(name)
+            ext = ext.lower()
+            if ext in exts:
+                images.append(name)
+            elif ext in SIDECAR_EXTS:
+                sidecars.setdefault(stem, {})[ext] = folder / name
+        for name in images:
+            yield folder / name, sidecars.get(os.path.splitext(name)[0], {})
+
+
+def find_sidecars(path: Path) -> Dict[str, Path]:
+    found = {}
+    for ext in SIDECAR_EXTS:
+        p = path.with_suffix(ext)
+        if p.is_file():
+            found[ext] = p
+    return found
+
+
+def read_sidecars(sidecars: Dict[str, Path]) -> Optional[Dict[str, Any]]:
+    if not sidecars:
+        return None
+    res: Dict[str, Any] = {}
+    tags_path = sidecars.get(TAG_SIDECAR_EXT)
+    if tags_path is not None:
+        text = tags_path.read_text(encoding='utf-8', errors='replace')
+        tags = (t.strip() for t in text.replace('\n', ',').split(','))
+        res['tags'] = list(dict.fromkeys(t for t in tags if t))
+    caption_path = sidecars.get(CAPTION_SIDECAR_EXT)
+    if caption_path is not None:
+        caption = caption_path.read_text(encoding='utf-8', errors='replace').strip()
+        if caption:
+            res['caption'] = [caption]
+    return res or None
+
+
+def _decode_bytes(im: Image.Image, factor: int) -> int:
+    pixels = im.size[0] * im.size[1]
+    peak = pixels * _MODE_BYTES.get(im.mode, 4) * _DECODE_COPIES.get(im.format, 1)
+    if im.mode not in _REDUCIBLE_MODES or factor <= 1:
+        # a full-size conversion copy
+        peak += pixels * 4
+    elif 'A' in im.mode:
+        # reduce() works on a premultiplied copy
+        peak += pixels * 4
+    return peak
+
+
+def load_image(
+    source: Union[Path, BinaryIO],
+    target_size: Optional[int] = None,
+    max_decode_bytes: int = MAX_DECODE_BYTES,
+) -> Image.Image:
+    with Image.open(source) as im:
+        if target_size:
+            # JPEG decodes straight to 1/2, 1/4 or 1/8 scale, never below target_size
+            im.draft('RGB', (target_size, target_size))
+
+        # shrink by an integer factor before any full-resolution conversion copy,
+        # keeping 2x headroom for the final resample
+        w, h = im.size
+        factor = max(w, h) // (target_size * 2) if target_size else 0
+
+        # checked before anything is decoded, formats that cannot draft are loaded whole by reduce()
+        need = _decode_bytes(im, factor)
+        if need > max_decode_bytes:
+            raise ImageTooLargeError(
+                f'{w}x{h} {im.format or "image"} needs {need / 2**20:.0f} MiB to decode, '
+                f'limit is {max_decode_bytes / 2**20:.0f} MiB')
+
+        if im.mode not in _REDUCIBLE_MODES:
+            im = im.convert('RGBA' if 'transparency' in im.info else 'RGB')
+
+        if factor > 1:
+            im = im.reduce(factor)
+
+        return im.convert('RGB')
+
+
 def prepare_image(image: Image.Image, target_size: int) -> torch.Tensor:
-    # Pad image to square
     image = image.convert('RGB')
-    w, h = image.size
-    max_dim = max(w, h)
-    pad_left = (max_dim - w) // 2
-    pad_top = (max_dim - h) // 2
 
-    padded = Image.new('RGB', (max_dim, max_dim), (255, 255, 255))
-    padded.paste(image, (pad_left, pad_top))
+    # Resize longest side to target, then pad to square, so no full-size canvas is allocated
+    w, h = image.size
+    scale = target_size / max(w, h)
+    if scale != 1:
+        w, h = max(1, round(w * scale)), max(1, round(h * scale))
+        image = image.resize((w, h), Image.BICUBIC)
 
-    # Resize
-    if max_dim != target_size:
-        padded = padded.resize((target_size, target_size), Image.BICUBIC)
+    padded = Image.new('RGB', (target_size, target_size), (255, 255, 255))
+    padded.paste(image, ((target_size - w) // 2, (target_size - h) // 2))
 
     # To tensor + normalize (CLIP mean/std used by JoyTag)
     x = TVF.pil_to_tensor(padded) / 255.0
@@ -0,0 +1,98 @@
+from __future__ import annotations
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+import torch
+
+
+@dataclass(frozen=True)
+class InferenceProfile:
+    compile: bool = True
+    compile_mode: str = 'default'
+    channels_last: bool = True
+    warmup_batches: Tuple[int, ...] = (1,)
+    warmup_iters: int = 2
+
+
+def _cache_file(cache_dir: Path, name: str, device: torch.device) -> Path:
+    return cache_dir / f'{name}-{device.type}-torch{torch.__version__}.bin'
+
+
+def load_compile_cache(cache_dir: Path, name: str, device: torch.device) -> bool:
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # inductor's own FX graph cache location is set in the package __init__, before torch is imported
+    path = _cache_file(cache_dir, name, device)
+    loader = getattr(torch.compiler, 'load_cache_artifacts', None)
+    if loader is None or not path.exists():
+        return False
+    try:
+        loader(path.read_bytes())
+    except Exception:
+        path.unlink(missing_ok=True)
+        return False
+    return True
+
+
+def save_compile_cache(cache_dir: Path, name: str, device: torch.device) -> None:
+    saver = getattr(torch.compiler, 'save_cache_artifacts', None)
+    if saver is None:
+        return
+    artifacts = saver()
+    if artifacts is None:
+        return
+    data, _info = artifacts
+    path = _cache_file(cache_dir, name, device)
+    tmp = path.with_suffix('.tmp')
+    tmp.write_bytes(data)
+    tmp.replace(path)
+
+
+def warmup_sizes(profile: InferenceProfile, batch: int) -> Tuple[int, ...]:
+    # compiled batches are padded up to a power of two, up to the tuned size those are the only shapes that run
+    sizes = set(profile.warmup_batches)
+    n = 1
+    sizes.add(n)
+    while n < batch:
+        n *= 2
+        sizes.add(n)
+    return tuple(sorted(sizes))
+
+
+def optimize_module(
+    model: torch.nn.Module,
+    profile: InferenceProfile,
+    device: torch.device,
+    cache_dir: Path,
+    name: str,
+    run: Callable[[Callable, int], object],
+    batch: int = 1,
+) -> Tuple[Callable, float]:
+    if profile.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
+    forward: Callable = model
+    cached = False
+    if profile.compile:
+        cached = load_compile_cache(cache_dir, name, device)
+        forward = torch.compile(model, mode=profile.compile_mode, dynamic=False)
+
+    # every batch shape is compiled here, not on the first real image
+    t0 = time.perf_counter()
+    with torch.inference_mode():
+        for bs in warmup_sizes(profile, batch):
+            for _ in range(profile.warmup_iters):
+                run(forward, bs)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    warmup = time.perf_counter() - t0
+
+    if profile.compile and not cached:
+        save_compile_cache(cache_dir, name, device)
+    return forward, warmup
+
+
+def to_memory_format(x: torch.Tensor, profile: Optional[InferenceProfile]) -> torch.Tensor:
+    if profile is not None and profile.channels_last and x.dim() == 4:
+        return x.contiguous(memory_format=torch.channels_last)
+    return x
@@ -1,14 +1,17 @@
 
 from __future__ import annotations
+import json
+import time
 from pathlib import Path
-from PIL import Image
 import torch
 import torch.amp.autocast_mode
 from .vendor_loader import load_models_module
-from .images import prepare_image
+from .images import load_image, prepare_image
 from .models import TaskModel
 from .storage import load_top_tags
-from typing import Dict
+from .inference import InferenceProfile, optimize_module, to_memory_format
+from .weights_cache import WeightsCache, has_meta_tensors
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
 
 
 JoyTagModels = load_models_module('joytag_models')
@@ -16,45 +19,128 @@ VisionModel = JoyTagModels.VisionModel
 
 
 class JoyTagModel(TaskModel):
+    max_batch = 64
+
     def __init__(
         self,
         threshold: float = 0.4,
+        save_embeddings: bool = False,
+        device: str = 'cuda',
+        profile: Optional[InferenceProfile] = None,
+        weights_dtype: Optional[torch.dtype] = None,
+        use_weights_cache: bool = True,
     ):
         super().__init__(model_name='joytag')
         self.top_tags = load_top_tags(self.model_dir)
         self.threshold = threshold
+        self.save_embeddings = save_embeddings
+        self.device = torch.device(device)
+        self.profile = profile
+        if weights_dtype is None:
+            weights_dtype = torch.float16 if self.device.type == 'cuda' else torch.float32
+        self.weights_dtype = weights_dtype
+        self.use_weights_cache = use_weights_cache
+        self._forward: Optional[Callable] = None
+
+    def _from_state_dict(self, state: Dict[str, torch.Tensor]) -> Optional[torch.nn.Module]:
+        with (self.model_dir / 'config.json').open('r', encoding='utf-8') as f:
+            config = json.load(f)
+        cls = next((c for c in VisionModel.__subclasses__() if c.__name__ == config.get('class')), None)
+        if cls is None:
+            return None
+        kwargs = {k: v for k, v in config.items() if k != 'class'}
+
+        # build on the meta device and adopt the mapped tensors instead of copying them
+        with torch.device('meta'):
+            model = cls(**kwargs)
+        model.load_state_dict(state, assign=True)
+        if has_meta_tensors(model):
+            # non-persistent buffers are not in the state dict, build them for real
+            model = cls(**kwargs)
+            model.load_state_dict(state, assign=True)
+        return model
+
+    def _load(self) -> Tuple[torch.nn.Module, bool]:
+        cache = WeightsCache(self.model_dir, self.weights_dtype)
+        state = cache.load_state_dict() if self.use_weights_cache else None
+        if state is not None:
+            model = self._from_state_dict(state)
+            if model is not None:
+                return model, True
 
-    def activate(self) -> None:
         model = VisionModel.load_model(str(self.model_dir))
+        if self.use_weights_cache:
+            cache.save_state_dict(model.state_dict())
+        return model.to(self.weights_dtype), False
+
+    def activate(self) -> None:
+        t0 = time.perf_counter()
+        model, cached = self._load()
         model.eval()
-        self._model = model.to('cuda')
+        self._model = model.to(self.device)
+        self._forward = self._model
+        self.report(f"joytag activate ({'warm' if cached else 'cold'}): {time.perf_counter() - t0:.2f}s")
 
-    @torch.no_grad()
-    def process(self, path: Path) -> Dict[str, float]:
-        if self._model is None:
-            raise RuntimeError('Model is not activated. Call activate() first.')
+        if self.profile is not None:
+            size = self._model.image_size
+
+            def run(forward: Callable, bs: int):
+                x = torch.zeros(bs, 3, size, size, device=self.device)
+                return self._run(forward, to_memory_format(x, self.profile))
 
-        with Image.open(path) as im:
-            image = im.convert('RGB').copy()
+            self._forward, secs = optimize_module(
+                self._model, self.profile, self.device, self.model_dir / '.cache', 'joytag', run, self.batch_size)
+            self.report(f'joytag warmup: {secs:.1f}s')
 
-        x = prepare_image(image, self._model.image_size).unsqueeze(0).to('cuda')
+    def deactivate(self) -> None:
+        self._forward = None
+        super().deactivate()
 
-        with torch.amp.autocast_mode.autocast(device_type='cuda', enabled=True):
-            preds = self._model({'image': x})
-            vals = preds['tags'].sigmoid().float().cpu()[0].numpy()
+    def _run(self, forward: Callable, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        with torch.amp.autocast_mode.autocast(device_type=self.device.type, enabled=self.device.type == 'cuda'):
+            return forward({'image': x}, return_embeddings=self.save_embeddings)
 
-        idxs = [i for i, s in enumerate(vals) if s > self.threshold]
-        idxs.sort(key=lambda i: vals[i], reverse=True)
+    def process(self, source: Union[Path, BinaryIO]) -> Dict[str, Any]:
+        return self.process_batch([source])[0]
 
-        return {self.top_tags[i]: float(vals[i]) for i in idxs}
+    @torch.inference_mode()
+    def process_batch(self, sources: List[Union[Path, BinaryIO]]) -> List[Dict[str, Any]]:
+        if self._model is None:
+            raise RuntimeError('Model is not activated. Call activate() first.')
+
+        size = self._model.image_size
+        x = torch.stack([prepare_image(load_image(s, size, self.max_decode_bytes), size) for s in sources])
+        n = len(sources)
+        if self.profile is not None and self.profile.compile:
+            # compiled graphs are static, a short tail batch is padded to a power of two
+            padded = 1 << (n - 1).bit_length()
+            if padded > n:
+                x = torch.cat([x, x.new_zeros((padded - n, *x.shape[1:]))])
+        preds = self._run(self._forward, to_memory_format(x.to(self.device), self.profile))
+        vals = preds['tags'][:n].sigmoid().float().cpu().numpy()
+        embeddings = preds['embeddings'][:n].float().cpu().numpy() if self.save_embeddings else None
+
+        results = []
+        for row in range(n):
+            v = vals[row]
+            idxs = [i for i, s in enumerate(v) if s > self.threshold]
+            idxs.sort(key=lambda i: v[i], reverse=True)
+            results.append({
+                'tags': {self.top_tags[i]: float(v[i]) for i in idxs},
+                'embedding': embeddings[row] if embeddings is not None else None,
+            })
+        return results
 
     def get_filed_name(self) -> str:
         return '_tags'
 
     def get_result(self, obj: object) -> list[str]:
-        d = dict(obj)
+        d = dict(obj)['tags']
 
         res: list[str] = []
         for k, v in d.items():
             res.append(f'{k} ({v * 100:.2f}%)')
         return res
+
+    def get_embedding(self, obj: object):
+        return dict(obj).get('embedding')
@@ -13,17 +13,21 @@ from PySide6.QtWidgets import (
     QScrollArea,
     QSizePolicy,
     QSplitter,
+    QTabWidget,
     QVBoxLayout,
     QWidget,
 )
 from .batch_controller import BatchController
-from typing import List
+from .dialogs import ImageGroupsDialog, TagStatsDialog
+from .gallery import GalleryView
+from typing import List, Optional
 
 
 class MainPage(QWidget):
     status = Signal(str)
+    open_folder = Signal(Path)
 
-    def __init__(self) -> None:
+    def __init__(self, optimize: bool = False) -> None:
         super().__init__()
         # Left pane
         self.search_edit = QLineEdit()
@@ -48,6 +52,27 @@ class MainPage(QWidget):
         nav_row.addWidget(self.next_btn)
         left_layout.addLayout(nav_row)
 
+        tools_row = QHBoxLayout()
+        self.dups_btn = QPushButton('Duplicates')
+        self.similar_btn = QPushButton('Find Similar')
+        tools_row.addWidget(self.dups_btn)
+        tools_row.addWidget(self.similar_btn)
+        left_layout.addLayout(tools_row)
+
+        self.watch_btn = QPushButton('Watch Folder')
+        self.watch_btn.setCheckable(True)
+        left_layout.addWidget(self.watch_btn)
+
+        workspace_row = QHBoxLayout()
+        self.search_all_btn = QPushButton('Search All Roots')
+        self.stats_btn = QPushButton('Workspace Stats')
+        workspace_row.addWidget(self.search_all_btn)
+        workspace_row.addWidget(self.stats_btn)
+        left_layout.addLayout(workspace_row)
+
+        self.tag_stats_btn = QPushButton('Tag Stats')
+        left_layout.addWidget(self.tag_stats_btn)
+
         # Right pane (preview + tags)
         self.preview_label = QLabel('Preview')
         self.preview_label.setAlignment(Qt.AlignCenter)
@@ -60,35 +85,54 @@ class MainPage(QWidget):
         self.preview_scroll.setFrameShape(QFrame.NoFrame)
         self.preview_scroll.setWidget(self.preview_label)
 
+        # BatchController
+        self.batchController = BatchController(self, optimize=optimize)
+
+        self.gallery = GalleryView(self.batchController)
+        self.view_tabs = QTabWidget()
+        self.view_tabs.addTab(self.preview_scroll, 'Image Preview')
+        self.view_tabs.addTab(self.gallery, 'Gallery')
+
         self.tags_list = QListWidget()
         self.tags_list.setSelectionMode(QListWidget.SingleSelection)
 
         self.tag_edit = QLineEdit()
-        self.tag_edit.setPlaceholderText('Add tag… (UI only)')
+        self.tag_edit.setPlaceholderText('Add tag…')
         self.add_tag_btn = QPushButton('Add Tag')
+        self.remove_tag_btn = QPushButton('Remove Tag')
+        self.tag_up_btn = QPushButton('Up')
+        self.tag_down_btn = QPushButton('Down')
+        self.caption_edit = QLineEdit()
+        self.caption_edit.setPlaceholderText('Caption…')
         self.remove_dups_btn = QPushButton('Remove Duplicates')
         self.undo_btn = QPushButton('Undo')
+        self.redo_btn = QPushButton('Redo')
         self.save_btn = QPushButton('Save')
 
         tag_row = QHBoxLayout()
         tag_row.addWidget(self.tag_edit, 1)
         tag_row.addWidget(self.add_tag_btn)
+        tag_row.addWidget(self.remove_tag_btn)
+        tag_row.addWidget(self.tag_up_btn)
+        tag_row.addWidget(self.tag_down_btn)
 
         action_row = QHBoxLayout()
         action_row.addWidget(self.remove_dups_btn)
         action_row.addStretch(1)
         action_row.addWidget(self.undo_btn)
+        action_row.addWidget(self.redo_btn)
         action_row.addWidget(self.save_btn)
 
         right = QWidget()
         right_layout = QVBoxLayout(right)
         right_layout.setContentsMargins(8, 8, 8, 8)
         right_layout.setSpacing(8)
-        right_layout.addWidget(QLabel('Image Preview'))
-        right_layout.addWidget(self.preview_scroll, 1)
+        right_layout.addWidget(self.view_tabs, 1)
         right_layout.addWidget(QLabel('Tags'))
         right_layout.addWidget(self.tags_list, 0)
         right_layout.addLayout(tag_row)
+        right_layout.addWidget(QLabel('Caption'))
+        right_layout.addWidget(self.caption_edit)
         right_layout.addLayout(action_row)
 
         # Splitter
@@ -105,46 +149,81 @@ class MainPage(QWidget):
 
         # Minimal wiring for UI feel (still 'UI mock')
         self._current_dir: Path | None = None
+        self._pending_select: Optional[str] = None
 
         self.search_edit.textChanged.connect(self._apply_filter)
         self.file_list.currentRowChanged.connect(self.on_select_row)
         self.prev_btn.clicked.connect(lambda: self._step(-1))
         self.next_btn.clicked.connect(lambda: self._step(+1))
-
-        self.add_tag_btn.clicked.connect(self._ui_add_tag_only)
-        self.tag_edit.returnPressed.connect(self._ui_add_tag_only)
-        self.remove_dups_btn.clicked.connect(self._ui_remove_dups_only)
-        self.undo_btn.clicked.connect(self._ui_undo_only)
-        self.save_btn.clicked.connect(self._ui_save_only)
-        # BatchController
-        self.batchController = BatchController(self)
+        self.dups_btn.clicked.connect(self._show_duplicates)
+        self.similar_btn.clicked.connect(self._show_similar)
+        self.watch_btn.toggled.connect(self._on_watch_toggled)
+        self.search_all_btn.clicked.connect(self._search_workspace)
+        self.stats_btn.clicked.connect(self._show_workspace_stats)
+        self.tag_stats_btn.clicked.connect(self._show_tag_stats)
+
+        self.add_tag_btn.clicked.connect(self._on_add_tag)
+        self.tag_edit.returnPressed.connect(self._on_add_tag)
+        self.remove_tag_btn.clicked.connect(self._on_remove_tag)
+        self.tag_up_btn.clicked.connect(lambda: self._on_move_tag(-1))
+        self.tag_down_btn.clicked.connect(lambda: self._on_move_tag(+1))
+        self.caption_edit.editingFinished.connect(self._on_caption_edited)
+        self.remove_dups_btn.clicked.connect(self._on_remove_dups)
+        self.undo_btn.clicked.connect(self._on_undo)
+        self.redo_btn.clicked.connect(self._on_redo)
+        self.save_btn.clicked.connect(self._on_save)
+        self.gallery.activated_id.connect(self.select_image)
+        self.gallery.opened_id.connect(self._open_from_gallery)
         self.batchController.item_found.connect(self.on_item_found)
+        self.batchController.item_removed.connect(self.on_item_removed)
         self.batchController.status.connect(self.on_status)
         self.batchController.item_tag.connect(self.on_show_tags)
+        self.batchController.tags_changed.connect(self.on_tags_changed)
 
     def load_directory(self, folder: Path) -> None:
         self.file_list.clear()
+        self.gallery.gallery.clear()
         self.preview_label.setText('No images found in this folder.')
         self.tags_list.clear()
+        self.caption_edit.clear()
         self.batchController.start_tasks(folder=folder)
 
     @Slot(str)
     def on_item_found(self, id: str) -> None:
+        # the list and the gallery hold the same ids in the same rows, the gallery finds them in both
+        if self.gallery.gallery.row(id) is not None:
+            return
         current_row = self.file_list.currentRow()
         item = QListWidgetItem(id)
         item.setData(Qt.UserRole, id)
         self.file_list.addItem(item)
+        self.gallery.gallery.add(id)
 
-        if current_row >= 0:
+        if id == self._pending_select:
+            self._pending_select = None
+            self.file_list.setCurrentRow(self.file_list.count() - 1)
+        elif current_row >= 0:
             self.file_list.setCurrentRow(current_row)
         elif self.file_list.count() > 0:
             self.file_list.setCurrentRow(0)
 
+    @Slot(str)
+    def on_item_removed(self, id: str) -> None:
+        row = self.gallery.gallery.row(id)
+        if row is None:
+            return
+        self.gallery.gallery.remove(id)
+        self.file_list.takeItem(row)
+
+    def _on_watch_toggled(self, checked: bool) -> None:
+        self.batchController.set_watch(checked)
+
     def _apply_filter(self, text: str) -> None:
         t = text.strip().lower()
         for i in range(self.file_list.count()):
             item = self.file_list.item(i)
             item.setHidden(t not in item.text().lower())
+        self.gallery.set_filter(t)
 
     def _step(self, delta: int) -> None:
         row = self.file_list.currentRow()
@@ -153,14 +232,95 @@ class MainPage(QWidget):
         new_row = max(0, min(self.file_list.count() - 1, row + delta))
         self.file_list.setCurrentRow(new_row)
 
+    def select_image(self, id: str) -> None:
+        row = self.gallery.gallery.row(id)
+        if row is not None:
+            self.file_list.setCurrentRow(row)
+
+    def _open_from_gallery(self, id: str) -> None:
+        self.select_image(id)
+        self.view_tabs.setCurrentWidget(self.preview_scroll)
+
+    def _show_duplicates(self) -> None:
+        clusters = self.batchController.duplicate_clusters()
+        if not clusters:
+            QMessageBox.information(self, 'Duplicates', 'No near-duplicate images found.')
+            return
+        groups = []
+        for ids in clusters:
+            items = [(id, 'original' if i == 0 else 'reused') for i, id in enumerate(ids)]
+            groups.append((ids[0], items))
+        dlg = ImageGroupsDialog(f'Duplicates ({len(clusters)} clusters)', groups, self)
+        dlg.activated.connect(self.select_image)
+        dlg.show()
+
+    def _show_similar(self) -> None:
+        row = self.file_list.currentRow()
+        if row < 0:
+            return
+        id = self.file_list.item(row).data(Qt.UserRole)
+        hits = self.batchController.find_similar(id)
+        if not hits:
+            QMessageBox.information(self, 'Find Similar', 'No embedding stored for this image yet.')
+            return
+        items = [(hit, f'{score:.3f}') for hit, score in hits]
+        dlg = ImageGroupsDialog(f'Similar to {id}', [(id, items)], self)
+        dlg.activated.connect(self.select_image)
+        dlg.show()
+
+    def _search_workspace(self) -> None:
+        text = self.search_edit.text().strip()
+        if not text:
+            self.status.emit('Type a tag or file name in the filter box first')
+            return
+        groups = {}
+        for qid, img in self.batchController.search_workspace(text):
+            key, id = self.batchController.workspace.split(qid)
+            groups.setdefault(key, []).append((qid, img.status))
+        if not groups:
+            QMessageBox.information(self, 'Search All Roots', f'No images match "{text}".')
+            return
+        dlg = ImageGroupsDialog(f'Search: {text}', list(groups.items()), self)
+        dlg.activated.connect(self._open_workspace_image)
+        dlg.show()
+
+    def _open_workspace_image(self, qid: str) -> None:
+        key, id = self.batchController.workspace.split(qid)
+        if key == self.batchController.root_key:
+            self.select_image(id)
+            return
+        root = self.batchController.workspace.root_of(qid)
+        if root is not None:
+            self._pending_select = id
+            self.open_folder.emit(root.path)
+
+    def _show_workspace_stats(self) -> None:
+        stats = self.batchController.workspace_stats()
+        status = ', '.join(f'{k}: {v}' for k, v in sorted(stats['status'].items()))
+        top = ', '.join(f'{t} ({n})' for t, n in stats['tags'].most_common(20))
+        QMessageBox.information(
+            self,
+            'Workspace Stats',
+            f"Roots: {stats['roots']}\nImages: {stats['count']}\n{status}\n\nTop tags: {top}",
+        )
+
+    def _show_tag_stats(self) -> None:
+        if self.batchController.database is None:
+            return
+        TagStatsDialog(self.batchController, self).show()
+
     def on_select_row(self, row: int) -> None:
         if row < 0:
             return
         item = self.file_list.item(row)
 
         img = self.batchController.getImage(item.data(Qt.UserRole))
+        self.gallery.select(img.id)
         self.show_image(img.path)
         self.show_tags(img.tags)
+        self.caption_edit.setText(img.caption_text())
+        if img['_error']:
+            self.status.emit(f"Error: {img['_error']}")
 
     def show_image(self, path: Path) -> None:
         pix = QPixmap(str(path))
@@ -196,36 +356,76 @@ class MainPage(QWidget):
 
     @Slot(str)
     def on_show_tags(self, id: str) -> None:
+        if id != self._current_id():
+            return
+        img = self.batchController.getImage(id)
+        self.show_tags(img['tags'])
+        self.caption_edit.setText(img.caption_text())
+
+    @Slot()
+    def on_tags_changed(self) -> None:
+        id = self._current_id()
+        if id is not None:
+            self.on_show_tags(id)
+
+    def _current_id(self) -> Optional[str]:
         row = self.file_list.currentRow()
-        if row >= 0:
-            img = self.batchController.getImage(self.file_list.item(row).data(Qt.UserRole))
-            self.show_tags(img['tags'])
+        if row < 0:
+            return None
+        return self.file_list.item(row).data(Qt.UserRole)
 
-    # UI-only actions (placeholders)
-    def _ui_add_tag_only(self) -> None:
+    # Edit actions, recorded in the controller's edit log
+    def _on_add_tag(self) -> None:
         text = self.tag_edit.text().strip()
-        if not text:
+        id = self._current_id()
+        if not text or id is None:
             return
-        self.tags_list.addItem(text)
+        self.batchController.add_tag(id, text)
         self.tag_edit.clear()
 
-    def _ui_remove_dups_only(self) -> None:
-        seen = set()
-        deduped = []
-        for i in range(self.tags_list.count()):
-            t = self.tags_list.item(i).text()
-            if t not in seen:
-                seen.add(t)
-                deduped.append(t)
-        self.tags_list.clear()
-        for t in deduped:
-            self.tags_list.addItem(t)
-
-    def _ui_undo_only(self) -> None:
-        QMessageBox.information(self, 'Undo', 'UI mock: no real undo stack implemented.')
+    def _on_remove_tag(self) -> None:
+        id = self._current_id()
+        row = self.tags_list.currentRow()
+        if id is None or row < 0:
+            return
+        self.batchController.remove_tag(id, row)
+        self.tags_list.setCurrentRow(min(row, self.tags_list.count() - 1))
 
-    def _ui_save_only(self) -> None:
-        QMessageBox.information(self, 'Save', 'UI mock: no real file writing implemented.')
+    def _on_move_tag(self, delta: int) -> None:
+        id = self._current_id()
+        row = self.tags_list.currentRow()
+        if id is None or row < 0:
+            return
+        to = max(0, min(self.tags_list.count() - 1, row + delta))
+        self.batchController.move_tag(id, row, to)
+        self.tags_list.setCurrentRow(to)
+
+    def _on_remove_dups(self) -> None:
+        id = self._current_id()
+        if id is not None:
+            self.batchController.remove_duplicate_tags(id)
+
+    def _on_caption_edited(self) -> None:
+        id = self._current_id()
+        if id is not None:
+            self.batchController.set_caption(id, self.caption_edit.text().strip())
+
+    def _on_undo(self) -> None:
+        id = self.batchController.undo()
+        if id is None:
+            self.status.emit('Nothing to undo')
+        elif id and id != self._current_id():
+            self.select_image(id)
+
+    def _on_redo(self) -> None:
+        id = self.batchController.redo()
+        if id is None:
+            self.status.emit('Nothing to redo')
+        elif id and id != self._current_id():
+            self.select_image(id)
+
+    def _on_save(self) -> None:
+        self.batchController.save()
 
     def on_status(self, msg: str):
         self.status.emit(msg)
@@ -1,14 +1,25 @@
 from pathlib import Path
+from typing import Any, BinaryIO, Callable, List, Union
 import torch
+from .images import MAX_DECODE_BYTES
 
 
 MODEL_ROOT = Path.cwd().resolve()
 
 
 class TaskModel():
+    # largest batch the tuner may try, models that cannot batch keep 1
+    max_batch = 1
+    # the size the worker starts with, set before activate so a compiled model builds it up front
+    batch_size = 1
+
     def __init__(self, model_name: str):
         self._model = None
         self.model_name = model_name
+        self.device = torch.device('cpu')
+        self.max_decode_bytes = MAX_DECODE_BYTES
+        # load and warmup times, the worker running the model points this at its status signal
+        self.report: Callable[[str], None] = lambda msg: None
         self.model_dir = Path(MODEL_ROOT / f'models/{self.model_name}').expanduser().resolve()
         if not self.model_dir.is_dir():
             raise SystemExit(f"model directory not found: {self.model_dir}")
@@ -21,11 +32,17 @@ class TaskModel():
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
 
-    def process(self, path: Path):
+    def process(self, source: Union[Path, BinaryIO]):
         pass
 
+    def process_batch(self, sources: List[Union[Path, BinaryIO]]) -> List[Any]:
+        return [self.process(s) for s in sources]
+
     def get_filed_name(self) -> str:
         pass
 
     def get_result(self, obj: object) -> list[str]:
         pass
+
+    def get_embedding(self, obj: object):
+        return None
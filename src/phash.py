@@ -0,0 +1,92 @@
+from __future__ import annotations
+from pathlib import Path
+from threading import Lock
+from typing import BinaryIO, List, Optional, Tuple, Union
+import numpy as np
+from PIL import Image
+from .images import MAX_DECODE_BYTES, load_image
+
+
+HASH_SIZE = 8
+
+# popcount lookup for numpy builds without np.bitwise_count
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def dhash(source: Union[Path, BinaryIO], max_decode_bytes: int = MAX_DECODE_BYTES) -> int:
+    # draft/reduce decoding keeps this cheap even for large originals
+    image = load_image(source, HASH_SIZE * 8, max_decode_bytes)
+    small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+
+    px = np.asarray(small, dtype=np.int16)
+    bits = px[:, 1:] > px[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hash_to_str(h: int) -> str:
+    return f'{h:016x}'
+
+
+def hash_from_str(s: str) -> int:
+    return int(s, 16)
+
+
+def popcount64(arr: np.ndarray) -> np.ndarray:
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(arr)
+    return _POPCOUNT8[arr.view(np.uint8)].reshape(arr.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+class HashIndex:
+    def __init__(self, capacity: int = 1024):
+        self._lock = Lock()
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._ids: List[str] = []
+        self._rows = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._hashes[:] = 0
+            self._ids = []
+            self._rows = {}
+
+    def add(self, id: str, h: int) -> None:
+        with self._lock:
+            row = self._rows.get(id)
+            if row is None:
+                row = len(self._ids)
+                if row >= len(self._hashes):
+                    grown = np.zeros(len(self._hashes) * 2, dtype=np.uint64)
+                    grown[:row] = self._hashes
+                    self._hashes = grown
+                self._ids.append(id)
+                self._rows[id] = row
+            self._hashes[row] = np.uint64(h)
+
+    def remove(self, id: str) -> None:
+        with self._lock:
+            row = self._rows.pop(id, None)
+            if row is None:
+                return
+            # move the last entry into the hole to keep the array packed
+            last = len(self._ids) - 1
+            if row != last:
+                self._hashes[row] = self._hashes[last]
+                self._ids[row] = self._ids[last]
+                self._rows[self._ids[row]] = row
+            self._ids.pop()
+
+    def nearest(self, h: int, max_distance: int) -> Optional[Tuple[str, int]]:
+        with self._lock:
+            n = len(self._ids)
+            if n == 0:
+                return None
+            dist = popcount64(self._hashes[:n] ^ np.uint64(h))
+            row = int(np.argmin(dist))
+            d = int(dist[row])
+            if d > max_distance:
+                return None
+            return self._ids[row], d
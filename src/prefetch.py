@@ -0,0 +1,191 @@
+from __future__ import annotations
+import os
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+_FADVISE = hasattr(os, 'posix_fadvise')
+
+
+def read_file(path: Path) -> bytes:
+    with open(path, 'rb', buffering=0) as f:
+        if _FADVISE:
+            # one sequential pass, let the kernel (and NFS client) read ahead aggressively
+            fd = f.fileno()
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        return f.read()
+
+
+def hint_file(path: Path) -> None:
+    # starts the page cache fill for a file that no reader thread has reached yet
+    if not _FADVISE:
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class _Entry:
+    __slots__ = ('path', 'size', 'charged', 'data', 'error', 'ready')
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.size = 0
+        # counted against the byte budget, set by the reader thread once admitted
+        self.charged = False
+        self.data: Optional[bytes] = None
+        self.error: Optional[BaseException] = None
+        self.ready = threading.Event()
+
+
+class Prefetcher:
+    def __init__(
+        self,
+        concurrency: int = 4,
+        max_bytes: int = 256 * 2**20,
+        hint_ahead: int = 16,
+        reader: Callable[[Path], bytes] = read_file,
+        size_of: Callable[[Path], int] = lambda p: os.stat(p).st_size,
+        hinter: Callable[[Path], None] = hint_file,
+    ):
+        self.concurrency = concurrency
+        self.max_bytes = max_bytes
+        self.hint_ahead = hint_ahead
+        self.reader = reader
+        self.size_of = size_of
+        self.hinter = hinter
+        self.buffered = 0
+        self._cond = threading.Condition()
+        self._pending: Deque[Tuple[Hashable, _Entry]] = deque()
+        # submitted and not yet taken, oldest first
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._hinted: Dict[Hashable, None] = {}
+        self._closed = False
+        self._threads: List[threading.Thread] = []
+        for i in range(concurrency):
+            t = threading.Thread(target=self._run, name=f'prefetch-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, key: Hashable, path: Path) -> None:
+        if self.concurrency <= 0:
+            return
+        with self._cond:
+            if self._closed or key in self._entries:
+                return
+            entry = _Entry(path)
+            self._entries[key] = entry
+            self._pending.append((key, entry))
+            self._cond.notify()
+
+    def take(self, key: Hashable, path: Path) -> bytes:
+        # files that were never submitted, or already taken by an earlier attempt, are read directly
+        with self._cond:
+            entry = self._entries.get(key)
+        if entry is None:
+            return self.reader(path)
+
+        entry.ready.wait()
+        with self._cond:
+            if self._entries.pop(key, None) is entry:
+                self._hinted.pop(key, None)
+                self._release(entry)
+        if entry.error is not None:
+            raise entry.error
+        if entry.data is None:
+            # closed before the read finished
+            return self.reader(path)
+        return entry.data
+
+    def discard(self, key: Hashable) -> None:
+        # a task that will never be taken gives its budget back
+        with self._cond:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            self._hinted.pop(key, None)
+            try:
+                self._pending.remove((key, entry))
+            except ValueError:
+                pass
+            self._release(entry)
+
+    def _release(self, entry: _Entry) -> None:
+        if entry.charged:
+            entry.charged = False
+            self.buffered -= entry.size
+        self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            for entry in self._entries.values():
+                entry.ready.set()
+            self._entries.clear()
+            self._hinted.clear()
+            self.buffered = 0
+            self._cond.notify_all()
+
+    def _hint(self) -> None:
+        # kernel hints for the files queued right behind the ones being read
+        if self.hint_ahead <= 0:
+            return
+        with self._cond:
+            ahead = [(k, e) for k, e in islice(self._pending, self.hint_ahead) if k not in self._hinted]
+            for k, _ in ahead:
+                self._hinted[k] = None
+        for _, e in ahead:
+            self.hinter(e.path)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                key, entry = self._pending.popleft()
+            self._hint()
+
+            try:
+                entry.size = self.size_of(entry.path)
+            except OSError as e:
+                entry.error = e
+                entry.ready.set()
+                continue
+
+            with self._cond:
+                # the oldest outstanding file is always admitted, the consumer is waiting on it
+                while (
+                    not self._closed
+                    and self._entries.get(key) is entry
+                    and self.buffered > 0
+                    and self.buffered + entry.size > self.max_bytes
+                    and next(iter(self._entries), None) != key
+                ):
+                    self._cond.wait()
+                if self._closed:
+                    entry.ready.set()
+                    return
+                if self._entries.get(key) is not entry:
+                    # discarded while waiting for budget
+                    continue
+                self.buffered += entry.size
+                entry.charged = True
+
+            try:
+                entry.data = self.reader(entry.path)
+            except Exception as e:
+                entry.error = e
+            entry.ready.set()
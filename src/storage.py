@@ -1,51 +1,127 @@
+import copy
 import json
+from collections.abc import Mapping
 from pathlib import Path
-from typing import Any, Dict, List
-from .imagefile import ImageFile
+from typing import Any, Dict, List, Optional
+import numpy as np
+from .filestore import FileStore, TagVocab
 
 
-def _default_index(index_path: Path) -> Dict[str, Any]:
-    return {'root': str(index_path.parent), 'files': {}}
+def columns_path(index_path: Path) -> Path:
+    return index_path.with_suffix('.npz')
 
 
-def load_index(index_path: Path) -> Dict[str, Any]:
+def _default_index(index_path: Path, vocab: Optional[TagVocab] = None) -> Dict[str, Any]:
+    return {'root': str(index_path.parent), 'files': FileStore(vocab)}
+
+
+def load_index(index_path: Path, vocab: Optional[TagVocab] = None) -> Dict[str, Any]:
     if not index_path.exists():
-        return _default_index(index_path)
+        return _default_index(index_path, vocab)
+
+    data = _load_columns(index_path, vocab)
+    if data is not None:
+        return data
 
     try:
         with index_path.open('r', encoding='utf-8') as f:
             data = json.load(f)
     except json.JSONDecodeError:
-        return _default_index(index_path)
+        return _default_index(index_path, vocab)
 
     if not isinstance(data, dict) or 'root' not in data:
-        return _default_index(index_path)
+        return _default_index(index_path, vocab)
 
     files_raw = data.get('files')
     if not isinstance(files_raw, dict):
         files_raw = {}
 
-    # decode: Dict[str, dict] -> Dict[str, ImageFile]
-    data['files'] = {k: ImageFile.from_dict(v) for k, v in files_raw.items()}
+    # decode: Dict[str, dict] -> columnar FileStore, the raw dicts are dropped right after
+    data['files'] = FileStore.from_dicts(files_raw, vocab)
+    data['files'].load_relabels(data.pop('relabels', None))
 
     return data
 
 
-def save_index(data: Dict[str, Any], index_path: Path) -> None:
+def _stamp(index_path: Path) -> np.ndarray:
+    st = index_path.stat()
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def _load_columns(index_path: Path, vocab: Optional[TagVocab] = None) -> Optional[Dict[str, Any]]:
+    # the binary copy is only trusted while it was written together with the current json
+    path = columns_path(index_path)
+    if not path.exists():
+        return None
+    try:
+        with np.load(path) as npz:
+            cols = {k: npz[k] for k in npz.files}
+        if not np.array_equal(cols.pop('stamp'), _stamp(index_path)):
+            return None
+        data = json.loads(cols.pop('meta').tobytes().decode('utf-8'))
+        data['files'] = FileStore.unpack(cols, vocab)
+    except (OSError, ValueError, KeyError):
+        return None
+    return data
+
+
+def snapshot_columns(data: Dict[str, Any]) -> Optional[Dict[str, np.ndarray]]:
+    files_obj = data.get('files')
+    if not isinstance(files_obj, FileStore):
+        return None
+    cols = files_obj.pack()
+    meta = {k: v for k, v in data.items() if k != 'files'}
+    cols['meta'] = np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8)
+    return cols
+
+
+def snapshot_index(data: Dict[str, Any]) -> Dict[str, Any]:
     files_obj = data.get('files', {})
-    if not isinstance(files_obj, dict):
-        raise TypeError("data['files'] must be a dict[str, ImageFile]")
+    if not isinstance(files_obj, Mapping):
+        raise TypeError("data['files'] must be a mapping of id to ImageFile")
 
     payload = dict(data)
-    # encode: Dict[str, ImageFile] -> Dict[str, dict]
-    payload['files'] = {k: v.to_dict() for k, v in files_obj.items()}
+    # encode: FileStore / Dict[str, ImageFile] -> Dict[str, dict]
+    if isinstance(files_obj, FileStore):
+        payload['files'] = files_obj.to_dicts()
+        # a logged undo of a relabel still needs what it changed, the binary copy may not be there
+        relabels = files_obj.dump_relabels()
+        if relabels:
+            payload['relabels'] = relabels
+    else:
+        payload['files'] = {k: v.to_dict() for k, v in files_obj.items()}
+    return payload
+
+
+def copy_index(data: Dict[str, Any]) -> Dict[str, Any]:
+    # what snapshot_index and snapshot_columns need, detached so they can run off the UI thread
+    files_obj = data.get('files', {})
+    res = copy.deepcopy({k: v for k, v in data.items() if k != 'files'})
+    res['files'] = files_obj.copy() if isinstance(files_obj, FileStore) else copy.deepcopy(files_obj)
+    return res
+
+
+def save_index(data: Dict[str, Any], index_path: Path) -> None:
+    write_index(snapshot_index(data), index_path, snapshot_columns(data))
+
 
+def write_index(payload: Dict[str, Any], index_path: Path, columns: Optional[Dict[str, np.ndarray]] = None) -> None:
     tmp = index_path.with_suffix(index_path.suffix + '.tmp')
     with tmp.open('w', encoding='utf-8') as f:
         json.dump(payload, f, ensure_ascii=False, indent=3)
         f.flush()
 
     tmp.replace(index_path)
+    path = columns_path(index_path)
+    if columns is None:
+        path.unlink(missing_ok=True)
+        return
+
+    # stamped with the json it mirrors, written after it so a crash in between leaves it stale
+    tmp = path.with_suffix('.npz.tmp')
+    with tmp.open('wb') as f:
+        np.savez(f, stamp=_stamp(index_path), **columns)
+    tmp.replace(path)
 
 
 def load_top_tags(model_dir: Path) -> List[str]:
@@ -0,0 +1,298 @@
+from __future__ import annotations
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from .imagefile import ImageFile
+
+
+def tag_set(img: ImageFile) -> Set[str]:
+    return set(img.effective_tags())
+
+
+def _pair(a: int, b: int) -> int:
+    # one int per unordered pair keeps the sparse matrix a flat dict
+    return (a << 32) | b if a < b else (b << 32) | a
+
+
+# source, its tag id, the images it moved (None for a plain rename) and its pairs by partner
+_Move = Tuple[str, int, Optional[Set[str]], Dict[int, int]]
+
+
+class TagStats:
+    # images per chunk when the co-occurrence matrix is counted from scratch
+    rebuild_chunk = 16384
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        self.counts: Counter = Counter()
+        # sparse upper triangle of the co-occurrence matrix
+        self.cooc: Counter = Counter()
+        # tag id -> images carrying it, so bulk operations touch only those records
+        self._postings: Dict[int, Set[str]] = {}
+        self._files: Optional[Dict[str, ImageFile]] = None
+        self._built = False
+        # what each relabel moved by the number of its log op, (source, id, images or None for a plain rename,
+        # pairs), to undo it in place
+        self._relabels: List[Tuple[int, Set[str], List[_Move]]] = []
+        # relabels whose images or tags were changed outside the log since, their record no longer fits
+        self._stale: Set[int] = set()
+
+    def _tid(self, name: str) -> int:
+        tid = self._ids.get(name)
+        if tid is None:
+            tid = len(self._names)
+            self._ids[name] = tid
+            self._names.append(name)
+        return tid
+
+    def attach(self, files: Dict[str, ImageFile]) -> None:
+        # counted on first use, opening a folder does not pay for it
+        self.__init__()
+        self._files = files
+
+    def _ensure(self) -> None:
+        if not self._built and self._files is not None:
+            self.rebuild(self._files)
+
+    def rebuild(self, files: Dict[str, ImageFile]) -> None:
+        self.__init__()
+        self._files = files
+        self._built = True
+        id_list = list(files)
+        names: List[str] = []
+        lens = np.zeros(len(id_list), dtype=np.int64)
+        for i, img in enumerate(files.values()):
+            tags = tag_set(img)
+            names.extend(tags)
+            lens[i] = len(tags)
+        for name in sorted(set(names)):
+            self._tid(name)
+        if not names:
+            return
+
+        # flat (image row, tag id) pairs, ordered by row then tag id
+        tids = np.fromiter(map(self._ids.__getitem__, names), dtype=np.int64, count=len(names))
+        rows = np.repeat(np.arange(len(id_list)), lens)
+        order = np.lexsort((tids, rows))
+        tids = tids[order]
+        counts = np.bincount(tids, minlength=len(self._names))
+        self.counts = Counter({tid: c for tid, c in enumerate(counts.tolist()) if c})
+
+        by_tag = rows[np.argsort(tids, kind='stable')]
+        ids = np.array(id_list, dtype=object)
+        end = np.cumsum(counts)
+        for tid, c in self.counts.items():
+            self._postings[tid] = set(ids[by_tag[end[tid] - c:end[tid]]].tolist())
+
+        # images with the same tag count share one triangle of pair indexes
+        starts = np.cumsum(lens) - lens
+        uniq = np.empty(0, dtype=np.int64)
+        n = np.empty(0, dtype=np.int64)
+        for k in np.unique(lens[lens > 1]).tolist():
+            lo, hi = np.triu_indices(k, 1)
+            group = starts[lens == k]
+            for i in range(0, len(group), self.rebuild_chunk):
+                block = tids[group[i:i + self.rebuild_chunk, None] + np.arange(k)]
+                keys, c = np.unique(block[:, lo] << 32 | block[:, hi], return_counts=True)
+                uniq, inverse = np.unique(np.concatenate([uniq, keys]), return_inverse=True)
+                n = np.bincount(inverse, weights=np.concatenate([n, c]), minlength=len(uniq)).astype(np.int64)
+        self.cooc = Counter(dict(zip(uniq.tolist(), n.tolist())))
+
+    def update(self, id: str, old: Set[str], new: Set[str]) -> None:
+        # a change that did not go through the log is not undone before a relabel is
+        if self._built:
+            for n, names, moves in self._relabels:
+                if not names.isdisjoint(old ^ new) or any(m[2] is not None and id in m[2] for m in moves):
+                    self._stale.add(n)
+            self._apply(id, old, new, old - new, new - old)
+
+    def _apply(self, id: str, old: Set[str], new: Set[str], removed: Set[str], added: Set[str]) -> None:
+        if not removed and not added:
+            return
+        ids = self._ids
+        removed_ids = set(self._tid(t) for t in removed)
+        added_ids = set(self._tid(t) for t in added)
+
+        # only pairs that include a changed tag move, each pair is counted once
+        if removed_ids:
+            old_ids = [ids[t] for t in old]
+            for r in removed_ids:
+                self.counts[r] -= 1
+                self._postings[r].discard(id)
+                for t in old_ids:
+                    if t != r and (t not in removed_ids or t > r):
+                        self._dec(_pair(r, t))
+        if added_ids:
+            new_ids = [ids[t] for t in new]
+            for a in added_ids:
+                self.counts[a] += 1
+                self._postings.setdefault(a, set()).add(id)
+                for t in new_ids:
+                    if t != a and (t not in added_ids or t > a):
+                        self.cooc[_pair(a, t)] += 1
+
+    def update_many(self, changes: Dict[str, Tuple[Set[str], Set[str]]]) -> None:
+        if not self._built:
+            return
+        diffs = {}
+        for id, (old, new) in changes.items():
+            removed, added = old - new, new - old
+            if removed or added:
+                diffs[id] = (old, new, removed, added)
+        if self._relabel(diffs):
+            return
+        for id, (old, new, removed, added) in diffs.items():
+            self._apply(id, old, new, removed, added)
+
+    def _relabel(self, diffs: Dict[str, Tuple[Set[str], ...]]) -> bool:
+        # renaming a tag on every image that has it, to an unused name, keeps all its pairs
+        if not diffs:
+            return False
+        _, _, removed, added = next(iter(diffs.values()))
+        if len(removed) != 1 or len(added) != 1:
+            return False
+        if any(d[2] != removed or d[3] != added for d in diffs.values()):
+            return False
+        (src,), (dst,) = removed, added
+        tid = self._ids.get(src)
+        if tid is None or self.count(dst) or self.counts[tid] != len(diffs):
+            return False
+        if self._postings.get(tid, set()) != diffs.keys():
+            return False
+        del self._ids[src]
+        self._ids[dst] = tid
+        self._names[tid] = dst
+        return True
+
+    def relabel(self, n: int, sources: List[str], target: str) -> None:
+        # images carrying a source and the target were edited one by one before, what is left is disjoint
+        if not self._built:
+            return
+        moves: List[_Move] = []
+        for src in dict.fromkeys(sources):
+            sid = self._ids.get(src)
+            if sid is None or src == target:
+                continue
+            tid = self._ids.get(target)
+            if tid is None or not self.counts[tid]:
+                # the source keeps its image set and pairs under the new name
+                self._ids.pop(target, None)
+                del self._ids[src]
+                self._ids[target] = sid
+                self._names[sid] = target
+                moves.append((src, sid, None, {}))
+                continue
+            pairs: Dict[int, int] = {}
+            for key in self._pair_keys(sid):
+                other = key >> 32 if key & 0xFFFFFFFF == sid else key & 0xFFFFFFFF
+                n = self.cooc.pop(key)
+                if other != tid:
+                    pairs[other] = n
+                    self.cooc[_pair(tid, other)] += n
+            images = self._postings.pop(sid, set())
+            self._postings.setdefault(tid, set()).update(images)
+            self.counts[tid] += self.counts.pop(sid, 0)
+            del self._ids[src]
+            moves.append((src, sid, images, pairs))
+        self._relabels.append((n, {*sources, target}, moves))
+
+    def unrelabel(self, n: int, sources: List[str], target: str) -> None:
+        if not self._built:
+            return
+        last = self._relabels.pop() if self._relabels else None
+        if last is None or last[0] != n or n in self._stale or not self._restore(target, last[2]):
+            # not the record of this relabel, or changed since in a way it does not cover: counted again from the
+            # images on next use rather than guessed
+            self._built = False
+
+    def _restore(self, target: str, moves: List[_Move]) -> bool:
+        for src, sid, images, pairs in reversed(moves):
+            tid = self._ids.get(target)
+            if tid is None or src in self._ids:
+                return False
+            if images is None:
+                if tid != sid:
+                    return False
+                del self._ids[target]
+                self._ids[src] = sid
+                self._names[sid] = src
+                continue
+            held = self._postings.get(tid, set())
+            if not images <= held or any(self.cooc[_pair(tid, o)] < n for o, n in pairs.items()):
+                return False
+            held -= images
+            self.counts[tid] -= len(images)
+            self.counts[sid] = len(images)
+            self._postings[sid] = images
+            self._ids[src] = sid
+            for other, n in pairs.items():
+                key = _pair(tid, other)
+                self.cooc[key] -= n
+                if not self.cooc[key]:
+                    del self.cooc[key]
+                self.cooc[_pair(sid, other)] = n
+        return True
+
+    def _pair_keys(self, sid: int) -> List[int]:
+        # the pairs of one tag, found through its images when that is cheaper than walking every pair
+        if self._files is not None and self.counts[sid] * 32 < len(self.cooc):
+            ids = self._ids
+            keys = set()
+            for id in self._postings.get(sid, ()):
+                img = self._files.get(id)
+                for t in tag_set(img) if img is not None else ():
+                    other = ids.get(t)
+                    if other is not None and other != sid:
+                        keys.add(_pair(sid, other))
+            return [k for k in keys if k in self.cooc]
+        return [k for k in self.cooc if k >> 32 == sid or k & 0xFFFFFFFF == sid]
+
+    def _dec(self, key: int) -> None:
+        n = self.cooc[key] - 1
+        if n > 0:
+            self.cooc[key] = n
+        else:
+            del self.cooc[key]
+
+    def count(self, tag: str) -> int:
+        self._ensure()
+        tid = self._ids.get(tag)
+        return self.counts[tid] if tid is not None else 0
+
+    def images_with(self, tag: str) -> Set[str]:
+        self._ensure()
+        tid = self._ids.get(tag)
+        return set(self._postings.get(tid, ())) if tid is not None else set()
+
+    def top(self, n: int = 100, text: str = '') -> List[Tuple[str, int]]:
+        self._ensure()
+        t = text.strip().lower()
+        res = ((self._names[tid], c) for tid, c in self.counts.items() if c > 0)
+        if t:
+            res = (r for r in res if t in r[0].lower())
+        return sorted(res, key=lambda r: (-r[1], r[0]))[:n]
+
+    def cooccurring(self, tag: str, n: int = 20) -> List[Tuple[str, int]]:
+        self._ensure()
+        tid = self._ids.get(tag)
+        if tid is None:
+            return []
+        res = []
+        for key, c in self.cooc.items():
+            a, b = key >> 32, key & 0xFFFFFFFF
+            if a == tid:
+                res.append((self._names[b], c))
+            elif b == tid:
+                res.append((self._names[a], c))
+        return sorted(res, key=lambda r: (-r[1], r[0]))[:n]
+
+    def named_counts(self) -> Optional[Dict[str, int]]:
+        # None until counted, a full count of a large folder is not paid for here
+        if not self._built:
+            return None
+        return {self._names[tid]: c for tid, c in self.counts.items() if c > 0}
+
+    def tags(self) -> Iterable[str]:
+        self._ensure()
+        return (self._names[tid] for tid, c in self.counts.items() if c > 0)
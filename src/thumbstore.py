@@ -0,0 +1,195 @@
+from __future__ import annotations
+import io
+import os
+import struct
+from pathlib import Path
+from threading import Lock
+from typing import BinaryIO, Dict, Optional, Tuple, Union
+from PIL import Image
+from .images import MAX_DECODE_BYTES, load_image
+
+THUMB_SIZE = 160
+
+_MAGIC = b'TETHUMB1'
+# the token is also the first 8 bytes of the data file, an index is only used with its own data file
+_HEADER = struct.Struct('<8sH8s')
+_TOKEN = 8
+# offset, length, source size, source mtime_ns, id length; the utf-8 id follows
+_RECORD = struct.Struct('<QIqqH')
+
+Stamp = Tuple[int, int]
+
+
+def file_stamp(path: Path) -> Stamp:
+    st = path.stat()
+    return st.st_size, st.st_mtime_ns
+
+
+def make_thumbnail(
+    source: Union[Path, BinaryIO],
+    size: int = THUMB_SIZE,
+    max_decode_bytes: int = MAX_DECODE_BYTES,
+) -> bytes:
+    image = load_image(source, size, max_decode_bytes)
+    image.thumbnail((size, size), Image.BILINEAR)
+    buf = io.BytesIO()
+    image.save(buf, format='JPEG', quality=85)
+    return buf.getvalue()
+
+
+class ThumbStore:
+    # every thumbnail of a folder in one append-only file, located through an append-only offset index
+    def __init__(self, folder: Path, size: int = THUMB_SIZE):
+        self.data_path = folder / 'thumbs.bin'
+        self.index_path = folder / 'thumbs.idx'
+        self.size = size
+        self.entries: Dict[str, Tuple[int, int, Stamp]] = {}
+        self.dead_bytes = 0
+        self._lock = Lock()
+        self._data: Optional[BinaryIO] = None
+        self._index: Optional[BinaryIO] = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self.entries
+
+    def _load(self) -> None:
+        if not (self.data_path.exists() and self.index_path.exists()):
+            self._reset()
+            return
+        raw = self.index_path.read_bytes()
+        data_size = self.data_path.stat().st_size
+        with self.data_path.open('rb') as f:
+            token = f.read(_TOKEN)
+        if len(raw) < _HEADER.size or len(token) < _TOKEN or _HEADER.unpack_from(raw) != (_MAGIC, self.size, token):
+            self._reset()
+            return
+
+        pos = _HEADER.size
+        live = 0
+        while pos + _RECORD.size <= len(raw):
+            offset, length, size, mtime_ns, n = _RECORD.unpack_from(raw, pos)
+            end = pos + _RECORD.size + n
+            # a torn tail from a crash, or data that never made it to disk
+            if end > len(raw) or offset + length > data_size:
+                break
+            id = raw[pos + _RECORD.size:end].decode('utf-8')
+            old = self.entries.pop(id, None)
+            if old is not None:
+                live -= old[1]
+            if length:
+                self.entries[id] = (offset, length, (size, mtime_ns))
+                live += length
+            pos = end
+        self.dead_bytes = data_size - _TOKEN - live
+        self._open(index_size=pos)
+
+    def _reset(self) -> None:
+        self.entries.clear()
+        self.dead_bytes = 0
+        token = os.urandom(_TOKEN)
+        self.data_path.write_bytes(token)
+        self.index_path.write_bytes(_HEADER.pack(_MAGIC, self.size, token))
+        self._open()
+
+    def _open(self, index_size: Optional[int] = None) -> None:
+        self._data = self.data_path.open('r+b')
+        self._index = self.index_path.open('r+b')
+        if index_size is not None:
+            self._index.truncate(index_size)
+        self._index.seek(0, os.SEEK_END)
+
+    def _append_record(self, id: str, offset: int, length: int, stamp: Stamp) -> None:
+        key = id.encode('utf-8')
+        self._index.write(_RECORD.pack(offset, length, stamp[0], stamp[1], len(key)) + key)
+
+    def get(self, id: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self.entries.get(id)
+            if entry is None or self._data is None:
+                return None
+            offset, length, _ = entry
+            self._data.seek(offset)
+            return self._data.read(length)
+
+    def stamp(self, id: str) -> Optional[Stamp]:
+        entry = self.entries.get(id)
+        return entry[2] if entry is not None else None
+
+    def put(self, id: str, data: bytes, stamp: Stamp) -> None:
+        with self._lock:
+            if self._data is None:
+                return
+            offset = self._data.seek(0, os.SEEK_END)
+            self._data.write(data)
+            # data first, an index record never points past the end of the data file
+            self._data.flush()
+            old = self.entries.get(id)
+            if old is not None:
+                self.dead_bytes += old[1]
+            self.entries[id] = (offset, len(data), stamp)
+            self._append_record(id, offset, len(data), stamp)
+            self._index.flush()
+
+    def rename(self, old_id: str, new_id: str) -> None:
+        with self._lock:
+            entry = self.entries.pop(old_id, None)
+            if entry is None or self._index is None:
+                return
+            self.entries[new_id] = entry
+            self._append_record(new_id, *entry)
+            self._append_record(old_id, 0, 0, (0, 0))
+            self._index.flush()
+
+    def discard(self, id: str) -> None:
+        with self._lock:
+            entry = self.entries.pop(id, None)
+            if entry is None or self._index is None:
+                return
+            self.dead_bytes += entry[1]
+            self._append_record(id, 0, 0, (0, 0))
+            self._index.flush()
+
+    def compact(self) -> None:
+        with self._lock:
+            if self._data is None:
+                return
+            data_tmp = self.data_path.with_suffix('.bin.tmp')
+            index_tmp = self.index_path.with_suffix('.idx.tmp')
+            entries = {}
+            # in offset order, the old file is read front to back
+            ordered = sorted(self.entries.items(), key=lambda kv: kv[1][0])
+            token = os.urandom(_TOKEN)
+            with data_tmp.open('wb') as data, index_tmp.open('wb') as index:
+                data.write(token)
+                index.write(_HEADER.pack(_MAGIC, self.size, token))
+                for id, (offset, length, stamp) in ordered:
+                    self._data.seek(offset)
+                    entries[id] = (data.tell(), length, stamp)
+                    data.write(self._data.read(length))
+                    key = id.encode('utf-8')
+                    index.write(_RECORD.pack(entries[id][0], length, stamp[0], stamp[1], len(key)) + key)
+            self._close_files()
+            # a crash between the two swaps leaves mismatched tokens, the store then starts over
+            data_tmp.replace(self.data_path)
+            index_tmp.replace(self.index_path)
+            self.entries = entries
+            self.dead_bytes = 0
+            self._open()
+
+    def _close_files(self) -> None:
+        for f in (self._data, self._index):
+            if f is not None:
+                f.close()
+        self._data = None
+        self._index = None
+
+    def close(self) -> None:
+        live = sum(e[1] for e in self.entries.values())
+        if self._data is not None and self.dead_bytes > max(live, 1 << 20):
+            self.compact()
+        with self._lock:
+            self._close_files()
@@ -0,0 +1,223 @@
+from __future__ import annotations
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from PySide6.QtCore import QObject, QFileSystemWatcher, QTimer, Signal, Slot
+from .images import IMAGE_EXTS
+
+# (size, mtime_ns, inode), a rename keeps all three
+FileStat = Tuple[int, int, int]
+
+
+def _stat(st: os.stat_result) -> FileStat:
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class FolderWatcher(QObject):
+    created = Signal(Path)
+    modified = Signal(Path)
+    deleted = Signal(Path)
+    renamed = Signal(Path, Path)
+
+    # tracked files stat'ed per sweep tick
+    sweep_batch = 2048
+
+    def __init__(
+        self,
+        root: Path,
+        recursive: bool = True,
+        debounce_ms: int = 500,
+        sweep_ms: int = 1000,
+        parent: Optional[QObject] = None,
+    ):
+        super().__init__(parent)
+        self.root = root
+        self.recursive = recursive
+        self.debounce_ms = debounce_ms
+        # a steady stream of events still gets flushed at least this often
+        self.max_delay = debounce_ms * 5 / 1000
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._on_directory_changed)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._flush)
+        # a write to a file already in a folder changes nothing the directory watch sees, and a watch per file
+        # runs out long before a large folder does; tracked files are re-stat'ed a slice per tick instead
+        self._sweep = QTimer(self)
+        self._sweep.setInterval(sweep_ms)
+        self._sweep.timeout.connect(self._on_sweep)
+        self._sweep_queue: List[Tuple[Path, str]] = []
+        self._files: Dict[Path, Dict[str, FileStat]] = {}
+        self._dirs: Dict[Path, Set[str]] = {}
+        self._dirty: Set[Path] = set()
+        self._first_dirty = 0.0
+        # new or changed files, (new, stat when last seen): announced once a flush finds the stat unchanged,
+        # a file still being written is not reported half done
+        self._settling: Dict[Path, Tuple[bool, FileStat]] = {}
+        # files gone in the last flush, held one more so a move split across two flushes is still a rename
+        self._gone: Dict[FileStat, Path] = {}
+
+    def start(self) -> None:
+        self.stop()
+        self._add_tree(self.root)
+        self._sweep.start()
+
+    def stop(self) -> None:
+        self._timer.stop()
+        self._sweep.stop()
+        watched = self._watcher.directories()
+        if watched:
+            self._watcher.removePaths(watched)
+        self._files.clear()
+        self._dirs.clear()
+        self._dirty.clear()
+        self._settling.clear()
+        self._gone.clear()
+        self._sweep_queue = []
+
+    def _list(self, folder: Path) -> Tuple[Dict[str, FileStat], Set[str]]:
+        files: Dict[str, FileStat] = {}
+        dirs: Set[str] = set()
+        try:
+            with os.scandir(folder) as it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            dirs.add(e.name)
+                        elif e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_EXTS:
+                            files[e.name] = _stat(e.stat())
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return files, dirs
+
+    def _add_tree(self, folder: Path, found: Optional[List[Tuple[Path, FileStat]]] = None) -> None:
+        files, dirs = self._list(folder)
+        self._files[folder] = files
+        self._dirs[folder] = dirs
+        self._watcher.addPath(str(folder))
+        if found is not None:
+            found.extend((folder / name, st) for name, st in files.items())
+        if self.recursive:
+            for name in dirs:
+                self._add_tree(folder / name, found)
+
+    def _drop_tree(self, folder: Path) -> List[Tuple[Path, FileStat]]:
+        if folder not in self._files:
+            return []
+        gone = [(folder / name, st) for name, st in self._files.pop(folder).items()]
+        for name in self._dirs.pop(folder, set()):
+            gone.extend(self._drop_tree(folder / name))
+        self._watcher.removePath(str(folder))
+        return gone
+
+    @Slot()
+    def _on_sweep(self) -> None:
+        if not self._sweep_queue:
+            self._sweep_queue = [(folder, name) for folder, files in self._files.items() for name in files]
+        batch = self._sweep_queue[-self.sweep_batch:]
+        del self._sweep_queue[-self.sweep_batch:]
+        for folder, name in batch:
+            files = self._files.get(folder)
+            if files is None or name not in files:
+                continue
+            try:
+                st = _stat(os.stat(folder / name))
+            except OSError:
+                st = None
+            if st != files[name]:
+                # the flush lists the folder again and sorts out what happened
+                self._on_directory_changed(str(folder))
+
+    @Slot(str)
+    def _on_directory_changed(self, path: str) -> None:
+        if not self._dirty:
+            self._first_dirty = time.monotonic()
+        self._dirty.add(Path(path))
+        if time.monotonic() - self._first_dirty >= self.max_delay:
+            self._timer.start(0)
+        else:
+            self._timer.start(self.debounce_ms)
+
+    @Slot()
+    def _flush(self) -> None:
+        dirty, self._dirty = self._dirty, set()
+        found: List[Tuple[Path, FileStat]] = []
+        changed: List[Tuple[Path, FileStat]] = []
+        deleted: List[Tuple[Path, FileStat]] = []
+
+        for folder in sorted(dirty):
+            if folder not in self._files:
+                continue
+            if not folder.is_dir():
+                deleted.extend(self._drop_tree(folder))
+                continue
+
+            old_files = self._files[folder]
+            files, dirs = self._list(folder)
+            for name, st in files.items():
+                old = old_files.get(name)
+                if old is None:
+                    found.append((folder / name, st))
+                elif old != st:
+                    changed.append((folder / name, st))
+            for name, st in old_files.items():
+                if name not in files:
+                    deleted.append((folder / name, st))
+            self._files[folder] = files
+
+            if self.recursive:
+                old_dirs = self._dirs.get(folder, set())
+                for name in dirs - old_dirs:
+                    self._add_tree(folder / name, found)
+                for name in old_dirs - dirs:
+                    deleted.extend(self._drop_tree(folder / name))
+                self._dirs[folder] = dirs
+
+        # files seen before this flush are done once their stat holds
+        seen = {p for p, _ in found} | {p for p, _ in changed} | {p for p, _ in deleted}
+        settled: List[Tuple[Path, bool]] = []
+        for p, (new, st) in list(self._settling.items()):
+            if p in seen:
+                continue
+            try:
+                now = _stat(os.stat(p))
+            except OSError:
+                # gone, the listing of its folder reports it
+                continue
+            if now == st:
+                del self._settling[p]
+                settled.append((p, new))
+            else:
+                self._settling[p] = (new, now)
+                # the sweep compares against this, it must not report the same write again
+                files = self._files.get(p.parent)
+                if files is not None and p.name in files:
+                    files[p.name] = now
+        for p, st in changed:
+            new = self._settling.get(p, (False, st))[0]
+            self._settling[p] = (new, st)
+
+        # a file that was never announced goes without a word, the rest may come back under another name
+        gone, self._gone = self._gone, {}
+        for p, st in deleted:
+            new = self._settling.pop(p, (False, st))[0]
+            if not new:
+                self._gone[st] = p
+        for p, st in found:
+            src = self._gone.pop(st, None) or gone.pop(st, None)
+            if src is not None:
+                self.renamed.emit(src, p)
+            else:
+                self._settling[p] = (True, st)
+        for p in gone.values():
+            self.deleted.emit(p)
+        for p, new in settled:
+            if new:
+                self.created.emit(p)
+            else:
+                self.modified.emit(p)
+        if self._settling or self._gone:
+            self._timer.start(self.debounce_ms)
@@ -0,0 +1,79 @@
+from __future__ import annotations
+import json
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Optional
+import torch
+from safetensors.torch import load_file, save_file
+
+CACHE_DIR_NAME = '.cache'
+
+
+def dtype_name(dtype: torch.dtype) -> str:
+    return str(dtype).replace('torch.', '')
+
+
+class WeightsCache:
+    def __init__(self, model_dir: Path, dtype: torch.dtype):
+        self.model_dir = model_dir
+        self.dtype = dtype
+        self.dir = model_dir / CACHE_DIR_NAME / f'weights-{dtype_name(dtype)}'
+        self.meta_path = self.dir / 'cache.json'
+        self.weights_path = self.dir / 'model.safetensors'
+
+    def fingerprint(self) -> Dict[str, Any]:
+        # the cache is keyed on every top-level source file, any change invalidates it
+        files = {}
+        for p in sorted(self.model_dir.iterdir()):
+            if p.is_file():
+                st = p.stat()
+                files[p.name] = [st.st_size, st.st_mtime_ns]
+        return {'dtype': dtype_name(self.dtype), 'files': files}
+
+    def is_valid(self) -> bool:
+        if not self.meta_path.exists():
+            return False
+        try:
+            with self.meta_path.open('r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except json.JSONDecodeError:
+            return False
+        return meta == self.fingerprint()
+
+    def begin(self) -> Path:
+        self.invalidate()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        return self.dir
+
+    def commit(self) -> None:
+        # written last, a crash mid-conversion leaves an invalid cache
+        tmp = self.meta_path.with_suffix('.tmp')
+        with tmp.open('w', encoding='utf-8') as f:
+            json.dump(self.fingerprint(), f)
+        tmp.replace(self.meta_path)
+
+    def invalidate(self) -> None:
+        if self.dir.exists():
+            shutil.rmtree(self.dir)
+
+    def save_state_dict(self, state_dict: Dict[str, torch.Tensor]) -> None:
+        self.begin()
+        converted = {}
+        for k, v in state_dict.items():
+            v = v.detach().to('cpu')
+            if v.is_floating_point():
+                v = v.to(self.dtype)
+            # clone so tied weights do not share storage, which safetensors rejects
+            converted[k] = v.contiguous().clone()
+        save_file(converted, str(self.weights_path))
+        self.commit()
+
+    def load_state_dict(self) -> Optional[Dict[str, torch.Tensor]]:
+        if not self.is_valid() or not self.weights_path.exists():
+            return None
+        # safetensors maps the file, tensors are not copied until they are moved to a device
+        return load_file(str(self.weights_path), device='cpu')
+
+
+def has_meta_tensors(module: torch.nn.Module) -> bool:
+    return any(t.is_meta for t in module.parameters()) or any(t.is_meta for t in module.buffers())
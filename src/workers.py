@@ -1,35 +1,76 @@
-from dataclasses import dataclass
+import errno
+import io
+import time
+from dataclasses import dataclass, replace
 from PySide6.QtCore import QObject, Signal, QRunnable
 from queue import Queue, Empty
 from pathlib import Path
-from .images import iter_images
-from .enums import WorkerName
+from threading import Condition, Event
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, UnidentifiedImageError
+from .images import ImageTooLargeError, iter_images_with_sidecars, read_sidecars
+from .storage import snapshot_columns, snapshot_index, write_index
+from .enums import ErrorKind, WorkerName
 from .models import TaskModel
-from typing import List
+from .batching import (
+    BatchSizeStore,
+    BatchTuner,
+    device_key,
+    is_oom,
+    memory_budget,
+    memory_in_use,
+    peak_memory,
+    release_memory,
+    reset_peak_memory,
+)
+from .embeddings import EmbeddingStore
+from .phash import HashIndex, dhash, hash_to_str
+from .prefetch import Prefetcher, read_file
+from .thumbstore import Stamp, ThumbStore, file_stamp, make_thumbnail
+from .workspace import summarize
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
 
 class ScanSignals(QObject):
-    found = Signal(Path)
+    found = Signal(Path, object)
     error = Signal(str, str)
 
 
 class ScanWorker(QRunnable):
-    def __init__(self, folder, recursive=True):
+    def __init__(self, folder, recursive=True, import_workers: int = 8, chunk_size: int = 256):
         super().__init__()
         self.folder = folder
         self.recursive = recursive
+        self.import_workers = import_workers
+        self.chunk_size = chunk_size
         self.signals = ScanSignals()
         self._cancel = False
 
     def cancel(self):
         self._cancel = True
 
+    def _emit_chunk(self, pool: ThreadPoolExecutor, chunk: List[Tuple[Path, Dict[str, Path]]]) -> None:
+        # sidecar reads are I/O bound, a chunk is parsed in parallel and emitted in scan order
+        imported = pool.map(read_sidecars, [sidecars for _, sidecars in chunk])
+        for (p, _), props in zip(chunk, imported):
+            if self._cancel:
+                return
+            self.signals.found.emit(p, props)
+
     def run(self):
         try:
-            for p in iter_images(self.folder, recursive=self.recursive):
-                if self._cancel:
-                    break
-                self.signals.found.emit(p)
+            with ThreadPoolExecutor(max_workers=self.import_workers) as pool:
+                chunk = []
+                for item in iter_images_with_sidecars(self.folder, recursive=self.recursive):
+                    if self._cancel:
+                        break
+                    chunk.append(item)
+                    if len(chunk) >= self.chunk_size:
+                        self._emit_chunk(pool, chunk)
+                        chunk = []
+                if chunk and not self._cancel:
+                    self._emit_chunk(pool, chunk)
             self.signals.error.emit(WorkerName.Scan_Worker, 'Done' if not self._cancel else 'cancel')
         except Exception as e:
             self.signals.error.emit(WorkerName.Scan_Worker, str(e))
@@ -38,57 +79,415 @@ class ScanWorker(QRunnable):
 class AISignals(QObject):
     result = Signal(object)
     error = Signal(str, str)
+    status = Signal(str)
 
 
 @dataclass(frozen=True)
 class ImageTask:
     id: str
     path: Path
+    # stamped by AIWorker.put, tells a task apart from a later one for the same id
+    seq: int = 0
+
+
+TRANSIENT_ERRNOS = {errno.EIO, errno.EAGAIN, errno.EINTR, errno.ETIMEDOUT, errno.EBUSY, errno.ESTALE}
+
+
+def is_transient(e: BaseException) -> bool:
+    if isinstance(e, (TimeoutError, InterruptedError, BlockingIOError, ConnectionError)):
+        return True
+    return isinstance(e, OSError) and e.errno in TRANSIENT_ERRNOS
+
+
+def error_kind(e: BaseException, decoding: bool = False) -> ErrorKind:
+    # only a file that cannot be decoded is worth quarantining, the rest may work on the next run
+    if is_oom(e):
+        return ErrorKind.MODEL
+    if isinstance(e, (ImageTooLargeError, UnidentifiedImageError, Image.DecompressionBombError, SyntaxError)):
+        return ErrorKind.FILE
+    if isinstance(e, OSError):
+        # the bytes are already in memory while decoding, PIL reports broken data as OSError
+        return ErrorKind.FILE if decoding else ErrorKind.IO
+    return ErrorKind.FILE if decoding and isinstance(e, ValueError) else ErrorKind.MODEL
+
+
+def describe_error(e: BaseException) -> str:
+    return f'{type(e).__name__}: {e}'
 
 
 class AIWorker(QRunnable):
-    def __init__(self, models: List[TaskModel], remove_watermark: bool = True):
+    def __init__(
+        self,
+        models: List[TaskModel],
+        remove_watermark: bool = True,
+        hash_index: Optional[HashIndex] = None,
+        dup_distance: int = 4,
+        max_retries: int = 2,
+        retry_delay: float = 0.5,
+        prefetch: Optional[Prefetcher] = None,
+        tune_batches: bool = True,
+        memory_fraction: float = 0.85,
+    ):
         super().__init__()
 
         self.models = models
+        self.hash_index = hash_index
+        self.dup_distance = dup_distance
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # reads upcoming files while the models run, None reads each file when its turn comes
+        self.prefetch = prefetch
         self.signals = AISignals()
         self.running = True
         self.queue: Queue[ImageTask] = Queue()
+        # batch size per model, grown while per-image latency improves and halved on out-of-memory
+        self.tune_batches = tune_batches
+        self.memory_fraction = memory_fraction
+        self.tuners: Dict[str, BatchTuner] = {}
+        # read and hashed, waiting for a near-duplicate in the previous batch to be indexed
+        self._carry: List[Tuple[ImageTask, bytes, Optional[int]]] = []
+        # tasks at or below these sequence numbers were withdrawn, per id and for everything
+        self._seq = 0
+        self._dropped: Dict[str, int] = {}
+        self._cleared = 0
 
     def cancel(self):
         self.running = False
         self.put(None)
+        if self.prefetch is not None:
+            self.prefetch.close()
 
     def run(self):
         try:
             for m in self.models:
+                tuner = self.tuners[m.model_name] = self._make_tuner(m)
+                m.batch_size = tuner.size
+                m.report = self.signals.status.emit
                 m.activate()
-            while self.running:
-                try:
-                    item = self.queue.get(timeout=0.3)
-                    result = []
-                    if item is None:
-                        break
-
-                    for m in self.models:
-                        if not self.running:
-                            break
-                        res = m.process(item.path)
-                        result.append({
-                            'models': m.model_name,
-                            'result': res
-                            })
-                    self.signals.result.emit({
-                        'id': item.id,
-                        'result': result
-                    })
-                except Empty:
+            stop = False
+            while self.running and (not stop or self._carry):
+                items, stop = self._next_items(stop)
+                if not items and not self._carry:
                     continue
+                for res in self._process_items(items):
+                    self.signals.result.emit(res)
             for m in self.models:
                 m.deactivate()
             self.signals.error.emit(WorkerName.AIWorker, 'Done' if self.running else 'cancel')
         except Exception as e:
             self.signals.error.emit(WorkerName.AIWorker, str(e))
 
+    def _make_tuner(self, m: TaskModel) -> BatchTuner:
+        if not self.tune_batches or m.max_batch <= 1:
+            return BatchTuner(1)
+        start = BatchSizeStore(m.model_dir).get(device_key(m.device))
+        return BatchTuner(m.max_batch, start, memory_budget(m.device, self.memory_fraction))
+
+    def _save_tuned(self, m: TaskModel, tuner: BatchTuner) -> None:
+        BatchSizeStore(m.model_dir).put(device_key(m.device), tuner.size)
+        self.signals.status.emit(f'{m.model_name}: batch size {tuner.size} on {device_key(m.device)}')
+
+    def _next_items(self, stop: bool) -> Tuple[List[ImageTask], bool]:
+        # whatever is queued right now, up to the largest batch any model runs
+        limit = max((t.size for t in self.tuners.values()), default=1)
+        items: List[ImageTask] = []
+        while not stop and len(items) + len(self._carry) < limit:
+            try:
+                if items or self._carry:
+                    item = self.queue.get_nowait()
+                else:
+                    item = self.queue.get(timeout=0.3)
+            except Empty:
+                break
+            if item is None:
+                stop = True
+            elif self.is_stale(item.id, item.seq):
+                self._discard(item)
+            else:
+                items.append(item)
+        return items, stop
+
+    def _read_with_retry(self, item: ImageTask) -> bytes:
+        attempt = 0
+        while True:
+            try:
+                return self._read(item)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient(e) or not self.running:
+                    raise
+                time.sleep(self.retry_delay * (2 ** attempt))
+                attempt += 1
+
+    def _read(self, item: ImageTask) -> bytes:
+        # the file is read once, hashing and every model decode from the same buffer
+        if self.prefetch is not None:
+            return self.prefetch.take(item, item.path)
+        return read_file(item.path)
+
+    def _process_items(self, items: List[ImageTask]) -> List[Dict[str, Any]]:
+        # one bad file must not end the worker or the batch, it is reported and skipped
+        results: List[Optional[Dict[str, Any]]] = [None] * (len(self._carry) + len(items))
+        prepared = [(pos, c) for pos, c in enumerate(self._carry) if not self.is_stale(c[0].id, c[0].seq)]
+        self._carry = []
+        for pos, item in enumerate(items, len(results) - len(items)):
+            try:
+                data = self._read_with_retry(item)
+            except Exception as e:
+                results[pos] = self._error(item, e, error_kind(e))
+                continue
+            try:
+                phash = dhash(io.BytesIO(data)) if self.hash_index is not None else None
+            except Exception as e:
+                results[pos] = self._error(item, e, error_kind(e, decoding=True))
+                continue
+            prepared.append((pos, (item, data, phash)))
+
+        ready = []
+        batch_hashes: List[int] = []
+        for pos, (item, data, phash) in prepared:
+            if phash is not None:
+                duplicate = self.hash_index.nearest(phash, self.dup_distance)
+                if duplicate is not None:
+                    results[pos] = self._result(item, [], phash, duplicate[0])
+                    continue
+                if any(bin(phash ^ h).count('1') <= self.dup_distance for h in batch_hashes):
+                    # near an image of this batch, checked again once that one is in the index
+                    self._carry.append((item, data, phash))
+                    continue
+                batch_hashes.append(phash)
+            ready.append((pos, item, data, phash))
+
+        outputs: Dict[int, List[Dict[str, Any]]] = {pos: [] for pos, *_ in ready}
+        failed: Dict[int, BaseException] = {}
+        for m in self.models:
+            if not self.running:
+                break
+            live = [r for r in ready if r[0] not in failed]
+            for (pos, *_), res in zip(live, self._run_model(m, [r[2] for r in live])):
+                if isinstance(res, BaseException):
+                    failed[pos] = res
+                else:
+                    outputs[pos].append({'models': m.model_name, 'result': res})
+
+        for pos, item, _, phash in ready:
+            if pos in failed:
+                results[pos] = self._error(item, failed[pos], error_kind(failed[pos], decoding=True))
+                continue
+            if self.is_stale(item.id, item.seq):
+                # renamed, deleted or from a folder that was closed while it ran
+                continue
+            if phash is not None and self.running:
+                self.hash_index.add(item.id, phash)
+            results[pos] = self._result(item, outputs[pos], phash, None)
+        return [r for r in results if r is not None]
+
+    def _run_model(self, m: TaskModel, datas: List[bytes]) -> List[Any]:
+        # one entry per image, a result or the exception that image raised
+        tuner = self.tuners[m.model_name]
+        out: List[Any] = []
+        pos = 0
+        while pos < len(datas):
+            n = min(tuner.size, len(datas) - pos)
+            chunk = datas[pos:pos + n]
+            try:
+                out.extend(self._timed_batch(m, tuner, chunk))
+                pos += n
+                continue
+            except Exception as e:
+                # the traceback pins the batch tensors, it is dropped before memory is released
+                error = None if is_oom(e) and n > 1 else e.with_traceback(None)
+            release_memory(m.device)
+            if error is None:
+                # the same items again, in smaller batches
+                tuner.oom(n)
+            elif n == 1:
+                out.append(error)
+                pos += 1
+            else:
+                # one undecodable image fails the whole batch, the rest still get results
+                out.extend(self._one_by_one(m, chunk))
+                pos += n
+        return out
+
+    def _timed_batch(self, m: TaskModel, tuner: BatchTuner, chunk: List[bytes]) -> List[Any]:
+        base = memory_in_use(m.device)
+        reset_peak_memory(m.device)
+        t0 = time.perf_counter()
+        res = m.process_batch([io.BytesIO(d) for d in chunk])
+        if tuner.record(len(chunk), time.perf_counter() - t0, base, peak_memory(m.device)):
+            self._save_tuned(m, tuner)
+        return res
+
+    def _one_by_one(self, m: TaskModel, chunk: List[bytes]) -> List[Any]:
+        out: List[Any] = []
+        for d in chunk:
+            try:
+                out.append(m.process_batch([io.BytesIO(d)])[0])
+            except Exception as e:
+                out.append(e.with_traceback(None))
+                release_memory(m.device)
+        return out
+
+    def _result(
+        self,
+        item: ImageTask,
+        result: List[Dict[str, Any]],
+        phash: Optional[int],
+        duplicate_of: Optional[str],
+    ) -> Dict[str, Any]:
+        return {
+            'id': item.id,
+            'seq': item.seq,
+            'result': result,
+            'phash': hash_to_str(phash) if phash is not None else None,
+            'duplicate_of': duplicate_of,
+        }
+
+    def _error(self, item: ImageTask, e: BaseException, kind: ErrorKind) -> Dict[str, Any]:
+        return {'id': item.id, 'seq': item.seq, 'error': describe_error(e), 'error_kind': kind}
+
     def put(self, item: ImageTask):
+        if item is not None:
+            self._seq += 1
+            item = replace(item, seq=self._seq)
+            if self.prefetch is not None:
+                self.prefetch.submit(item, item.path)
         self.queue.put(item)
+
+    def is_stale(self, id: str, seq: int) -> bool:
+        return seq <= self._cleared or seq <= self._dropped.get(id, 0)
+
+    def drop(self, id: str) -> None:
+        # queued or running tasks for this id are skipped and never reach the hash index
+        self._dropped[id] = self._seq
+
+    def clear(self) -> None:
+        # everything put so far is withdrawn, used when the folder changes
+        self._cleared = self._seq
+        self._dropped.clear()
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                return
+            if item is None:
+                # the stop request stays queued
+                self.queue.put(None)
+                return
+            self._discard(item)
+
+    def _discard(self, item: ImageTask) -> None:
+        if self.prefetch is not None:
+            self.prefetch.discard(item)
+
+
+class CompactSignals(QObject):
+    done = Signal(object, str)
+
+
+class CompactWorker(QRunnable):
+    def __init__(self, data: Dict[str, Any], index_path: Path):
+        super().__init__()
+        # a copy_index copy, encoding it is the slow part and happens here
+        self.data = data
+        self.index_path = index_path
+        self.signals = CompactSignals()
+        self.finished = Event()
+        # counted from the copy here, a large folder takes seconds
+        self.summary: Dict[str, Any] = {}
+        # kept alive past run, the controller may still ask the pool for it before the done signal arrives
+        self.setAutoDelete(False)
+
+    def run(self):
+        try:
+            write_index(snapshot_index(self.data), self.index_path, snapshot_columns(self.data))
+            self.summary = summarize(self.data)
+            msg = 'Done'
+        except Exception as e:
+            msg = str(e)
+        self.finished.set()
+        self.signals.done.emit(self.index_path, msg)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.finished.wait(timeout)
+
+
+class IndexSignals(QObject):
+    done = Signal(object, object)
+
+
+class IndexWorker(QRunnable):
+    def __init__(self, store: EmbeddingStore):
+        super().__init__()
+        self.store = store
+        self.signals = IndexSignals()
+
+    def run(self):
+        try:
+            ivf = self.store.build_index()
+        except Exception as e:
+            # the message in place of the index
+            self.signals.done.emit(self.store, describe_error(e))
+            return
+        self.signals.done.emit(self.store, ivf)
+
+
+class ThumbSignals(QObject):
+    ready = Signal(str, bytes)
+    error = Signal(str, str)
+
+
+@dataclass(frozen=True)
+class ThumbTask:
+    id: str
+    path: Path
+    # stamp of the stored thumbnail, it is only regenerated when the original changed
+    stamp: Optional[Stamp] = None
+
+
+class ThumbWorker(QRunnable):
+    def __init__(self, store: ThumbStore):
+        super().__init__()
+        self.store = store
+        self.signals = ThumbSignals()
+        self.running = True
+        self._pending: Deque[Optional[ThumbTask]] = deque()
+        self._cond = Condition()
+
+    def request(self, tasks: List[ThumbTask]) -> None:
+        # the newest request is what is on screen, cells scrolled past are dropped
+        with self._cond:
+            if not self.running:
+                return
+            self._pending = deque(tasks)
+            self._cond.notify()
+
+    def cancel(self):
+        # None is the stop sentinel, it replaces whatever was still pending
+        with self._cond:
+            self.running = False
+            self._pending = deque([None])
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                task = self._pending.popleft()
+            if task is None:
+                return
+            try:
+                stamp = file_stamp(task.path)
+                if stamp == task.stamp:
+                    continue
+                data = make_thumbnail(task.path, self.store.size)
+            except Exception as e:
+                self.signals.error.emit(WorkerName.Thumb_Worker, f'{task.id}: {describe_error(e)}')
+                continue
+            try:
+                self.store.put(task.id, data, stamp)
+            except Exception as e:
+                # a full disk or a closed store, the thumbnail is still shown and made again next time
+                self.signals.error.emit(WorkerName.Thumb_Worker, f'{task.id}: {describe_error(e)}')
+            self.signals.ready.emit(task.id, data)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+import json
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .editlog import EditLog
+from .enums import Fileds
+from .filestore import FileStore
+from .imagefile import ImageFile
+from .storage import load_index
+
+WORKSPACE_PATH = Path.home() / '.tageditor' / 'workspace.json'
+INDEX_NAME = 'tags_index.json'
+LOG_NAME = 'tags_index.log'
+
+
+def summarize(data: Dict[str, Any], tags: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    # tags counted already, by the live tag statistics, are taken as given
+    files = data.get(Fileds.FILES, {})
+    if isinstance(files, FileStore):
+        return {
+            'count': len(files),
+            'status': files.status_counts(),
+            'tags': dict(tags) if tags is not None else files.tag_counts(),
+        }
+    status: Counter = Counter()
+    counted: Counter = Counter()
+    for img in files.values():
+        status[str(img.status)] += 1
+        if tags is None:
+            counted.update(set(img.effective_tags()))
+    return {'count': len(files), 'status': dict(status), 'tags': dict(tags) if tags is not None else dict(counted)}
+
+
+@dataclass
+class RootEntry:
+    key: str
+    path: Path
+    summary: Dict[str, Any] = field(default_factory=dict)
+    updated: float = 0.0
+
+    @property
+    def index_path(self) -> Path:
+        return self.path / INDEX_NAME
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'key': self.key, 'path': self.path.as_posix(), 'summary': self.summary, 'updated': self.updated}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> 'RootEntry':
+        return cls(key=d['key'], path=Path(d['path']), summary=d.get('summary', {}), updated=d.get('updated', 0.0))
+
+
+class Workspace:
+    def __init__(self, path: Path = WORKSPACE_PATH, max_loaded: int = 4):
+        self.path = path
+        self.max_loaded = max_loaded
+        self.roots: Dict[str, RootEntry] = {}
+        # key -> index data, least recently used first
+        self._loaded: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._pinned: Dict[str, Dict[str, Any]] = {}
+        self.load()
+
+    def load(self) -> None:
+        self.roots = {}
+        if not self.path.exists():
+            return
+        try:
+            with self.path.open('r', encoding='utf-8') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            return
+        for d in data.get('roots', []):
+            entry = RootEntry.from_dict(d)
+            self.roots[entry.key] = entry
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+        with tmp.open('w', encoding='utf-8') as f:
+            json.dump({'roots': [r.to_dict() for r in self.roots.values()]}, f, ensure_ascii=False, indent=3)
+        tmp.replace(self.path)
+
+    def register(self, folder: Path) -> RootEntry:
+        folder = folder.resolve()
+        for entry in self.roots.values():
+            if entry.path == folder:
+                return entry
+
+        base = (folder.name or 'root').replace(':', '_')
+        key = base
+        n = 2
+        while key in self.roots:
+            key = f'{base}-{n}'
+            n += 1
+        entry = RootEntry(key=key, path=folder)
+        self.roots[key] = entry
+        self.save()
+        return entry
+
+    def unregister(self, key: str) -> None:
+        self.roots.pop(key, None)
+        self._loaded.pop(key, None)
+        self._pinned.pop(key, None)
+        self.save()
+
+    @staticmethod
+    def qualify(key: str, id: str) -> str:
+        return f'{key}:{id}'
+
+    @staticmethod
+    def split(qid: str) -> Tuple[str, str]:
+        key, _, id = qid.partition(':')
+        return key, id
+
+    def attach(self, key: str, data: Dict[str, Any]) -> None:
+        # the controller's live database, never evicted
+        self._loaded.pop(key, None)
+        self._pinned[key] = data
+
+    def detach(self, key: str) -> None:
+        self._pinned.pop(key, None)
+
+    def index(self, key: str) -> Dict[str, Any]:
+        if key in self._pinned:
+            return self._pinned[key]
+        if key in self._loaded:
+            self._loaded.move_to_end(key)
+            return self._loaded[key]
+
+        entry = self.roots[key]
+        data = load_index(entry.index_path)
+        EditLog(entry.path / LOG_NAME).replay(data[Fileds.FILES], data.get('log_seq', 0))
+        self._loaded[key] = data
+        while len(self._loaded) > self.max_loaded:
+            self._loaded.popitem(last=False)
+        return data
+
+    def update_summary(self, key: str, summary: Dict[str, Any]) -> None:
+        entry = self.roots.get(key)
+        if entry is None:
+            return
+        entry.summary = summary
+        entry.updated = time.time()
+        self.save()
+
+    def stats(self, live: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+        # live holds up to date summaries of pinned roots, the controller has their tags counted already
+        live = live or {}
+        status: Counter = Counter()
+        tags: Counter = Counter()
+        count = 0
+        for key, entry in self.roots.items():
+            summary = live.get(key)
+            if summary is None:
+                summary = summarize(self._pinned[key]) if key in self._pinned else entry.summary
+            count += summary.get('count', 0)
+            status.update(summary.get('status', {}))
+            tags.update(summary.get('tags', {}))
+        return {'roots': len(self.roots), 'count': count, 'status': dict(status), 'tags': tags}
+
+    def iter_images(self) -> Iterator[Tuple[str, ImageFile]]:
+        # roots are paged in one at a time through the LRU, so memory stays bounded
+        for key in list(self.roots):
+            if not self.roots[key].index_path.exists() and key not in self._pinned:
+                continue
+            for id, img in self.index(key).get(Fileds.FILES, {}).items():
+                yield self.qualify(key, id), img
+
+    def search(self, text: str, limit: int = 500) -> List[Tuple[str, ImageFile]]:
+        t = text.strip().lower()
+        if not t:
+            return []
+        res: List[Tuple[str, ImageFile]] = []
+        for qid, img in self.iter_images():
+            if t in qid.lower() or any(t == tag.lower() for tag in img.effective_tags()):
+                res.append((qid, img))
+                if len(res) >= limit:
+                    break
+        return res
+
+    def root_of(self, qid: str) -> Optional[RootEntry]:
+        return self.roots.get(self.split(qid)[0])
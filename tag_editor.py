@@ -1,3 +1,4 @@
+import argparse
 import sys
 from pathlib import Path
 from PySide6.QtGui import QAction, QKeySequence
@@ -18,14 +19,14 @@ from src.mainpage import MainPage
 
 class MainWindow(QMainWindow):
 
-    def __init__(self) -> None:
+    def __init__(self, optimize: bool = False) -> None:
         super().__init__()
         self.setWindowTitle('TagEditor')
         self.resize(1150, 720)
 
         self.stack = QStackedWidget()
         self.home = HomePage()
-        self.main = MainPage()
+        self.main = MainPage(optimize)
         self.stack.addWidget(self.home)
         self.stack.addWidget(self.main)
         self.setCentralWidget(self.stack)
@@ -61,9 +62,19 @@ class MainWindow(QMainWindow):
 
         save_shortcut = QAction(self)
         save_shortcut.setShortcut(QKeySequence.Save)
-        save_shortcut.triggered.connect(lambda: self.main._ui_save_only())
+        save_shortcut.triggered.connect(lambda: self.main._on_save())
         self.addAction(save_shortcut)
 
+        undo_shortcut = QAction(self)
+        undo_shortcut.setShortcut(QKeySequence.Undo)
+        undo_shortcut.triggered.connect(lambda: self.main._on_undo())
+        self.addAction(undo_shortcut)
+
+        redo_shortcut = QAction(self)
+        redo_shortcut.setShortcut(QKeySequence.Redo)
+        redo_shortcut.triggered.connect(lambda: self.main._on_redo())
+        self.addAction(redo_shortcut)
+
         # Wire home page
         self.home.browse_btn.clicked.connect(self.choose_folder)
         self.home.open_btn.clicked.connect(self.open_from_home)
@@ -72,6 +83,7 @@ class MainWindow(QMainWindow):
         # Improve preview resizing behavior
         self.main.preview_scroll.viewport().installEventFilter(self.main)
         self.main.status.connect(self.on_status)
+        self.main.open_folder.connect(self._open_folder)
 
     def go_home(self) -> None:
         self.stack.setCurrentWidget(self.home)
@@ -102,8 +114,12 @@ class MainWindow(QMainWindow):
 
 
 def main() -> int:
-    app = QApplication(sys.argv)
-    w = MainWindow()
+    parser = argparse.ArgumentParser(description='TagEditor')
+    # off by default: compiling takes a while on the first run and needs a working compiler toolchain
+    parser.add_argument('--optimize', action='store_true', help='compile the tagger and use channels-last inference')
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+    w = MainWindow(args.optimize)
     app.aboutToQuit.connect(w.main.on_shutdown)
     w.show()
     return app.exec()